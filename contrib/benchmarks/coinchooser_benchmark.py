@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+'''Measure coin selection speed and the quality of the transactions it builds.
+
+For each synthetic UTXO distribution and wallet size, payments of a few fractions of the
+wallet's value are made with each coin chooser, and with --wallet also with the wallet's
+own make_unsigned_transaction().  The distributions are:
+
+    dust      most coins are dust, each at its own address
+    whales    mostly modest coins and 1% large ones, each at its own address
+    reuse     coins of widely varying value concentrated on few addresses
+    coinbase  equal coinbase outputs paid to a handful of mining addresses
+
+For every payment the selection time (the best of --repeat runs), input count, fee, fee rate,
+fee paid beyond the estimate, and change outputs are recorded, along with whether the
+change is in the range CoinChooserPrivacy prefers and whether every coin of each spent
+address was spent.  Selection is deterministic, so outcomes can be compared across changes.
+
+Chooser runs use P2PKH coins at synthetic addresses.  Wallet runs use an imported private
+key wallet of --wallet-keys keys, so their coins are spread across at most that many
+addresses, and include adding the wallet's key information to each coin.
+
+Usage:
+    contrib/benchmarks/coinchooser_benchmark.py [--json] [--repeat N] [--wallet]
+        [--choosers NAME,NAME...] [--distributions NAME,NAME...] [--wallet-keys N] [sizes...]
+
+The default sizes are 1000 and 10000 coins, timed once each.  With --json a machine readable
+list of results is written to stdout instead of a table.
+'''
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from bitcoinx import PrivateKey, sha256
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrumsv import coinchooser
+from electrumsv.address import Address
+from electrumsv.app_state import AppStateProxy
+from electrumsv.bitcoin import COIN
+from electrumsv.crypto import hash_160
+from electrumsv.simple_config import SimpleConfig
+from electrumsv.storage import WalletStorage
+from electrumsv.transaction import XTxInput
+from electrumsv.wallet import ImportedPrivkeyWallet, UTXO
+
+
+FEE_PER_KB = 1000
+DUST_THRESHOLD = 546
+# Payments are these fractions of the wallet's value
+PAYMENT_FRACTIONS = (0.001, 0.05, 0.5)
+CHOOSERS = ('CoinChooserPrivacy', 'CoinChooserBranchAndBound')
+PUBKEY_HEX = PrivateKey(sha256(b'coinchooser benchmark')).public_key.to_hex()
+
+
+def dust_coins(rnd, count):
+    '''Returns a list of (value, address index, is_coinbase) triples.'''
+    return [(rnd.randrange(DUST_THRESHOLD, 3_000) if rnd.random() < 0.9
+             else rnd.randrange(10_000, 1_000_000), n, False) for n in range(count)]
+
+
+def whale_coins(rnd, count):
+    return [(rnd.randrange(10 * COIN, 50 * COIN) if rnd.random() < 0.01
+             else rnd.randrange(100_000, 1_000_000), n, False) for n in range(count)]
+
+
+def reuse_coins(rnd, count):
+    address_count = max(1, count // 50)
+    return [(int(rnd.lognormvariate(12, 2)) + DUST_THRESHOLD, rnd.randrange(address_count),
+             False) for _n in range(count)]
+
+
+def coinbase_coins(rnd, count):
+    return [(12 * COIN + COIN // 2, rnd.randrange(5), True) for _n in range(count)]
+
+
+DISTRIBUTIONS = {
+    'dust': dust_coins,
+    'whales': whale_coins,
+    'reuse': reuse_coins,
+    'coinbase': coinbase_coins,
+}
+
+
+def synthetic_address(n):
+    return Address.from_P2PKH_hash(hash_160(b'coinchooser benchmark' + n.to_bytes(4, 'little')))
+
+
+def chooser_coins(coin_specs):
+    coins = []
+    for n, (value, address_index, _is_coinbase) in enumerate(coin_specs):
+        coin = XTxInput(sha256(n.to_bytes(4, 'little')), n % 4, value=value,
+                        address=synthetic_address(address_index))
+        coin.type = 'p2pkh'
+        coin.x_pubkeys = [PUBKEY_HEX]
+        coin.pubkeys = [PUBKEY_HEX]
+        coin.num_sig = 1
+        coin.signatures = [None]
+        coins.append(coin)
+    return coins
+
+
+def wallet_coins(wallet, coin_specs):
+    addresses = wallet.get_receiving_addresses()
+    coins = []
+    for n, (value, address_index, is_coinbase) in enumerate(coin_specs):
+        address = addresses[address_index % len(addresses)]
+        coins.append(UTXO(value=value, script_pubkey=address.to_script(),
+                          tx_hash=sha256(n.to_bytes(4, 'little')).hex(), out_index=n % 4,
+                          height=100, address=address, is_coinbase=is_coinbase))
+    return coins
+
+
+def fee_estimator(size):
+    return size * FEE_PER_KB // 1000
+
+
+def best_time(repeat, func, *args):
+    best = None
+    for _n in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return round(best, 4), result
+
+
+def outcome(tx, coins, amount, change_addrs):
+    '''Return a dictionary describing the quality of a transaction paying amount.'''
+    size = tx.estimated_size()
+    fee = tx.get_fee()
+    change = [value for address, value in tx.outputs() if address in change_addrs]
+    spent_addresses = {txin.address for txin in tx.inputs()}
+    return {
+        'inputs': len(tx.inputs()),
+        'size': size,
+        'fee': fee,
+        'fee_rate': round(fee / size, 3),
+        'excess_fee': fee - fee_estimator(size),
+        'change_outputs': len(change),
+        'change': sum(change),
+        # The range CoinChooserPrivacy does not penalize
+        'change_in_range': bool(change) and amount * 0.75 <= sum(change) <= amount * 1.33,
+        'addresses_fully_spent': (len(tx.inputs()) ==
+                                  sum(coin.address in spent_addresses for coin in coins)),
+    }
+
+
+def run_benchmark(distribution, size, chooser_names, wallet, config, repeat):
+    coin_specs = DISTRIBUTIONS[distribution](random.Random(size), size)
+    coins = chooser_coins(coin_specs)
+    total = sum(value for value, _address_index, _is_coinbase in coin_specs)
+    pay_to = synthetic_address(size + 1)
+    change_addr = synthetic_address(size + 2)
+
+    results = []
+    for fraction in PAYMENT_FRACTIONS:
+        amount = int(total * fraction)
+        outputs = [(pay_to, amount)]
+        runs = {}
+        for name in chooser_names:
+            chooser_class = getattr(coinchooser, name)
+            seconds, tx = best_time(repeat, chooser_class().make_tx, coins, list(outputs),
+                                    [change_addr], fee_estimator, DUST_THRESHOLD)
+            runs[name] = {'seconds': seconds, **outcome(tx, coins, amount, {change_addr})}
+        if wallet:
+            utxos = wallet_coins(wallet, coin_specs)
+            seconds, tx = best_time(repeat, wallet.make_unsigned_transaction, utxos,
+                                    list(outputs), config, None, change_addr)
+            runs['wallet'] = {'seconds': seconds, **outcome(tx, utxos, amount, {change_addr})}
+        results.append({'distribution': distribution, 'coins': size,
+                        'addresses': len({coin.address for coin in coins}),
+                        'amount': amount, 'runs': runs})
+    return results
+
+
+def make_wallet(data_dir, key_count):
+    keys = [PrivateKey(sha256(b'coinchooser benchmark wallet' + n.to_bytes(4, 'little')))
+            for n in range(key_count)]
+    storage = WalletStorage(os.path.join(data_dir, 'wallet'))
+    return ImportedPrivkeyWallet.from_text(storage, ' '.join(key.to_WIF() for key in keys))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('sizes', nargs='*', type=int, default=[1000, 10000],
+                        help='wallet sizes in coins')
+    parser.add_argument('--choosers', default=','.join(CHOOSERS),
+                        help='comma-separated coin chooser class names')
+    parser.add_argument('--distributions', default=','.join(DISTRIBUTIONS),
+                        help='comma-separated UTXO distributions')
+    parser.add_argument('--wallet', action='store_true',
+                        help="also time the wallet's make_unsigned_transaction()")
+    parser.add_argument('--wallet-keys', type=int, default=100,
+                        help='keys in the wallet used for wallet runs')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='time the best of this many runs')
+    parser.add_argument('--json', action='store_true', help='write results as JSON')
+    args = parser.parse_args()
+    chooser_names = args.choosers.split(',')
+
+    data_dir = tempfile.mkdtemp()
+    try:
+        config = SimpleConfig({'electrum_sv_path': data_dir, 'fee_per_kb': FEE_PER_KB})
+        AppStateProxy(config, 'cmdline')
+        wallet = make_wallet(data_dir, args.wallet_keys) if args.wallet else None
+        all_results = []
+        for distribution in args.distributions.split(','):
+            for size in args.sizes:
+                results = run_benchmark(distribution, size, chooser_names, wallet, config,
+                                        args.repeat)
+                all_results.extend(results)
+                if args.json:
+                    continue
+                for result in results:
+                    print(f'{distribution} {size:,d} coins at {result["addresses"]:,d} '
+                          f'addresses paying {result["amount"]:,d}')
+                    for name, run in result['runs'].items():
+                        print(f'    {name:<28} {run["seconds"]:>8.3f}s  '
+                              f'{run["inputs"]:>6,d} inputs  fee {run["fee"]:>8,d} '
+                              f'({run["fee_rate"]:.2f}/byte, +{run["excess_fee"]:,d})  '
+                              f'change {run["change"]:>13,d} in {run["change_outputs"]}'
+                              f'{"  in range" if run["change_in_range"] else ""}'
+                              f'{"" if run["addresses_fully_spent"] else "  PARTIAL"}')
+    finally:
+        shutil.rmtree(data_dir)
+    if args.json:
+        json.dump(all_results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
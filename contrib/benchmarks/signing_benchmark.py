@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+'''Measure the cost of signing transactions with many inputs.
+
+For each input count an unsigned transaction spending that many P2PKH coins of a single key
+is built and timed through three stages: computing every input's sighash preimage, the same
+recomputing the hashes common to every preimage for each input (as was done before they were
+cached, and which is quadratic in the input count), and a full sign() for each process
+count given with --processes.
+
+Usage:
+    contrib/benchmarks/signing_benchmark.py [--json] [--uncached-limit N]
+        [--processes N,N...] [sizes...]
+
+The default sizes are 10, 100, 1000 and 5000 inputs.  The uncached stage is skipped for
+transactions with more than --uncached-limit inputs, 1000 by default.  Signing is timed with
+1 and os.cpu_count() processes by default; transactions with fewer inputs than
+PARALLEL_SIGNING_MIN_INPUTS are always signed in-process.
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from bitcoinx import PrivateKey, sha256
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrumsv.address import Address
+from electrumsv.transaction import Transaction
+
+
+PRIVATE_KEY = PrivateKey(sha256(b'signing benchmark'))
+PUBLIC_KEY_HEX = PRIVATE_KEY.public_key.to_hex()
+ADDRESS = Address.from_string(PRIVATE_KEY.public_key.to_address().to_string())
+
+
+def unsigned_transaction(input_count):
+    inputs = [{
+        'type': 'p2pkh',
+        'address': ADDRESS,
+        'prevout_hash': sha256(n.to_bytes(4, 'little')).hex(),
+        'prevout_n': n % 4,
+        'value': 10_000,
+        'sequence': 0xffffffff - 1,
+        'x_pubkeys': [PUBLIC_KEY_HEX],
+        'pubkeys': [PUBLIC_KEY_HEX],
+        'signatures': [None],
+        'num_sig': 1,
+    } for n in range(input_count)]
+    outputs = [(ADDRESS, input_count * 10_000 - input_count * 200)]
+    return Transaction.from_io(inputs, outputs)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return round(time.perf_counter() - start, 4)
+
+
+def uncached_preimages(tx):
+    for n in range(len(tx.inputs())):
+        tx.invalidate_sighash_context()
+        tx.serialize_preimage(n)
+
+
+def run_benchmark(input_count, uncached_limit, process_counts):
+    results = {'inputs': input_count}
+    results['preimages_seconds'] = timed(unsigned_transaction(input_count).serialize_preimages)
+    if input_count <= uncached_limit:
+        results['uncached_preimages_seconds'] = timed(uncached_preimages,
+                                                      unsigned_transaction(input_count))
+    keypairs = {PUBLIC_KEY_HEX: (PRIVATE_KEY.to_bytes(), True)}
+    results['sign_seconds'] = {}
+    for processes in process_counts:
+        tx = unsigned_transaction(input_count)
+        results['sign_seconds'][processes] = timed(tx.sign, keypairs, processes)
+        assert tx.is_complete()
+    serial_seconds = results['sign_seconds'][process_counts[0]]
+    results['sign_per_input_ms'] = round(serial_seconds * 1000 / input_count, 4)
+    results['sign_speedup'] = {processes: round(serial_seconds / seconds, 2) if seconds else None
+                               for processes, seconds in results['sign_seconds'].items()}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('sizes', nargs='*', type=int, default=[10, 100, 1000, 5000],
+                        help='transaction sizes in inputs')
+    parser.add_argument('--uncached-limit', type=int, default=1000,
+                        help='largest input count to time without the sighash cache')
+    parser.add_argument('--processes', default=f'1,{os.cpu_count() or 1}',
+                        help='comma-separated process counts to sign with')
+    parser.add_argument('--json', action='store_true', help='write results as JSON')
+    args = parser.parse_args()
+    process_counts = sorted(set(int(count) for count in args.processes.split(',')))
+
+    all_results = []
+    for size in args.sizes:
+        results = run_benchmark(size, args.uncached_limit, process_counts)
+        all_results.append(results)
+        if not args.json:
+            uncached = results.get('uncached_preimages_seconds')
+            uncached = f'{uncached:>9.3f}s' if uncached is not None else f'{"-":>10}'
+            print(f'{size:>6,d} inputs: preimages {results["preimages_seconds"]:>8.3f}s  '
+                  f'uncached {uncached}  ({results["sign_per_input_ms"]:.3f}ms per signature)')
+            for processes, seconds in results['sign_seconds'].items():
+                print(f'    sign with {processes:>3d} processes {seconds:>8.3f}s  '
+                      f'speedup {results["sign_speedup"][processes]:>5.2f}x')
+    if args.json:
+        json.dump(all_results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+'''Measure wallet synchronisation throughput against an in-process fake ElectrumX server.
+
+For each wallet size a synthetic dataset is generated and served locally, and an SVSession
+is driven through the stages of a sync: header catch-up, script hash subscription (which
+fetches the history of every address with a status), resubscription as after a restart,
+transaction fetch with a hash check and parse, and merkle proof verification.  No network
+access is needed.
+
+Usage:
+    contrib/benchmarks/sync_benchmark.py [--json] [--txs-per-block N] [sizes...]
+
+The default sizes are 1000, 10000 and 100000 addresses.  With --json a machine readable
+list of results is written to stdout instead of a table.
+'''
+
+import argparse
+from functools import partial
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from aiorpcx import TaskGroup
+from bitcoinx import Headers, double_sha256, hash_to_hex_str, hex_str_to_hash
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from electrumsv.app_state import app_state, AppStateProxy
+from electrumsv.bitcoin import history_status
+from electrumsv.network import SVServer, SVSession, _root_from_proof
+from electrumsv.networks import Net
+from electrumsv.simple_config import SimpleConfig
+from electrumsv.tests.fake_electrumx import FakeElectrumX, SyntheticDataset
+from electrumsv.transaction import Transaction
+
+
+class BenchmarkWallet:
+    '''The parts of the wallet interface SVSession uses when subscribing.'''
+
+    def __init__(self):
+        self.request_count = 0
+        self.response_count = 0
+        self.progress_event = app_state.async_.event()
+        self.histories = {}
+
+    def get_address_history(self, address):
+        return self.histories.get(address, [])
+
+    def get_address_status(self, address):
+        return history_status(self.get_address_history(address))
+
+    async def set_address_history(self, address, history, tx_fees):
+        self.histories[address] = history
+
+    def __str__(self):
+        return 'benchmark wallet'
+
+
+class BenchmarkNetwork:
+    '''The parts of the network interface SVSession uses outside of SVSession.run().'''
+
+    def __init__(self):
+        self.check_main_chain_event = app_state.async_.event()
+
+    def trigger_callback(self, event, *args):
+        pass
+
+
+class Stage:
+
+    def __init__(self, name, results):
+        self.name = name
+        self.results = results
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self.start
+
+    def record(self, count):
+        self.results[self.name] = {
+            'count': count,
+            'seconds': round(self.seconds, 4),
+            'per_sec': round(count / self.seconds, 1) if self.seconds else None,
+        }
+
+
+async def _run_stages(dataset, results):
+    async with FakeElectrumX(dataset) as server:
+        sv_server = SVServer.unique(server.host, server.port, 't')
+        session_factory = partial(SVSession, BenchmarkNetwork(), sv_server,
+                                  sv_server._logger(0))
+        async with sv_server._connector(session_factory, proxy=None) as session:
+            await session._negotiate_protocol()
+
+            with Stage('headers', results) as stage:
+                await session._subscribe_headers()
+            stage.record(dataset.height)
+
+            wallet = BenchmarkWallet()
+            pairs = list(zip(dataset.addresses, dataset.script_hashes))
+            with Stage('subscribe_and_history', results) as stage:
+                await session.subscribe_to_pairs(wallet, pairs)
+            stage.record(len(pairs))
+            assert len(wallet.histories) == len(pairs)
+
+            # A warm restart: resubscribe with every address already up to date
+            SVSession.unsubscribe_wallet(wallet)
+            with Stage('resubscribe', results) as stage:
+                await session.subscribe_to_pairs(wallet, pairs)
+            stage.record(len(pairs))
+
+            tx_heights = {tx_hash: height for history in wallet.histories.values()
+                          for tx_hash, height in history}
+            with Stage('tx_fetch', results) as stage:
+                async with TaskGroup() as group:
+                    tasks = {}
+                    for tx_hash in tx_heights:
+                        tasks[await group.spawn(session.request_tx(tx_hash))] = tx_hash
+                    async for task in group:
+                        # As the wallet does: check the hash, then parse once
+                        tx_bytes = bytes.fromhex(task.result())
+                        assert hash_to_hex_str(double_sha256(tx_bytes)) == tasks[task]
+                        Transaction(tx_bytes).inputs()
+            stage.record(len(tx_heights))
+
+            with Stage('proof_verify', results) as stage:
+                headers = await session.headers_at_heights(tx_heights.values())
+                async with TaskGroup() as group:
+                    tasks = {}
+                    for tx_hash, height in tx_heights.items():
+                        tasks[await group.spawn(session.request_proof(tx_hash, height))] = tx_hash
+                    async for task in group:
+                        tx_hash = tasks[task]
+                        result = task.result()
+                        branch = [hex_str_to_hash(item) for item in result['merkle']]
+                        root = _root_from_proof(hex_str_to_hash(tx_hash), branch, result['pos'])
+                        assert root == headers[tx_heights[tx_hash]].merkle_root
+            stage.record(len(tx_heights))
+        SVSession.unsubscribe_wallet(wallet)
+        SVSession._address_map.clear()
+        results['server_bytes_served'] = server.bytes_served
+
+
+def run_benchmark(address_count, txs_per_block):
+    results = {'addresses': address_count, 'txs_per_block': txs_per_block}
+    start = time.perf_counter()
+    dataset = SyntheticDataset(address_count, txs_per_block=txs_per_block)
+    results['dataset_seconds'] = round(time.perf_counter() - start, 4)
+
+    data_dir = tempfile.mkdtemp()
+    prior_net = Net._net
+    Net.set_to(dataset.net)
+    try:
+        AppStateProxy(SimpleConfig({'electrum_sv_path': data_dir}), 'cmdline')
+        app_state.headers = Headers.from_file(dataset.coin, os.path.join(data_dir, 'headers'),
+                                              dataset.checkpoint)
+        with app_state.async_:
+            app_state.async_.spawn_and_wait(_run_stages, dataset, results)
+    finally:
+        Net.set_to(prior_net)
+        shutil.rmtree(data_dir)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('sizes', nargs='*', type=int, default=[1000, 10000, 100000],
+                        help='wallet sizes in addresses')
+    parser.add_argument('--txs-per-block', type=int, default=500,
+                        help='transactions per synthetic block; lower it to sync more headers')
+    parser.add_argument('--json', action='store_true', help='write results as JSON')
+    args = parser.parse_args()
+
+    all_results = []
+    for size in args.sizes:
+        results = run_benchmark(size, args.txs_per_block)
+        all_results.append(results)
+        if not args.json:
+            print(f'{size:,d} addresses (dataset built in {results["dataset_seconds"]}s)')
+            for stage in ('headers', 'subscribe_and_history', 'resubscribe', 'tx_fetch',
+                          'proof_verify'):
+                item = results[stage]
+                print(f'    {stage:<24} {item["count"]:>9,d} in {item["seconds"]:>8.3f}s  '
+                      f'{item["per_sec"]:>10,.1f}/s')
+    if args.json:
+        json.dump(all_results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -25,9 +25,12 @@
 # Many of the functions in this file are copied from ElectrumX
 
 from collections import namedtuple
+from functools import reduce
+from operator import xor
+from weakref import WeakValueDictionary
 
 from bitcoinx import (
-    Ops, PublicKey, base58_decode_check, base58_encode_check, hash_to_hex_str, cashaddr,
+    Ops, PublicKey, base58_decode_check, double_sha256, hash_to_hex_str, cashaddr,
     push_item, Script, P2PKH_Address, P2SH_Address
 )
 
@@ -50,6 +53,168 @@ def to_bytes(x):
     raise TypeError('{} is not bytes ({})'.format(x, type(x)))
 
 
+# Bulk codecs.  These encode and decode lists of strings in one call, using precomputed
+# tables in place of the per-character work of the bitcoinx codecs.
+
+_B58_CHARS = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+# ASCII code -> base58 digit, or 255 for characters not in base58
+_B58_DIGITS = bytes(_B58_CHARS.find(chr(code)) % 256 for code in range(256))
+# Every pair of base58 characters, indexed by the value of the pair
+_B58_PAIRS = [first + second for first in _B58_CHARS for second in _B58_CHARS]
+
+
+def base58_decode_check_many(strings):
+    '''Decode Base58Check strings.  Returns a list of the payload of each string, or None
+    where a string is not valid Base58Check.'''
+    digit_table = _B58_DIGITS
+    result = []
+    append = result.append
+    for string in strings:
+        digits = string.encode('ascii', 'replace').translate(digit_table)
+        if not digits or 255 in digits:
+            append(None)
+            continue
+        value = 0
+        for digit in digits:
+            value = value * 58 + digit
+        # Each leading '1' is a leading zero byte
+        zeros = len(string) - len(string.lstrip('1'))
+        raw = value.to_bytes((value.bit_length() + 7) // 8 + zeros, 'big')
+        payload = raw[:-4]
+        append(payload if double_sha256(payload)[:4] == raw[-4:] else None)
+    return result
+
+
+def base58_encode_check_many(payloads):
+    '''Encode payloads, including their version bytes, as Base58Check strings.'''
+    pairs = _B58_PAIRS
+    result = []
+    append = result.append
+    for payload in payloads:
+        raw = bytes(payload) + double_sha256(payload)[:4]
+        value = int.from_bytes(raw, 'big')
+        chunks = []
+        while value:
+            value, pair = divmod(value, 3364)
+            chunks.append(pairs[pair])
+        chunks.reverse()
+        zeros = len(raw) - len(raw.lstrip(b'\0'))
+        append('1' * zeros + ''.join(chunks).lstrip('1'))
+    return result
+
+
+_CASHADDR_CHARS = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+_CASHADDR_CHAR_SET = frozenset(_CASHADDR_CHARS)
+# Cashaddr characters -> the base 32 digits int() understands
+_CASHADDR_TO_BASE32 = str.maketrans(_CASHADDR_CHARS, '0123456789abcdefghijklmnopqrstuv')
+# Every pair of cashaddr characters, indexed by the 10-bit value of the pair
+_CASHADDR_PAIRS = [first + second for first in _CASHADDR_CHARS for second in _CASHADDR_CHARS]
+# The payload of a hash160 is 34 5-bit symbols followed by 8 of checksum, 210 bits in all,
+# which is 27 bytes as an integer
+_CASHADDR_SYMBOLS = 42
+_CASHADDR_BYTES = 27
+# The checksum feedback of the top 5 bits of the polymod state
+_CASHADDR_FEEDBACK = [
+    reduce(xor, (generator for bit, generator in enumerate((
+        0x98f2bc8e61, 0x79b76d99e2, 0xf33e5fb3c4, 0xae2eabe2a8, 0x1e4f43e470))
+                 if top & (1 << bit)), 0)
+    for top in range(32)
+]
+
+
+def _cashaddr_polymod(state, values):
+    for value in values:
+        state = ((state & 0x07ffffffff) << 5) ^ value ^ _CASHADDR_FEEDBACK[state >> 35]
+    return state
+
+
+def _cashaddr_checksum_tables():
+    '''The polymod of a payload is linear in its bits.  For each byte of the payload as an
+    integer, return a table of what each value of the byte contributes to the polymod.'''
+    bits = _CASHADDR_SYMBOLS * 5
+    contributions = [
+        _cashaddr_polymod(0, [(1 << bit) >> (5 * (_CASHADDR_SYMBOLS - 1 - n)) & 31
+                              for n in range(_CASHADDR_SYMBOLS)])
+        for bit in range(bits)
+    ]
+    tables = []
+    for index in range(_CASHADDR_BYTES):
+        table = [0] * 256
+        for byte in range(1, 256):
+            bit = 8 * (_CASHADDR_BYTES - 1 - index) + (byte & -byte).bit_length() - 1
+            table[byte] = table[byte & (byte - 1)] ^ (contributions[bit] if bit < bits else 0)
+        tables.append(table)
+    return tables
+
+
+_CASHADDR_TABLES = _cashaddr_checksum_tables()
+# prefix -> the polymod contributions of a valid payload XOR to
+_cashaddr_targets = {}
+
+
+def _cashaddr_target(prefix):
+    target = _cashaddr_targets.get(prefix)
+    if target is None:
+        state = _cashaddr_polymod(1, [ord(c) & 0x1f for c in prefix] + [0])
+        target = _cashaddr_targets[prefix] = (
+            _cashaddr_polymod(state, bytes(_CASHADDR_SYMBOLS)) ^ 1)
+    return target
+
+
+def cashaddr_decode_many(strings, prefix):
+    '''Decode cashaddr strings of hash160s, with or without the lower case prefix.  Returns
+    a list of the (kind, hash160) pair of each string, or None where a string is invalid.'''
+    tables = _CASHADDR_TABLES
+    target = _cashaddr_target(prefix)
+    char_set = _CASHADDR_CHAR_SET
+    to_base32 = _CASHADDR_TO_BASE32
+    full_prefix = prefix + ':'
+    result = []
+    append = result.append
+    for string in strings:
+        payload = string.lower()
+        if payload != string and string.upper() != string:
+            append(None)
+            continue
+        if payload.startswith(full_prefix):
+            payload = payload[len(full_prefix):]
+        if len(payload) != _CASHADDR_SYMBOLS or not char_set.issuperset(payload):
+            append(None)
+            continue
+        value = int(payload.translate(to_base32), 32)
+        polymod = reduce(xor, map(list.__getitem__, tables,
+                                  value.to_bytes(_CASHADDR_BYTES, 'big')))
+        # Drop the checksum.  The 8-bit version byte, the hash160 and 2 bits of zero padding
+        # remain
+        value >>= 40
+        version = value >> 162
+        if polymod != target or value & 3 or version not in (0, 8):
+            append(None)
+            continue
+        append((version >> 3, ((value >> 2) & ((1 << 160) - 1)).to_bytes(20, 'big')))
+    return result
+
+
+def cashaddr_encode_many(prefix, pairs):
+    '''Encode (kind, hash160) pairs as cashaddr strings with the given lower case prefix.'''
+    tables = _CASHADDR_TABLES
+    target = _cashaddr_target(prefix)
+    char_pairs = _CASHADDR_PAIRS
+    shifts = range(200, -1, -10)
+    full_prefix = prefix + ':'
+    result = []
+    append = result.append
+    for kind, hash160 in pairs:
+        assert kind in (cashaddr.PUBKEY_TYPE, cashaddr.SCRIPT_TYPE) and len(hash160) == 20
+        value = (kind << 163 | int.from_bytes(hash160, 'big')) << 42
+        # The checksum symbols contribute themselves to the polymod
+        value |= target ^ reduce(xor, map(list.__getitem__, tables,
+                                          value.to_bytes(_CASHADDR_BYTES, 'big')))
+        append(full_prefix + ''.join([char_pairs[(value >> shift) & 1023]
+                                      for shift in shifts]))
+    return result
+
+
 
 class UnknownAddress(object):
 
@@ -94,18 +259,58 @@ class ScriptOutput(namedtuple("ScriptAddressTuple", "script")):
         return ScriptOutput(bytes(script))
 
 
-# A namedtuple for easy comparison and unique hashing
-class Address(namedtuple("AddressTuple", "hash160 kind")):
+class Address:
+    '''A P2PKH or P2SH address.  Addresses are immutable and interned, so equal addresses
+    are usually the same object, and cache their string, script and script hash forms when
+    first asked for them.'''
+
+    __slots__ = ('hash160', 'kind', '_string', '_script', '_scripthash', '__weakref__')
 
     # Address kinds
     ADDR_P2PKH = 0
     ADDR_P2SH = 1
 
+    # (hash160, kind) -> Address
+    _interned = WeakValueDictionary()
+
     def __new__(cls, hash160value, kind):
-        assert kind in (cls.ADDR_P2PKH, cls.ADDR_P2SH)
-        hash160value = to_bytes(hash160value)
-        assert len(hash160value) == 20
-        return super().__new__(cls, hash160value, kind)
+        if type(hash160value) is not bytes:
+            hash160value = to_bytes(hash160value)
+        address = cls._interned.get((hash160value, kind))
+        if address is None:
+            assert kind in (cls.ADDR_P2PKH, cls.ADDR_P2SH)
+            assert len(hash160value) == 20
+            address = super().__new__(cls)
+            address.hash160 = hash160value
+            address.kind = kind
+            # (version byte, string) as the string depends on the network
+            address._string = None
+            address._script = None
+            address._scripthash = None
+            cls._interned[(hash160value, kind)] = address
+        return address
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, Address):
+            return self.hash160 == other.hash160 and self.kind == other.kind
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __lt__(self, other):
+        if isinstance(other, Address):
+            return (self.hash160, self.kind) < (other.hash160, other.kind)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.hash160, self.kind))
+
+    def __reduce__(self):
+        return (Address, (self.hash160, self.kind))
 
     @classmethod
     def from_cashaddr_string(cls, string):
@@ -135,6 +340,10 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
             except ValueError as e:
                 raise AddressError(str(e))
 
+        return cls._from_base58_string(string, net.ADDRTYPE_P2PKH, net.ADDRTYPE_P2SH)
+
+    @classmethod
+    def _from_base58_string(cls, string, p2pkh_verbyte, p2sh_verbyte):
         try:
             raw = base58_decode_check(string)
         except ValueError as e:
@@ -145,14 +354,17 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
             raise AddressError('invalid address: {}'.format(string))
 
         verbyte, hash160_ = raw[0], raw[1:]
-        if verbyte == net.ADDRTYPE_P2PKH:
+        if verbyte == p2pkh_verbyte:
             kind = cls.ADDR_P2PKH
-        elif verbyte == net.ADDRTYPE_P2SH:
+        elif verbyte == p2sh_verbyte:
             kind = cls.ADDR_P2SH
         else:
             raise AddressError('unknown version byte: {}'.format(verbyte))
 
-        return cls(hash160_, kind)
+        address = cls(hash160_, kind)
+        if address._string is None:
+            address._string = (verbyte, string)
+        return address
 
     @classmethod
     def is_valid(cls, string):
@@ -163,17 +375,68 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
             return False
 
     @classmethod
-    def from_strings(cls, strings):
-        '''Construct a list from an iterable of strings.'''
-        return [cls.from_string(string) for string in strings]
+    def decode_strings(cls, strings, net=Net):
+        '''Decode an iterable of strings in bulk.  Returns a list of the address of each
+        string, or None where a string is not a valid address on the network.  Each distinct
+        string is decoded once.'''
+        p2pkh_verbyte, p2sh_verbyte = net.ADDRTYPE_P2PKH, net.ADDRTYPE_P2SH
+        strings = list(strings)
+        unique = list(dict.fromkeys(strings))
+        base58_strings = [string for string in unique if len(string) <= 35]
+        cash_strings = [string for string in unique if len(string) > 35]
+
+        decoded = {}
+        for string, payload in zip(base58_strings, base58_decode_check_many(base58_strings)):
+            address = None
+            if payload is not None and len(payload) == 21:
+                verbyte = payload[0]
+                if verbyte == p2pkh_verbyte:
+                    address = cls(payload[1:], cls.ADDR_P2PKH)
+                elif verbyte == p2sh_verbyte:
+                    address = cls(payload[1:], cls.ADDR_P2SH)
+                if address is not None and address._string is None:
+                    address._string = (verbyte, string)
+            decoded[string] = address
+        for string, pair in zip(cash_strings,
+                                cashaddr_decode_many(cash_strings, net.CASHADDR_PREFIX)):
+            if pair is not None:
+                kind, hash160 = pair
+                pair = cls(hash160, cls.ADDR_P2PKH if kind == cashaddr.PUBKEY_TYPE
+                           else cls.ADDR_P2SH)
+            decoded[string] = pair
+        return [decoded[string] for string in strings]
+
+    @classmethod
+    def from_strings(cls, strings, net=Net):
+        '''Construct a list from an iterable of strings, raising AddressError if any is
+        invalid.'''
+        strings = list(strings)
+        addresses = cls.decode_strings(strings, net)
+        for string, address in zip(strings, addresses):
+            if address is None:
+                raise AddressError('invalid address: {}'.format(string))
+        return addresses
+
+    @classmethod
+    def to_strings(cls, addresses):
+        '''Return the string of each address in a list, encoding those not yet cached in
+        one call.'''
+        verbytes = (Net.ADDRTYPE_P2PKH, Net.ADDRTYPE_P2SH)
+        uncached = [address for address in addresses
+                    if address._string is None or address._string[0] != verbytes[address.kind]]
+        strings = base58_encode_check_many(bytes([verbytes[address.kind]]) + address.hash160
+                                           for address in uncached)
+        for address, string in zip(uncached, strings):
+            address._string = (verbytes[address.kind], string)
+        return [address._string[1] for address in addresses]
 
     @classmethod
     def from_pubkey(cls, pubkey):
         '''Returns a P2PKH address from a public key.  The public key can
-        be bytes or a hex string.'''
+        be a PublicKey, bytes or a hex string.'''
         if isinstance(pubkey, str):
             pubkey = PublicKey.from_hex(pubkey)
-        else:
+        elif not isinstance(pubkey, PublicKey):
             pubkey = PublicKey.from_bytes(pubkey)
         return cls(hash_160(pubkey.to_bytes()), cls.ADDR_P2PKH)
 
@@ -210,7 +473,11 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
         else:
             verbyte = Net.ADDRTYPE_P2SH
 
-        return base58_encode_check(bytes([verbyte]) + self.hash160)
+        cached = self._string
+        if cached is None or cached[0] != verbyte:
+            cached = self._string = (verbyte, base58_encode_check_many(
+                [bytes([verbyte]) + self.hash160])[0])
+        return cached[1]
 
     def to_bytes(self) -> bytes:
         if self.kind == self.ADDR_P2PKH:
@@ -221,10 +488,12 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
 
     def to_script(self):
         '''Return a binary script to pay to the address.'''
-        if self.kind == self.ADDR_P2PKH:
-            return P2PKH_Address(self.hash160).to_script_bytes()
-        else:
-            return P2SH_Address(self.hash160).to_script_bytes()
+        if self._script is None:
+            if self.kind == self.ADDR_P2PKH:
+                self._script = P2PKH_Address(self.hash160).to_script_bytes()
+            else:
+                self._script = P2SH_Address(self.hash160).to_script_bytes()
+        return self._script
 
     def to_script_hex(self):
         '''Return a script to pay to the address as a hex string.'''
@@ -232,7 +501,9 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
 
     def to_scripthash(self):
         '''Returns the hash of the script in binary.'''
-        return sha256(self.to_script())
+        if self._scripthash is None:
+            self._scripthash = sha256(self.to_script())
+        return self._scripthash
 
     def to_scripthash_hex(self):
         '''Like other bitcoin hashes this is reversed when written in hex.'''
@@ -33,8 +33,11 @@ app_state.func()
 etc.
 '''
 
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import os
 import time
+from typing import Optional
 
 from bitcoinx import Headers
 
@@ -74,6 +77,7 @@ class AppStateProxy(object):
         self.decimal_point = config.get('decimal_point', 8)
         self.num_zeros = config.get('num_zeros', 0)
         self.async_ = ASync()
+        self._signing_executor = None
 
     def has_app(self):
         return self.app is not None
@@ -81,11 +85,42 @@ class AppStateProxy(object):
     def set_app(self, app) -> None:
         self.app = app
 
+    def signing_executor(self) -> Optional[ProcessPoolExecutor]:
+        '''The worker processes shared by all transaction signing, started on first use, or
+        None if the config has transactions signed in-process.'''
+        if self._signing_executor is None:
+            processes = self.config.get_signing_processes()
+            if processes > 1:
+                # Spawned rather than forked, so workers do not inherit our threads and
+                # locks, and so frozen builds start them the same way on every platform
+                context = multiprocessing.get_context('spawn')
+                self._signing_executor = ProcessPoolExecutor(processes, mp_context=context)
+        return self._signing_executor
+
+    def shutdown_signing_executor(self) -> None:
+        if self._signing_executor is not None:
+            self._signing_executor.shutdown()
+            self._signing_executor = None
+
     def headers_filename(self) -> str:
         return os.path.join(self.config.path, 'headers')
 
+    def headers_snapshot_filename(self) -> str:
+        return self.config.get('headers_snapshot',
+                               os.path.join(self.config.path, 'headers.snapshot'))
+
     def read_headers(self) -> None:
-        self.headers = Headers.from_file(Net.COIN, self.headers_filename(), Net.CHECKPOINT)
+        file_path = self.headers_filename()
+        is_new = not os.path.exists(file_path)
+        self.headers = Headers.from_file(Net.COIN, file_path, Net.CHECKPOINT)
+        # Seed a fresh headers file from a snapshot so we need not fetch it all from servers
+        snapshot_path = self.headers_snapshot_filename()
+        if is_new and os.path.exists(snapshot_path):
+            from .headers_snapshot import import_headers_snapshot, HeadersSnapshotError
+            try:
+                import_headers_snapshot(self.headers, snapshot_path)
+            except (HeadersSnapshotError, OSError) as e:
+                logger.error(f'unable to import headers snapshot {snapshot_path}: {e}')
         for n, chain in enumerate(self.headers.chains(), start=1):
             logger.info(f'chain #{n}: {chain.desc()}')
 
@@ -22,6 +22,7 @@
 # SOFTWARE.
 
 from asyncio import Event, Queue, new_event_loop, run_coroutine_threadsafe, CancelledError
+import concurrent.futures
 from functools import partial
 import queue
 import threading
@@ -104,7 +105,12 @@ class ASync(object):
 
     def spawn_and_wait(self, coro, *args, timeout=None):
         future = self._spawn(coro, args)
-        return future.result(timeout)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # Don't leave the coroutine running for a result nobody will collect
+            future.cancel()
+            raise
 
     def run_pending_callbacks(self):
         while not self._queue.empty():
@@ -23,6 +23,8 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import concurrent.futures
+from functools import partial
 import os
 
 from bitcoinx import bip32_is_valid_chain_string
@@ -36,10 +38,14 @@ from .logs import logs
 from .wallet import (
     ImportedAddressWallet, ImportedPrivkeyWallet, Standard_Wallet, Multisig_Wallet, wallet_types,
 )
+from .wallet_support import discover_accounts
 
 
 logger = logs.get_logger('wizard')
 
+# Seconds to wait for each round of account discovery before using the default derivation
+DISCOVERY_TIMEOUT = 5
+
 
 class BaseWizard(object):
 
@@ -321,7 +327,31 @@ class BaseWizard(object):
 
     def on_restore_bip39(self, seed, passphrase):
         f = lambda x: self.run('on_bip44', seed, passphrase, str(x))
-        self.derivation_dialog(f, bip44_derivation_cointype(0, 0))
+        derivation = self.waiting_dialog(
+            partial(self._discover_bip39_derivation, seed, passphrase),
+            _('Looking for accounts used with this seed...'))
+        self.derivation_dialog(f, derivation)
+
+    def _discover_bip39_derivation(self, seed, passphrase):
+        '''The derivation of the first account of the seed with history if a server is
+        connected and one is found, otherwise the default derivation.'''
+        default_derivation = bip44_derivation_cointype(0, 0)
+        daemon = getattr(app_state, 'daemon', None)
+        network = daemon.network if daemon else None
+        if network is None or not network.is_connected():
+            return default_derivation
+        try:
+            accounts = discover_accounts(keystore.bip39_to_seed(seed, passphrase),
+                                         partial(network.get_histories,
+                                                 timeout=DISCOVERY_TIMEOUT))
+        except concurrent.futures.TimeoutError:
+            logger.warning('account discovery timed out')
+            return default_derivation
+        except Exception:
+            logger.exception('account discovery failed')
+            return default_derivation
+        logger.debug('discovered accounts %s', [account.derivation for account in accounts])
+        return accounts[0].derivation if accounts else default_derivation
 
     def create_keystore(self, seed, passphrase):
         k = keystore.from_seed(seed, passphrase, self.wallet_type == 'multisig')
@@ -25,8 +25,8 @@
 
 from bitcoinx import Ops, hash_to_hex_str, sha256
 
-from .address import Address
-from .crypto import hash_160, sha256d, hmac_oneshot
+from .address import Address, base58_encode_check_many
+from .crypto import hash_160, hmac_oneshot
 from .networks import Net
 from .util import bfh, bh2u, assert_bytes, to_bytes
 from . import version
@@ -142,9 +142,7 @@ is_seed = lambda x: bool(seed_type(x))
 ############ functions from pywallet #####################
 
 def hash160_to_b58_address(h160, addrtype):
-    s = bytes([addrtype])
-    s += h160
-    return base_encode(s + sha256d(s)[0:4], base=58)
+    return base58_encode_check_many([bytes([addrtype]) + h160])[0]
 
 
 def hash160_to_p2pkh(h160):
@@ -241,6 +239,14 @@ def base_decode(v, length, base):
 def scripthash_hex(script):
     return hash_to_hex_str(sha256(bytes(script)))
 
+def history_status(history):
+    '''The ElectrumX status hash of a script hash history, a list of (tx_hash, height) pairs,
+    or None if the history is empty.'''
+    if not history:
+        return None
+    status = ''.join(f'{tx_hash}:{tx_height}:' for tx_hash, tx_height in history)
+    return sha256(status.encode()).hex()
+
 def msg_magic(message):
     length = bfh(var_int(len(message)))
     return b"\x18Bitcoin Signed Message:\n" + length + message
@@ -23,13 +23,16 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from bisect import bisect_left, bisect_right
 from collections import defaultdict, namedtuple
+from itertools import accumulate, repeat
 from math import floor, log10
+from operator import attrgetter
 
 from .bitcoin import COIN
 from .crypto import sha256
 from .logs import logs
-from .transaction import Transaction
+from .transaction import Transaction, XTxInput, to_txin
 from .exceptions import NotEnoughFunds
 
 
@@ -76,14 +79,77 @@ class PRNG:
 
 Bucket = namedtuple('Bucket', ['desc', 'size', 'value', 'coins'])
 
-def strip_unneeded(bkts, sufficient_funds):
-    '''Remove buckets that are unnecessary in achieving the spend amount'''
-    bkts = sorted(bkts, key = lambda bkt: bkt.value)
-    for i in range(len(bkts)):
-        if not sufficient_funds(bkts[i + 1:]):
-            return bkts[i:]
+def strip_unneeded(candidate, buckets, sufficient_funds):
+    '''Remove buckets that are unnecessary in achieving the spend amount
+    from candidate, a tuple of indices into buckets'''
+    candidate = sorted(candidate, key = lambda n: buckets[n].value)
+    for i in range(len(candidate)):
+        if not sufficient_funds([buckets[n] for n in candidate[i + 1:]]):
+            return tuple(candidate[i:])
     # Shouldn't get here
-    return bkts
+    return tuple(candidate)
+
+
+def privacy_penalty(tx):
+    '''Penalizes each bucket beyond the first, change that is quite
+    different to the sent amount, and change that is too big.'''
+    min_change = min(o[1] for o in tx.outputs()) * 0.75
+    max_change = max(o[1] for o in tx.outputs()) * 1.33
+    spent_amount = sum(o[1] for o in tx.outputs())
+
+    def penalty(count, value, _size):
+        badness = count - 1
+        change = float(value - spent_amount)
+        # Penalize change not roughly in output range
+        if change < min_change:
+            badness += (min_change - change) / (min_change + 10000)
+        elif change > max_change:
+            badness += (change - max_change) / (max_change + 10000)
+            # Penalize large change; 5 BTC excess ~= using 1 more input
+            badness += change / (COIN * 5)
+        return badness
+
+    return penalty
+
+
+def minimise_fee_penalty(_tx):
+    '''Penalizes the size of the inputs, and so the fee.'''
+    def penalty(_count, _value, size):
+        return size
+    return penalty
+
+
+def consolidate_penalty(_tx):
+    '''Prefers the largest inputs, so as to merge as many coins as possible
+    while fees are low.'''
+    def penalty(_count, _value, size):
+        return -size
+    return penalty
+
+
+# Config names of functions returning penalty(count, value, size) functions
+# for a transaction.  count, value and size are the number of buckets in a
+# candidate and their total value and size.
+PENALTIES = {
+    'privacy': privacy_penalty,
+    'minimise_fee': minimise_fee_penalty,
+    'consolidate': consolidate_penalty,
+}
+
+
+def least_penalty(buckets, candidates, penalty_func):
+    '''Return the candidate, a tuple of indices into buckets, with the least
+    penalty.  Candidates are scored from their totals without building
+    lists of their buckets.'''
+    values = [bucket.value for bucket in buckets]
+    sizes = [bucket.size for bucket in buckets]
+    penalties = [penalty_func(len(candidate), sum(map(values.__getitem__, candidate)),
+                              sum(map(sizes.__getitem__, candidate)))
+                 for candidate in candidates]
+    best = min(penalties)
+    logger.debug("Bucket sets: %d", len(buckets))
+    logger.debug("Winning penalty: %d", best)
+    return candidates[penalties.index(best)]
 
 class CoinChooserBase:
     def keys(self, coins):
@@ -104,7 +170,7 @@ class CoinChooserBase:
         return [make_Bucket(key, value) for key, value in buckets.items()]
 
     def penalty_func(self, _tx):
-        def penalty(_candidate):
+        def penalty(_count, _value, _size):
             return 0
         return penalty
 
@@ -169,6 +235,11 @@ class CoinChooserBase:
             logger.debug('not keeping dust %s', dust)
         return change, dust
 
+    def make_prng(self, coins):
+        '''Return a PRNG seeded deterministically from coins.'''
+        utxos = [c['prevout_hash'] + str(c['prevout_n']) for c in coins]
+        return PRNG(''.join(sorted(utxos)))
+
     def make_tx(self, coins, outputs, change_addrs, fee_estimator,
                 dust_threshold):
         '''Select unspent coins to spend to pay outputs.  If the change is
@@ -177,8 +248,7 @@ class CoinChooserBase:
         added to the transaction fee.'''
 
         # Deterministic randomness from coins
-        utxos = [c['prevout_hash'] + str(c['prevout_n']) for c in coins]
-        self.p = PRNG(''.join(sorted(utxos)))
+        self.p = self.make_prng(coins)
 
         # Copy the ouputs so when adding change we don't modify "outputs"
         tx = Transaction.from_io([], outputs)
@@ -186,17 +256,22 @@ class CoinChooserBase:
         base_size = tx.estimated_size()
         spent_amount = tx.output_value()
 
+        def required_funds(inputs_size):
+            '''Return the value inputs of the given total size must have
+            to pay for the transaction'''
+            return spent_amount + fee_estimator(base_size + inputs_size)
+
         def sufficient_funds(buckets):
             '''Given a list of buckets, return True if it has enough
             value to pay for the transaction'''
             total_input = sum(bucket.value for bucket in buckets)
-            total_size = sum(bucket.size for bucket in buckets) + base_size
-            return total_input >= spent_amount + fee_estimator(total_size)
+            total_size = sum(bucket.size for bucket in buckets)
+            return total_input >= required_funds(total_size)
 
         # Collect the coins into buckets, choose a subset of the buckets
         buckets = self.bucketize_coins(coins)
         buckets = self.choose_buckets(buckets, sufficient_funds,
-                                      self.penalty_func(tx))
+                                      self.penalty_func(tx), required_funds)
 
         tx.add_inputs([coin for b in buckets for coin in b.coins])
         tx_size = base_size + sum(bucket.size for bucket in buckets)
@@ -212,13 +287,15 @@ class CoinChooserBase:
 
         return tx
 
-    def choose_buckets(self, buckets, sufficient_funds, penalty_func):
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func,
+                       required_funds):
         raise NotImplementedError('To be subclassed')
 
 class CoinChooserRandom(CoinChooserBase):
 
     def bucket_candidates(self, buckets, sufficient_funds):
-        '''Returns a list of bucket sets.'''
+        '''Returns a list of bucket sets, each a tuple of indices into
+        buckets.'''
         candidates = set()
 
         # Add all singletons
@@ -242,16 +319,13 @@ class CoinChooserRandom(CoinChooserBase):
             else:
                 raise NotEnoughFunds()
 
-        candidates = [[buckets[n] for n in c] for c in candidates]
-        return [strip_unneeded(c, sufficient_funds) for c in candidates]
+        return [strip_unneeded(c, buckets, sufficient_funds) for c in candidates]
 
-    def choose_buckets(self, buckets, sufficient_funds, penalty_func):
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func,
+                       _required_funds):
         candidates = self.bucket_candidates(buckets, sufficient_funds)
-        penalties = [penalty_func(cand) for cand in candidates]
-        winner = candidates[penalties.index(min(penalties))]
-        logger.debug("Bucket sets: %d", len(buckets))
-        logger.debug("Winning penalty: %d", min(penalties))
-        return winner
+        winner = least_penalty(buckets, candidates, penalty_func)
+        return [buckets[n] for n in winner]
 
 class CoinChooserPrivacy(CoinChooserRandom):
     '''Attempts to better preserve user privacy.  First, if any coin is
@@ -261,27 +335,226 @@ class CoinChooserPrivacy(CoinChooserRandom):
     reduce blockchain UTXO bloat, and reduce future privacy loss that
     would come from reusing that address' remaining UTXOs.  Second, it
     penalizes change that is quite different to the sent amount.
-    Third, it penalizes change that is too big.'''
+    Third, it penalizes change that is too big.
+
+    Candidates are chosen between with the named function of PENALTIES;
+    the second and third points only hold for the default, "privacy".'''
+
+    def __init__(self, penalty='privacy'):
+        if penalty not in PENALTIES:
+            logger.warning('unknown coin chooser penalty %s', penalty)
+            penalty = 'privacy'
+        self.penalty = penalty
 
     def keys(self, coins):
         return [coin['address'] for coin in coins]
 
     def penalty_func(self, tx):
-        min_change = min(o[1] for o in tx.outputs()) * 0.75
-        max_change = max(o[1] for o in tx.outputs()) * 1.33
-        spent_amount = sum(o[1] for o in tx.outputs())
+        return PENALTIES[self.penalty](tx)
+
+
+class CoinChooserBranchAndBound(CoinChooserPrivacy):
+    '''A CoinChooserPrivacy for wallets with very many coins.  Buckets and
+    their penalty are the same, so every coin of an address is still spent
+    together and change close to the sent amounts is preferred, but the
+    candidate bucket sets are found without shuffling every bucket.
+
+    Buckets are valued net of the fee for spending them and sorted, and
+    candidates are: the single buckets nearest some multiples of the
+    amount needed, found by bisection; random draws of buckets until the
+    amount is met, with and without the buckets not needed; the set of up
+    to max_search_buckets buckets leaving the least change, found by a
+    branch-and-bound search pruned with prefix sums; and, so there is
+    always a candidate, the fewest largest buckets meeting the amount.
+    The searches are limited only by step counts, so that the same coins
+    give the same choice on any machine.'''
+
+    # Single buckets nearest these multiples of the amount needed are candidates
+    single_multiples = (1, 1.5, 2, 3, 5)
+    random_draws = 100
+    # Random draws stop once this many buckets have been drawn in all; a draw
+    # in progress is completed
+    draw_steps = 100_000
+    max_search_buckets = 6
+    search_steps = 50_000
 
-        def penalty(buckets):
-            badness = len(buckets) - 1
-            total_input = sum(bucket.value for bucket in buckets)
-            change = float(total_input - spent_amount)
-            # Penalize change not roughly in output range
-            if change < min_change:
-                badness += (min_change - change) / (min_change + 10000)
-            elif change > max_change:
-                badness += (change - max_change) / (max_change + 10000)
-                # Penalize large change; 5 BTC excess ~= using 1 more input
-                badness += change / (COIN * 5)
-            return badness
+    def make_tx(self, coins, outputs, change_addrs, fee_estimator,
+                dust_threshold):
+        coins = list(map(to_txin, coins))
+        return super().make_tx(coins, outputs, change_addrs, fee_estimator,
+                               dust_threshold)
 
-        return penalty
+    def make_prng(self, coins):
+        # The sum of the outpoints does not depend on the order of the
+        # coins, and is much cheaper than sorting them
+        outpoints = map(XTxInput.outpoint_bytes, coins)
+        return PRNG(str(sum(map(int.from_bytes, outpoints, repeat('big')))))
+
+    def keys(self, coins):
+        return list(map(attrgetter('address'), coins))
+
+    def bucketize_coins(self, coins):
+        # Every coin of a bucket pays to the same address, so each input
+        # has the size of the first.  Input sizes depend only on the input
+        # type and its public keys, so are only calculated once for each.
+        groups = defaultdict(list)
+        for key, coin in zip(self.keys(coins), coins):
+            groups[key].append(coin)
+        input_sizes = {}
+        get_value = attrgetter('value')
+        buckets = []
+        for key, coins in groups.items():
+            coin = coins[0]
+            size_key = (coin.type, coin.num_sig, len(coin.x_pubkeys or ()),
+                        coin.x_pubkeys[0][:2] if coin.x_pubkeys else None)
+            input_size = input_sizes.get(size_key)
+            if input_size is None:
+                input_size = input_sizes[size_key] = Transaction.estimated_input_size(coin)
+            buckets.append(Bucket(key, len(coins) * input_size,
+                                  sum(map(get_value, coins)), coins))
+        return buckets
+
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func,
+                       required_funds):
+        target = required_funds(0)
+        # The fee for each byte of input
+        fee_rate = (required_funds(100_000) - target) / 100_000
+
+        # Buckets worth spending, ascending by value net of their fee
+        buckets = [(bucket.value - bucket.size * fee_rate, bucket)
+                   for bucket in buckets]
+        buckets = sorted((pair for pair in buckets if pair[0] > 0),
+                         key=lambda pair: pair[0])
+        values = [value for value, bucket in buckets]
+        buckets = [bucket for value, bucket in buckets]
+        # prefix_sums[n] is the net value of the first n buckets
+        prefix_sums = [0] + list(accumulate(values))
+        if prefix_sums[-1] < target or not sufficient_funds(buckets):
+            raise NotEnoughFunds()
+
+        # The fewest largest buckets meeting target
+        count = len(values)
+        first = bisect_right(prefix_sums, prefix_sums[-1] - target) - 1
+        candidates = {tuple(range(max(first, 0), count))}
+        for multiple in self.single_multiples:
+            index = bisect_left(values, target * multiple)
+            if index < count:
+                candidates.add((index, ))
+        self._random_candidates(values, target, candidates)
+        best = self._search_candidate(values, prefix_sums, target, fee_rate)
+        if best:
+            candidates.add(best)
+
+        winner = least_penalty(buckets, sorted(candidates), penalty_func)
+        winner = [buckets[n] for n in sorted(winner)]
+
+        # Net values are estimates; top up with the largest unused buckets
+        for bucket in reversed(buckets):
+            if sufficient_funds(winner):
+                break
+            if bucket not in winner:
+                winner.append(bucket)
+        return winner
+
+    def _random_candidates(self, values, target, candidates):
+        '''Add random draws of buckets, both whole and less the smallest
+        buckets not needed to meet target.'''
+        count = len(values)
+        steps = 0
+        for _i in range(min(self.random_draws, (count - 1) * 10 + 1)):
+            if steps >= self.draw_steps:
+                break
+            drawn = set()
+            total = 0
+            while total < target:
+                index = self.p.randint(0, count)
+                if index not in drawn:
+                    drawn.add(index)
+                    total += values[index]
+            steps += len(drawn)
+            drawn = sorted(drawn)
+            candidates.add(tuple(drawn))
+            # Strip the smallest buckets while what remains is enough
+            start = 0
+            while start + 1 < len(drawn) and total - values[drawn[start]] >= target:
+                total -= values[drawn[start]]
+                start += 1
+            candidates.add(tuple(drawn[start:]))
+
+    def _search_candidate(self, values, prefix_sums, target, fee_rate):
+        '''Return the set of bucket indices found with the least net value
+        over target.  A set is as good as exact if it exceeds target by less
+        than the fee for a change output.'''
+        good_enough = fee_rate * 34
+        best = [None, None]
+        steps = 0
+
+        def search(chosen, total, end):
+            # Try sets adding to chosen from the buckets before end
+            nonlocal steps
+            needed = target - total
+            # The smallest bucket meeting the need completes a set
+            index = bisect_left(values, needed, 0, end)
+            if index < end:
+                excess = values[index] - needed
+                if best[0] is None or excess < best[0]:
+                    best[:] = excess, chosen + (index, )
+            if len(chosen) + 2 > self.max_search_buckets:
+                return
+            # Otherwise add a smaller bucket, largest first, while the
+            # buckets up to it can meet the need
+            for index in range(index - 1, -1, -1):
+                steps += 1
+                if ((best[0] is not None and best[0] <= good_enough)
+                        or prefix_sums[index + 1] < needed
+                        or steps > self.search_steps):
+                    return
+                search(chosen + (index, ), total + values[index], index)
+
+        search((), 0, len(values))
+        return best[1]
+
+
+# Config names of the coin choosers for payments
+COIN_CHOOSERS = {
+    'privacy': CoinChooserPrivacy,
+    'branch_and_bound': CoinChooserBranchAndBound,
+}
+
+
+def get_coin_chooser(config):
+    '''The payment coin chooser named in the config, with its penalty.'''
+    name = config.get_coin_chooser()
+    if name not in COIN_CHOOSERS:
+        logger.warning('unknown coin chooser %s', name)
+        name = 'privacy'
+    return COIN_CHOOSERS[name](config.get_coin_chooser_penalty())
+
+
+class CoinConsolidator(CoinChooserBase):
+    '''Chooses small coins to merge into a single output, so that later
+    payments can be made from few, large coins.  As with
+    CoinChooserPrivacy, every coin of an address is spent together.'''
+
+    def keys(self, coins):
+        return [coin['address'] for coin in coins]
+
+    def choose_coins(self, coins, max_value, max_inputs, fee_estimator):
+        '''Return the coins to consolidate, no more than max_inputs of them.
+        Buckets holding the most coins of value below max_value are taken
+        first, and buckets not worth the fee for spending them are
+        skipped.'''
+        def small_count(bucket):
+            return sum(coin['value'] < max_value for coin in bucket.coins)
+
+        buckets = [bucket for bucket in self.bucketize_coins(coins)
+                   if len(bucket.coins) <= max_inputs
+                   and bucket.value > fee_estimator(bucket.size)
+                   and small_count(bucket)]
+        buckets.sort(key=lambda bucket: (-small_count(bucket), bucket.value))
+
+        chosen = []
+        for bucket in buckets:
+            if len(chosen) + len(bucket.coins) <= max_inputs:
+                chosen.extend(bucket.coins)
+        return chosen
@@ -30,11 +30,13 @@ import datetime
 from decimal import Decimal
 from functools import wraps
 import json
+import os
 import sys
 
 from bitcoinx import PrivateKey, PublicKey
 
 from . import bitcoin
+from . import keystore
 from .address import Address
 from .app_state import app_state
 from .bitcoin import COIN
@@ -45,6 +47,7 @@ from .logs import logs
 from .paymentrequest import PR_PAID, PR_UNPAID, PR_UNKNOWN, PR_EXPIRED
 from .transaction import Transaction, multisig_script
 from .util import bfh, bh2u, format_satoshis, json_decode, to_bytes
+from .wallet_support import discover_accounts
 
 
 logger = logs.get_logger("commands")
@@ -102,7 +105,7 @@ def command(s):
             if c.requires_wallet and wallet is None:
                 raise Exception("Wallet not loaded. Use 'electrum-sv daemon load_wallet'")
             if c.requires_password and password is None and wallet.storage.get('use_encryption') \
-               and not kwargs.get("unsigned"):
+               and not kwargs.get("unsigned") and not wallet.is_unlocked():
                 return {'error': 'Password required' }
             return func(*args, **kwargs)
         return func_wrapper
@@ -150,7 +153,7 @@ class Commands:
                 if hasattr(nt, 'to_string'): return nt.to_string()
                 return nt
 
-            if isinstance(v, tuple): v = EncodeNamedTupleObject(v)
+            if isinstance(v, (tuple, Address)): v = EncodeNamedTupleObject(v)
             elif isinstance(v, list): v = ChkList(v) # may recurse
             elif isinstance(v, dict): v = Commands._EnsureDictNamedTuplesAreJSONSafe(v) # recurse
             return v
@@ -228,11 +231,22 @@ class Commands:
         """List unspent outputs. Returns the list of unspent transaction
         outputs in your wallet."""
         utxos = self.wallet.get_utxos(exclude_frozen=False)
-        tx_inputs = [utxo.to_tx_input() for utxo in utxos]
+        tx_inputs = [utxo.to_tx_input().to_dict() for utxo in utxos]
         for tx_input in tx_inputs:
             tx_input['address'] = tx_input['address'].to_string()
         return tx_inputs
 
+    @command('n')
+    def discoveraccounts(self, seed=None, passphrase=None):
+        """List the BIP44 accounts of a BIP39 seed whose first addresses have history. The
+        seed is prompted for, or read from stdin if it is not a terminal. Note: This is a
+        walletless server query, results are not checked by SPV.
+        """
+        accounts = discover_accounts(keystore.bip39_to_seed(seed, passphrase),
+                                     self.network.get_histories)
+        return [{'derivation': account.derivation, 'xpub': account.xpub}
+                for account in accounts]
+
     @command('n')
     def getaddressunspent(self, address):
         """Returns the UTXO list of any address. Note: This
@@ -274,6 +288,20 @@ class Commands:
         tx.sign(keypairs)
         return tx.as_dict()
 
+    @command('wp')
+    def unlock(self, password=None, timeout=None):
+        """Keep the wallet's keys decrypted for signing for timeout seconds, by default the
+        session timeout. Until then, or until it is locked, commands sign without a
+        password."""
+        self.wallet.unlock(password, timeout)
+        return True
+
+    @command('w')
+    def lock(self):
+        """Forget the wallet's decrypted keys, ending the session started by unlock."""
+        self.wallet.lock()
+        return True
+
     @command('wp')
     def signtransaction(self, tx, privkey=None, password=None):
         """Sign a transaction. The wallet keys will be used unless a private key is provided."""
@@ -392,6 +420,19 @@ class Commands:
         """Return the list of available servers"""
         return self.network.get_servers()
 
+    @command('')
+    def exportheaders(self, filename):
+        """Write a checksummed snapshot of the block headers to a file. New installations
+        import it at startup if it is placed in their data directory as 'headers.snapshot',
+        or if the 'headers_snapshot' config variable names it."""
+        from .headers_snapshot import export_headers_snapshot
+        if app_state.headers is None:
+            app_state.read_headers()
+        # Relative paths are relative to the directory the command was run from
+        file_path = os.path.join(self.config.get('cwd', ''), filename)
+        start_height, count = export_headers_snapshot(app_state.headers, file_path)
+        return {'start_height': start_height, 'count': count}
+
     @command('')
     def version(self):
         """Return the version of electrum-sv."""
@@ -457,12 +498,10 @@ class Commands:
               unsigned=False, password=None, locktime=None):
         self.nocheck = nocheck
         change_addr = Address.from_string(change_addr)
-        domain = None if domain is None else [Address.from_string(x) for x in domain]
-        final_outputs = []
-        for address, amount in outputs:
-            address = Address.from_string(address)
-            amount = satoshis(amount)
-            final_outputs.append((address, amount))
+        domain = None if domain is None else Address.from_strings(domain)
+        addresses = Address.from_strings(address for address, amount in outputs)
+        final_outputs = [(address, satoshis(amount))
+                         for address, (_, amount) in zip(addresses, outputs)]
 
         coins = self.wallet.get_spendable_coins(domain, self.config)
         tx = self.wallet.make_unsigned_transaction(coins, final_outputs, self.config,
@@ -702,11 +741,14 @@ param_descriptions = {
     'requested_amount': 'Requested amount (in BTC).',
     'outputs': 'list of ["address", amount]',
     'redeem_script': 'redeem script (hexadecimal)',
+    'filename': 'File name',
 }
 
 command_options = {
     'password':    ("-W", "Password"),
     'new_password':(None, "New Password"),
+    'passphrase':  (None, "Seed extension"),
+    'seed':        (None, "Seed phrase; prompted for if not given"),
     'receiving':   (None, "Show only receiving addresses"),
     'change':      (None, "Show only change addresses"),
     'frozen':      (None, "Show only frozen addresses"),
@@ -757,6 +799,7 @@ arg_types = {
     'fee': lambda x: str(Decimal(x)) if x is not None else None,
     'amount': lambda x: str(Decimal(x)) if x != '!' else '!',
     'locktime': int,
+    'timeout': int,
 }
 
 config_variables = {
@@ -1,3 +1,4 @@
+import concurrent.futures
 import os
 import shutil
 import threading
@@ -572,6 +573,21 @@ class InstallWizard(QDialog, MessageBoxMixin, BaseWizard):
         self.refresh_gui()
         return result
 
+    def waiting_dialog(self, task, msg):
+        '''Run task in a thread, showing msg and keeping the GUI responsive until it is done.
+        Returns its result.'''
+        self.please_wait.setText(msg)
+        self.refresh_gui()
+        future = app_state.app.run_in_thread(task)
+        try:
+            while True:
+                try:
+                    return future.result(1 / 60)
+                except concurrent.futures.TimeoutError:
+                    self.refresh_gui()
+        finally:
+            self.please_wait.setText(_("Please wait..."))
+
     def refresh_gui(self):
         # For some reason, to refresh the GUI this needs to be called twice
         app_state.app.processEvents()
@@ -0,0 +1,169 @@
+# ElectrumSV - lightweight Bitcoin SV client
+# Copyright (C) 2019 The ElectrumSV Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Compact, checksummed snapshots of the longest header chain.
+
+A snapshot lets a freshly provisioned installation populate its headers file without
+fetching everything after the checkpoint from the network.  The file format is a fixed
+size preamble followed by consecutive 80-byte raw headers:
+
+   a) magic bytes b'ESVHDRS\\0'
+   b) format version (little endian uint16)
+   c) checkpoint height the snapshot was made against (little endian uint32)
+   d) height of the first header (little endian uint32)
+   e) header count (little endian uint32)
+   f) double SHA256 of the raw headers that follow (32 bytes)
+
+The snapshot must contain the checkpoint header.  Headers before the checkpoint are
+accepted only if their prev_hash links connect them to it; headers after the checkpoint
+are connected with full bits and proof-of-work validation.
+'''
+
+import mmap
+import os
+from struct import Struct
+
+from bitcoinx import double_sha256, MissingHeader, IncorrectBits, InsufficientPoW
+
+from .logs import logs
+
+
+logger = logs.get_logger("headers_snapshot")
+
+HEADER_SIZE = 80
+SNAPSHOT_MAGIC = b'ESVHDRS\0'
+SNAPSHOT_VERSION = 1
+_preamble = Struct('<8sHIII32s')
+
+
+class HeadersSnapshotError(Exception):
+    pass
+
+
+def _contiguous_start_height(headers, chain):
+    '''The lowest height such that every header from it to the checkpoint is present.'''
+    height = headers.checkpoint.height
+    try:
+        while height > 0:
+            headers.raw_header_at_height(chain, height - 1)
+            height -= 1
+    except MissingHeader:
+        pass
+    return height
+
+
+def export_headers_snapshot(headers, file_path):
+    '''Write the longest chain of the given headers object to file_path as a snapshot.
+
+    The file is written under a temporary name and renamed into place, so a reader never
+    sees a partial snapshot.  Returns a (start_height, count) pair.
+    '''
+    chain = headers.longest_chain()
+    start_height = _contiguous_start_height(headers, chain)
+    raw_header_at_height = headers.raw_header_at_height
+    payload = b''.join(raw_header_at_height(chain, height)
+                       for height in range(start_height, chain.height + 1))
+    count = len(payload) // HEADER_SIZE
+    preamble = _preamble.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, headers.checkpoint.height,
+                              start_height, count, double_sha256(payload))
+
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(preamble)
+        f.write(payload)
+    os.replace(temp_path, file_path)
+    logger.info(f'exported {count:,d} headers from height {start_height:,d} to {file_path}')
+    return start_height, count
+
+
+def _verify_snapshot(snapshot_mmap, checkpoint):
+    '''Check the preamble, checksum and checkpoint header of a mapped snapshot.  Returns a
+    (start_height, count) pair.'''
+    if len(snapshot_mmap) < _preamble.size:
+        raise HeadersSnapshotError('snapshot is truncated')
+    magic, version, cp_height, start_height, count, checksum = \
+        _preamble.unpack(snapshot_mmap[:_preamble.size])
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise HeadersSnapshotError('not a headers snapshot or unsupported version')
+    if len(snapshot_mmap) - _preamble.size != count * HEADER_SIZE:
+        raise HeadersSnapshotError('snapshot size does not match its header count')
+    # Hash the mapped headers in place rather than copying them
+    with memoryview(snapshot_mmap) as view, view[_preamble.size:] as payload:
+        if double_sha256(payload) != checksum:
+            raise HeadersSnapshotError('snapshot checksum mismatch')
+    if cp_height != checkpoint.height or not start_height <= cp_height < start_height + count:
+        raise HeadersSnapshotError('snapshot was not made against our checkpoint')
+    cp_start = _preamble.size + (cp_height - start_height) * HEADER_SIZE
+    if snapshot_mmap[cp_start: cp_start + HEADER_SIZE] != checkpoint.raw_header:
+        raise HeadersSnapshotError('snapshot checkpoint header does not match')
+    return start_height, count
+
+
+def import_headers_snapshot(headers, file_path):
+    '''Memory-map the snapshot at file_path, verify it against the checkpoint of the headers
+    object and add its headers.  Returns the longest chain afterwards.
+
+    Nothing is written to the headers object unless the checksum and checkpoint header
+    verify, and the pre-checkpoint headers link to the checkpoint.
+
+    Raises: HeadersSnapshotError, OSError
+    '''
+    checkpoint = headers.checkpoint
+    coin = headers.coin
+    with open(file_path, 'rb') as f:
+        # An empty file cannot be mapped
+        if os.fstat(f.fileno()).st_size < _preamble.size:
+            raise HeadersSnapshotError('snapshot is truncated')
+        snapshot_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        start_height, count = _verify_snapshot(snapshot_mmap, checkpoint)
+
+        def extract_header(height):
+            start = _preamble.size + (height - start_height) * HEADER_SIZE
+            return snapshot_mmap[start: start + HEADER_SIZE]
+
+        # Verify the prev_hash links back from the checkpoint before setting anything
+        pre_checkpoint = []
+        next_raw_header = checkpoint.raw_header
+        for height in reversed(range(start_height, checkpoint.height)):
+            raw_header = extract_header(height)
+            if coin.header_prev_hash(next_raw_header) != coin.header_hash(raw_header):
+                raise HeadersSnapshotError(f'header at height {height:,d} does not connect')
+            pre_checkpoint.append((height, raw_header))
+            next_raw_header = raw_header
+
+        try:
+            for height, raw_header in pre_checkpoint:
+                headers.set_one(height, raw_header)
+            for height in range(checkpoint.height + 1, start_height + count):
+                headers.connect(extract_header(height))
+        except (MissingHeader, IncorrectBits, InsufficientPoW) as e:
+            raise HeadersSnapshotError(f'invalid header at height {height:,d}: {e}')
+        finally:
+            headers.flush()
+    finally:
+        snapshot_mmap.close()
+
+    chain = headers.longest_chain()
+    logger.info(f'imported headers snapshot {file_path}; height is now {chain.height:,d}')
+    return chain
@@ -21,7 +21,13 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from collections import namedtuple
 import hashlib
+import hmac
+from itertools import repeat
+import os
+import threading
+import time
 from unicodedata import normalize
 
 from bitcoinx import (
@@ -74,6 +80,9 @@ class KeyStore:
                 if x_signatures[k] is not None:
                     # this pubkey already signed
                     continue
+                if x_pubkey in keypairs:
+                    # another input for the same address
+                    continue
                 derivation = self.get_pubkey_derivation(x_pubkey)
                 if not derivation:
                     continue
@@ -90,36 +99,147 @@ class KeyStore:
 
 
 
+def _zeroise(secrets):
+    '''Overwrite and forget a map of decrypted key material held in bytearrays.'''
+    for secret in secrets.values():
+        secret[:] = bytes(len(secret))
+    secrets.clear()
+
+
+class _UnlockedSession:
+    '''The decrypted key material of an unlocked keystore.  Only a salted hash of the
+    password that unlocked it is kept.
+
+    Python cannot erase the immutable copies made while decrypting and deriving keys, but
+    the session's own copies are overwritten when it ends.'''
+
+    def __init__(self, password, secrets, timeout):
+        self.salt = os.urandom(16)
+        self.password_hash = self._hash(password)
+        self.secrets = secrets
+        self.expiry = time.monotonic() + timeout
+
+    def _hash(self, password):
+        if password is None:
+            return None
+        if isinstance(password, str):
+            password = password.encode('utf8')
+        return hmac.new(self.salt, password, hashlib.sha256).digest()
+
+    def has_expired(self):
+        return time.monotonic() >= self.expiry
+
+    def accepts(self, password):
+        '''Signing without a password, or with the unlocking password, uses the session.'''
+        if password is None:
+            return True
+        return (self.password_hash is not None and
+                hmac.compare_digest(self._hash(password), self.password_hash))
+
+    def end(self):
+        _zeroise(self.secrets)
+        self.password_hash = None
+
+
 class Software_KeyStore(KeyStore):
 
     def __init__(self):
         KeyStore.__init__(self)
+        self._session = None
+        self._session_lock = threading.Lock()
 
     def may_have_password(self):
         return not self.is_watching_only()
 
     def sign_message(self, sequence, message, password):
-        privkey, compressed = self.get_private_key(sequence, password)
+        privkey, compressed = self.get_private_keys({0: sequence}, password)[0]
         key = PrivateKey(privkey, compressed)
         return key.sign_message(message)
 
     def decrypt_message(self, sequence, message, password):
-        privkey, compressed = self.get_private_key(sequence, password)
+        privkey, compressed = self.get_private_keys({0: sequence}, password)[0]
         key = PrivateKey(privkey)
         return key.decrypt_message(message)
 
-    def sign_transaction(self, tx, password):
+    def unlock(self, password, timeout=None):
+        '''Check the password and keep the decrypted key material for a signing session of
+        `timeout` seconds, by default the configured session timeout.  Until it times out or
+        lock() is called, signing decrypts nothing and needs no password.  Raises
+        InvalidPassword if the password is not correct.'''
+        if timeout is None:
+            timeout = app_state.config.get_session_timeout()
+        session = _UnlockedSession(password, self._decrypt_secrets(password), timeout)
+        timer = threading.Timer(timeout, self._end_session, (session, ))
+        timer.daemon = True
+        with self._session_lock:
+            if self._session is not None:
+                self._session.end()
+            self._session = session
+        timer.start()
+
+    def lock(self):
+        '''End any signing session, zeroising its key material.'''
+        self._end_session(self._session)
+
+    def is_unlocked(self):
+        with self._session_lock:
+            return self._live_session() is not None
+
+    def _end_session(self, session):
+        with self._session_lock:
+            if session is not None and session is self._session:
+                session.end()
+                self._session = None
+
+    def _live_session(self):
+        # Called with the session lock held
+        session = self._session
+        if session is not None and session.has_expired():
+            session.end()
+            session = self._session = None
+        return session
+
+    def get_private_keys(self, derivations, password):
+        '''Takes a map of x_pubkey to derivation, as returned by get_tx_derivations(), and
+        returns a map of x_pubkey to (private key bytes, compressed) pairs.  Raises
+        InvalidPassword if the password is not correct.
+
+        An unlocked keystore derives the keys from its session's key material.
+        '''
+        with self._session_lock:
+            session = self._live_session()
+            if session is not None and session.accepts(password):
+                return self._private_keys_from_secrets(session.secrets, derivations)
+        return self._decrypt_private_keys(derivations, password)
+
+    def _decrypt_secrets(self, password):
+        '''Return a map of name to bytearray of the key material the keystore's private keys
+        are derived from.  Raises InvalidPassword.'''
+        raise NotImplementedError
+
+    def _private_keys_from_secrets(self, secrets, derivations):
+        '''As for get_private_keys(), but derived from the key material.'''
+        raise NotImplementedError
+
+    def _decrypt_private_keys(self, derivations, password):
+        # Decrypt the key material once for all the keys
+        secrets = self._decrypt_secrets(password)
+        try:
+            return self._private_keys_from_secrets(secrets, derivations)
+        finally:
+            _zeroise(secrets)
+
+    def sign_transaction(self, tx, password, executor=None):
         if self.is_watching_only():
             return
-        # Raise if password is not correct.
-        self.check_password(password)
-        # Add private keys
-        keypairs = self.get_tx_derivations(tx)
-        for k, v in keypairs.items():
-            keypairs[k] = self.get_private_key(v, password)
-        # Sign
-        if keypairs:
-            tx.sign(keypairs)
+        # Raises if password is not correct.
+        keypairs = self.get_private_keys(self.get_tx_derivations(tx), password)
+        try:
+            if keypairs:
+                tx.sign(keypairs, executor)
+        finally:
+            # Drop our references to the keys as soon as signing is done
+            keypairs.clear()
 
 
 class Imported_KeyStore(Software_KeyStore):
@@ -181,16 +301,23 @@ class Imported_KeyStore(Software_KeyStore):
         pubkey = _public_key_from_private_key_text(privkey_text)
         self.keypairs[pubkey] = pw_encode(privkey_text, password)
         self._sorted = None
+        # A session would not know the new key
+        self.lock()
         return pubkey
 
     def delete_imported_key(self, key):
         self.keypairs.pop(key)
+        self.lock()
 
     def export_private_key(self, pubkey, password):
         '''Returns a WIF string'''
         privkey_text = pw_decode(self.keypairs[pubkey], password)
         # this checks the password
-        if pubkey != _public_key_from_private_key_text(privkey_text):
+        try:
+            if pubkey != _public_key_from_private_key_text(privkey_text):
+                raise InvalidPassword()
+        except ValueError:
+            # Not decrypted, e.g. a password of None for an encrypted key
             raise InvalidPassword()
         return privkey_text
 
@@ -200,6 +327,23 @@ class Imported_KeyStore(Software_KeyStore):
         privkey = PrivateKey.from_text(privkey_text)
         return privkey.to_bytes(), privkey.is_compressed()
 
+    def _decrypt_secrets(self, password):
+        secrets = {}
+        for pubkey in self.keypairs:
+            privkey, compressed = self.get_private_key(pubkey, password)
+            secrets[pubkey] = bytearray(privkey + bytes([compressed]))
+        return secrets
+
+    def _private_keys_from_secrets(self, secrets, derivations):
+        return {x_pubkey: (bytes(secrets[pubkey][:32]), bool(secrets[pubkey][32]))
+                for x_pubkey, pubkey in derivations.items()}
+
+    def _decrypt_private_keys(self, derivations, password):
+        # Only decrypt the keys wanted
+        self.check_password(password)
+        return {x_pubkey: self.get_private_key(derivation, password)
+                for x_pubkey, derivation in derivations.items()}
+
     def get_pubkey_derivation(self, x_pubkey):
         if x_pubkey[0:2] in ['02', '03', '04']:
             pubkey = PublicKey.from_hex(x_pubkey)
@@ -263,24 +407,44 @@ class Deterministic_KeyStore(Software_KeyStore):
 
 class Xpub:
 
+    # The most derived public keys remembered for each chain; several gap limit windows
+    max_cached_pubkeys = 1000
+    # Chain nodes of the xpubs of x_pubkeys by serialized xpub and chain, as hex
+    _xpubkey_chain_keys = {}
+
     def __init__(self):
         self.xpub = None
-        self.xpub_receive = None
-        self.xpub_change = None
+        # (xpub, serialized xpub hex) as used in x_pubkeys
+        self._xpub_hex = None
+        # (xpub, (receiving chain BIP32PublicKey, change chain BIP32PublicKey))
+        self._chain_keys = None
+        # Derived public keys of the receiving and change chains by index
+        self._child_keys = ({}, {})
 
     def get_master_public_key(self):
         return self.xpub
 
+    def _chain_key(self, for_change):
+        if self._chain_keys is None or self._chain_keys[0] != self.xpub:
+            master_key = bip32_key_from_string(self.xpub)
+            self._chain_keys = (self.xpub, (master_key.child(0), master_key.child(1)))
+            self._child_keys = ({}, {})
+        return self._chain_keys[1][for_change]
+
+    def derive_public_key(self, for_change, n):
+        '''Returns the BIP32PublicKey at index n of the receiving or change chain.'''
+        chain_key = self._chain_key(for_change)
+        child_keys = self._child_keys[for_change]
+        public_key = child_keys.get(n)
+        if public_key is None:
+            public_key = chain_key.child_safe(n)
+            if len(child_keys) >= self.max_cached_pubkeys:
+                child_keys.pop(next(iter(child_keys)), None)
+            child_keys[n] = public_key
+        return public_key
+
     def derive_pubkey(self, for_change, n):
-        xpub = self.xpub_change if for_change else self.xpub_receive
-        if xpub is None:
-            xpub = bip32_key_from_string(self.xpub)
-            xpub = xpub.child(1 if for_change else 0).to_extended_key_string()
-            if for_change:
-                self.xpub_change = xpub
-            else:
-                self.xpub_receive = xpub
-        return self.get_pubkey_from_xpub(xpub, (n,))
+        return self.derive_public_key(for_change, n).to_hex()
 
     @classmethod
     def get_pubkey_from_xpub(self, xpub, sequence):
@@ -289,9 +453,31 @@ class Xpub:
             pubkey = pubkey.child_safe(n)
         return pubkey.to_hex()
 
+    @classmethod
+    def public_key_from_xpubkey(cls, x_pubkey):
+        '''Returns the BIP32PublicKey of an 'ff' x_pubkey.  The chain node is parsed and
+        derived once for all x_pubkeys of an xpub and chain.'''
+        assert x_pubkey[0:2] == 'ff'
+        assert len(x_pubkey) == 166
+        chain_keys = cls._xpubkey_chain_keys
+        chain_key = chain_keys.get(x_pubkey[2:162])
+        if chain_key is None:
+            xpub = base58_encode_check(bytes.fromhex(x_pubkey[2:158]))
+            chain_key = bip32_key_from_string(xpub).child_safe(
+                unpack_le_uint16(bytes.fromhex(x_pubkey[158:162]))[0])
+            if len(chain_keys) >= 100:
+                chain_keys.pop(next(iter(chain_keys)), None)
+            chain_keys[x_pubkey[2:162]] = chain_key
+        return chain_key.child_safe(unpack_le_uint16(bytes.fromhex(x_pubkey[162:166]))[0])
+
+    def _get_xpub_hex(self):
+        if self._xpub_hex is None or self._xpub_hex[0] != self.xpub:
+            self._xpub_hex = (self.xpub, base58_decode_check(self.xpub).hex())
+        return self._xpub_hex[1]
+
     def get_xpubkey(self, c, i):
         s = ''.join(int_to_hex(x,2) for x in (c, i))
-        return 'ff' + base58_decode_check(self.xpub).hex() + s
+        return 'ff' + self._get_xpub_hex() + s
 
     @classmethod
     def parse_xpubkey(self, pubkey):
@@ -315,12 +501,13 @@ class Xpub:
     def get_pubkey_derivation(self, x_pubkey):
         if x_pubkey[0:2] == 'fd':
             return self.get_pubkey_derivation_based_on_wallet_advice(x_pubkey)
-        if x_pubkey[0:2] != 'ff':
+        if x_pubkey[0:2] != 'ff' or self.xpub is None:
             return
-        xpub, derivation = self.parse_xpubkey(x_pubkey)
-        if self.xpub != xpub:
+        assert len(x_pubkey) == 166
+        # Compare serialized forms rather than base58 encoding the xpub in every x_pubkey
+        if x_pubkey[2:158] != self._get_xpub_hex():
             return
-        return derivation
+        return [unpack_le_uint16(bytes.fromhex(x_pubkey[n: n+4]))[0] for n in (158, 162)]
 
 
 class BIP32_KeyStore(Deterministic_KeyStore, Xpub):
@@ -344,13 +531,18 @@ class BIP32_KeyStore(Deterministic_KeyStore, Xpub):
     def get_master_private_key(self, password):
         return pw_decode(self.xprv, password)
 
-    def check_password(self, password):
+    def _decrypt_master_private_key(self, password):
         xprv = pw_decode(self.xprv, password)
         try:
-            assert (bip32_key_from_string(xprv).derivation().chain_code
+            xprv = bip32_key_from_string(xprv)
+            assert (xprv.derivation().chain_code
                     == bip32_key_from_string(self.xpub).derivation().chain_code)
         except (ValueError, AssertionError):
             raise InvalidPassword()
+        return xprv
+
+    def check_password(self, password):
+        self._decrypt_master_private_key(password)
 
     def update_password(self, old_password, new_password):
         self.check_password(old_password)
@@ -386,6 +578,29 @@ class BIP32_KeyStore(Deterministic_KeyStore, Xpub):
             privkey = privkey.child_safe(n)
         return privkey.to_bytes(), True
 
+    def _decrypt_secrets(self, password):
+        xprv = self._decrypt_master_private_key(password)
+        return {'xprv': bytearray(xprv.to_extended_key_string().encode())}
+
+    def _private_keys_from_secrets(self, secrets, derivations):
+        # Derive each branch (e.g. the change branch) once
+        xprv = bip32_key_from_string(secrets['xprv'].decode())
+        branches = {(): xprv}
+        try:
+            keypairs = {}
+            for x_pubkey, sequence in derivations.items():
+                path = tuple(sequence[:-1])
+                branch = branches.get(path)
+                if branch is None:
+                    branch = xprv
+                    for n in path:
+                        branch = branch.child_safe(n)
+                    branches[path] = branch
+                keypairs[x_pubkey] = branch.child_safe(sequence[-1]).to_bytes(), True
+            return keypairs
+        finally:
+            branches.clear()
+
     def set_wallet_advice(self, addr, advice): #overrides KeyStore.set_wallet_advice
         self.wallet_advice[addr] = advice
 
@@ -466,11 +681,19 @@ class Old_KeyStore(Deterministic_KeyStore):
         return be_bytes_to_int(sha256d(("%d:%d:"%(n, for_change)).encode('ascii') + bfh(mpk)))
 
     @classmethod
-    def get_pubkey_from_mpk(cls, mpk, for_change, n):
+    def public_key_from_mpk(cls, mpk, for_change, n):
         z = cls.get_sequence(mpk, for_change, n)
         master_public_key = cls._mpk_to_PublicKey(mpk)
-        public_key2 = master_public_key.add(int_to_be_bytes(z, 32))
-        return public_key2.to_hex(compressed=False)
+        # Uncompressed, as is the master public key
+        return master_public_key.add(int_to_be_bytes(z, 32))
+
+    @classmethod
+    def get_pubkey_from_mpk(cls, mpk, for_change, n):
+        return cls.public_key_from_mpk(mpk, for_change, n).to_hex(compressed=False)
+
+    def derive_public_key(self, for_change, n):
+        '''Returns the uncompressed PublicKey at index n of the receiving or change chain.'''
+        return self.public_key_from_mpk(self.mpk, for_change, n)
 
     def derive_pubkey(self, for_change, n):
         return self.get_pubkey_from_mpk(self.mpk, for_change, n)
@@ -481,14 +704,28 @@ class Old_KeyStore(Deterministic_KeyStore):
 
     def get_private_key(self, sequence, password):
         seed = self._get_hex_seed_bytes(password)
-        self.check_seed(seed)
-        for_change, n = sequence
         secexp = self.stretch_key(seed)
+        self._check_stretched_exponent(secexp)
+        for_change, n = sequence
         pk = self.get_private_key_from_stretched_exponent(for_change, n, secexp)
         return pk, False
 
+    def _decrypt_secrets(self, password):
+        # Stretching the seed is the expensive part; do it once for all keys
+        secexp = self.stretch_key(self._get_hex_seed_bytes(password))
+        self._check_stretched_exponent(secexp)
+        return {'secexp': bytearray(int_to_be_bytes(secexp, 32))}
+
+    def _private_keys_from_secrets(self, secrets, derivations):
+        secexp = be_bytes_to_int(secrets['secexp'])
+        return {x_pubkey: (self.get_private_key_from_stretched_exponent(for_change, n, secexp),
+                           False)
+                for x_pubkey, (for_change, n) in derivations.items()}
+
     def check_seed(self, seed):
-        secexp = self.stretch_key(seed)
+        self._check_stretched_exponent(self.stretch_key(seed))
+
+    def _check_stretched_exponent(self, secexp):
         master_private_key = PrivateKey(int_to_be_bytes(secexp, 32))
         master_public_key = master_private_key.public_key.to_bytes(compressed=False)[1:]
         if master_public_key != bfh(self.mpk):
@@ -650,6 +887,45 @@ def from_bip39_seed(seed, passphrase, derivation):
     k.add_xprv_from_seed(bip32_seed, derivation)
     return k
 
+
+# An account a seed might have been used with: its derivation path, extended public key and
+# the first addresses of its receiving chain
+AccountCandidate = namedtuple('AccountCandidate', 'derivation xpub addresses')
+
+
+def derive_account_candidates(bip32_seed, derivations, address_count=1, executor=None):
+    '''Return an AccountCandidate for each derivation path, deriving from the seed once.
+
+    Nodes shared by the paths, such as m/44'/0', are derived once.  The final step of each
+    path and its addresses are derived with executor.map if an executor is given.'''
+    root = BIP32PrivateKey.from_seed(bip32_seed, coin=Net.COIN)
+    paths = [tuple(bip32_decompose_chain_string(derivation)) for derivation in derivations]
+    nodes = {(): root}
+    for path in paths:
+        for n in range(1, len(path)):
+            if path[:n] not in nodes:
+                nodes[path[:n]] = nodes[path[:n - 1]].child_safe(path[n - 1])
+
+    # Parents are passed serialized so that the work can be pickled to a process pool
+    parents = [nodes[path[:-1]].to_extended_key_string() for path in paths]
+    last_steps = [path[-1] if path else None for path in paths]
+    if executor is None:
+        return list(map(_account_candidate, derivations, parents, last_steps,
+                        repeat(address_count)))
+    return list(executor.map(_account_candidate, derivations, parents, last_steps,
+                             repeat(address_count)))
+
+
+def _account_candidate(derivation, parent_xprv, last_step, address_count):
+    '''Return the AccountCandidate of the child last_step of the extended private key
+    parent_xprv, or of the key itself if last_step is None.'''
+    xprv = bip32_key_from_string(parent_xprv)
+    if last_step is not None:
+        xprv = xprv.child_safe(last_step)
+    receiving = xprv.public_key.child_safe(0)
+    addresses = [Address.from_pubkey(receiving.child_safe(n)) for n in range(address_count)]
+    return AccountCandidate(derivation, xprv.public_key.to_extended_key_string(), addresses)
+
 # extended pubkeys
 
 def is_xpubkey(x_pubkey):
@@ -668,8 +944,8 @@ def xpubkey_to_address(x_pubkey):
     if x_pubkey[0:2] in ['02', '03', '04']:
         pubkey = x_pubkey
     elif x_pubkey[0:2] == 'ff':
-        xpub, s = BIP32_KeyStore.parse_xpubkey(x_pubkey)
-        pubkey = BIP32_KeyStore.get_pubkey_from_xpub(xpub, s)
+        public_key = BIP32_KeyStore.public_key_from_xpubkey(x_pubkey)
+        return public_key.to_hex(), Address.from_pubkey(public_key)
     elif x_pubkey[0:2] == 'fe':
         mpk, s = Old_KeyStore.parse_xpubkey(x_pubkey)
         pubkey = Old_KeyStore.get_pubkey_from_mpk(mpk, s[0], s[1])
@@ -705,7 +981,7 @@ def load_keystore(storage, name):
 
 def is_address_list(text):
     parts = text.split()
-    return parts and all(Address.is_valid(x) for x in parts)
+    return parts and None not in Address.decode_strings(parts)
 
 
 def get_private_keys(text):
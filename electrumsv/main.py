@@ -27,6 +27,7 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import multiprocessing
 import os
 import sys
 import time
@@ -200,6 +201,17 @@ def init_cmdline(config_options, server):
         new_password = prompt_password('New password:')
         config_options['new_password'] = new_password
 
+    # Keep seeds out of shell history and process listings
+    if cmd.name == 'discoveraccounts' and not config.get('seed'):
+        if sys.stdin.isatty():
+            seed = prompt_password('Seed (will not echo):', False)
+        else:
+            seed = sys.stdin.read()
+        if not seed or not seed.strip():
+            print("Error: Seed required")
+            sys.exit(1)
+        config_options['seed'] = seed.strip()
+
     return cmd, password
 
 
@@ -274,6 +286,7 @@ def run_app_with_daemon(fd, is_gui, config_options):
             # Shut down the daemon before exiting the async loop
             d.stop()
             d.join()
+            app_state.shutdown_signing_executor()
     sys.exit(0)
 
 
@@ -303,6 +316,9 @@ def enforce_requirements():
 
 
 def main():
+    # Frozen builds run this executable for the signing worker processes, which must not
+    # start the application
+    multiprocessing.freeze_support()
     enforce_requirements()
     setup_windows_console()
 
@@ -22,7 +22,8 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+import concurrent.futures
 from contextlib import suppress
 from enum import IntEnum
 from functools import partial
@@ -37,7 +38,7 @@ import time
 import certifi
 from aiorpcx import (
     connect_rs, RPCSession, Notification, BatchError, RPCError, CancelledError, SOCKSError,
-    TaskTimeout, TaskGroup, handler_invocation, sleep, ignore_after, timeout_after,
+    TaskTimeout, TaskGroup, handler_invocation, sleep, ignore_after, timeout_after, run_in_thread,
     SOCKS4a, SOCKS5, SOCKSProxy, SOCKSUserAuth
 )
 from bitcoinx import (
@@ -46,6 +47,8 @@ from bitcoinx import (
 )
 
 from .app_state import app_state
+from .bitcoin import history_status
+from .exceptions import InvalidPassword
 from .i18n import _
 from .logs import logs
 from .transaction import Transaction
@@ -63,14 +66,33 @@ HEADERS_SUBSCRIBE = 'blockchain.headers.subscribe'
 REQUEST_MERKLE_PROOF = 'blockchain.transaction.get_merkle'
 SCRIPTHASH_HISTORY = 'blockchain.scripthash.get_history'
 SCRIPTHASH_SUBSCRIBE = 'blockchain.scripthash.subscribe'
+TRANSACTION_BROADCAST = 'blockchain.transaction.broadcast'
+# Script hash subscriptions are sent in batches of this size
+SUBSCRIBE_BATCH_SIZE = 200
+# Script hash histories not for a wallet are requested in batches of this size
+HISTORY_BATCH_SIZE = 200
+# How long a server's banner, donation address and peers are cached
+SERVER_INFO_TTL = 6 * 3600
+# Servers learnt from peers that have not been good for this long are forgotten
+SERVER_TTL = 14 * ONE_DAY
+# Transactions of a broadcast chain are sent in batches of this size
+BROADCAST_BATCH_SIZE = 100
+# How many times a transaction of a broadcast chain is sent before it is failed
+BROADCAST_ATTEMPTS = 5
+# How often, in seconds, wallets are checked for small coins to consolidate
+CONSOLIDATION_INTERVAL = 600
+# Broadcast errors meaning the server already has the transaction
+BROADCAST_TX_KNOWN = ('txn-already-in-mempool', 'txn-already-known')
+# Broadcast errors that sending the transaction's parents first can cure
+BROADCAST_TX_MISSING_INPUTS = ('Missing inputs', 'Inputs unavailable')
+BROADCAST_TX_CHAIN_TOO_LONG = _('too many of its ancestors are unconfirmed')
 BROADCAST_TX_MSG_LIST = (
     ('dust', _('very small "dust" payments')),
     (('Missing inputs', 'Inputs unavailable', 'bad-txns-inputs-spent'),
      _('missing, already-spent, or otherwise invalid coins')),
     ('insufficient priority', _('insufficient fees or priority')),
     ('bad-txns-premature-spend-of-coinbase', _('attempt to spend an unmatured coinbase')),
-    (('txn-already-in-mempool', 'txn-already-known'),
-     _("it already exists in the server's mempool")),
+    (BROADCAST_TX_KNOWN, _("it already exists in the server's mempool")),
     ('txn-mempool-conflict', _("it conflicts with one already in the server's mempool")),
     ('bad-txns-nonstandard-inputs', _('use of non-standard input scripts')),
     ('absurdly-high-fee', _('fee is absurdly high')),
@@ -81,21 +103,44 @@ BROADCAST_TX_MSG_LIST = (
     ('bare-multisig', _('it contains a bare multisig input')),
     ('multi-op-return', _('it contains more than 1 OP_RETURN input')),
     ('scriptsig-not-pushonly', _('a scriptsig is not simply data')),
-    ('bad-txns-nonfinal', _("transaction is not final"))
+    ('bad-txns-nonfinal', _("transaction is not final")),
+    ('too-long-mempool-chain', BROADCAST_TX_CHAIN_TOO_LONG),
 )
 
 
+def _broadcast_error_matches(exception, in_msgs):
+    if isinstance(in_msgs, str):
+        in_msgs = (in_msgs, )
+    return isinstance(exception, RPCError) and any(in_msg in exception.message
+                                                   for in_msg in in_msgs)
+
+
 def broadcast_failure_reason(exception):
-    if isinstance(exception, RPCError):
-        msg = exception.message
-        for in_msgs, out_msg in BROADCAST_TX_MSG_LIST:
-            if isinstance(in_msgs, str):
-                in_msgs = (in_msgs, )
-            if any(in_msg in msg for in_msg in in_msgs):
-                return out_msg
+    for in_msgs, out_msg in BROADCAST_TX_MSG_LIST:
+        if _broadcast_error_matches(exception, in_msgs):
+            return out_msg
     return _('reason unknown')
 
 
+def broadcast_failure_retryable(exception, parent_sent):
+    '''Return True if sending a transaction whose broadcast failed with exception again might
+    succeed.  parent_sent is True if a transaction it spends was sent alongside it, in which
+    case the server may not have accepted the parent when it checked the child's inputs.
+    '''
+    if not isinstance(exception, RPCError):
+        # Timeouts and lost connections
+        return True
+    return parent_sent and _broadcast_error_matches(exception, BROADCAST_TX_MISSING_INPUTS)
+
+
+class BroadcastStatus(IntEnum):
+    '''The status of a transaction of a broadcast chain.'''
+    queued = 0
+    sent = 1
+    accepted = 2
+    failed = 3
+
+
 class SwitchReason(IntEnum):
     '''The reason the main server was changed.'''
     disconnected = 0
@@ -103,6 +148,11 @@ class SwitchReason(IntEnum):
     user_set = 2
 
 
+# The argument of 'payment_received' callbacks, triggered when an unconfirmed transaction
+# paying a wallet address is fetched.  The address is an Address and the amount in satoshis.
+PaymentReceived = namedtuple('PaymentReceived', 'tx_hash address amount')
+
+
 def _require_list(obj):
     assert isinstance(obj, (tuple, list))
     return obj
@@ -118,13 +168,6 @@ def _require_string(obj):
     return obj
 
 
-def _history_status(history):
-    if not history:
-        return None
-    status = ''.join(f'{tx_hash}:{tx_height}:' for tx_hash, tx_height in history)
-    return sha256(status.encode()).hex()
-
-
 def _root_from_proof(hash, branch, index):
     '''From ElectrumX.'''
     for elt in branch:
@@ -148,13 +191,29 @@ class DisconnectSessionError(Exception):
 class SVServerState:
     '''The run-time state of an SVServer.'''
 
+    # Assumed round trip time of a server we have no measurements for
+    UNKNOWN_RTT = 1.0
+    # Smoothing factors of the exponential moving averages
+    RTT_ALPHA = 0.3
+    ERROR_ALPHA = 0.05
+    THROUGHPUT_ALPHA = 0.3
+
     def __init__(self):
         self.banner = ''
         self.donation_address = ''
+        self.first_try = 0
         self.last_try = 0
         self.last_good = 0
         self.last_blacklisted = 0
         self.retry_delay = 0
+        self.peers = []
+        # When the banner, donation address and peers were last fetched
+        self.last_info_fetch = 0
+        # Performance telemetry; moving averages.  avg_rtt and bytes_per_sec are None until
+        # first measured
+        self.avg_rtt = None
+        self.error_rate = 0.0
+        self.bytes_per_sec = None
 
     def can_retry(self, now):
         return not self.is_blacklisted(now) and self.last_try + self.retry_delay < now
@@ -162,11 +221,52 @@ class SVServerState:
     def is_blacklisted(self, now):
         return self.last_blacklisted > now - ONE_DAY
 
+    def is_info_fresh(self, now):
+        return self.last_info_fetch > now - SERVER_INFO_TTL
+
+    def is_stale(self, now):
+        '''True if the server has been tried but not good for SERVER_TTL, counting from when
+        it was first tried if it has never been good.'''
+        # States saved before first_try was recorded fall back to last_try
+        good_or_tried = self.last_good or self.first_try or self.last_try
+        return self.last_try > self.last_good and good_or_tried < now - SERVER_TTL
+
+    @staticmethod
+    def _moving_average(average, value, alpha):
+        if average is None:
+            return value
+        return average + alpha * (value - average)
+
+    def record_rtt(self, seconds):
+        self.avg_rtt = self._moving_average(self.avg_rtt, seconds, self.RTT_ALPHA)
+
+    def record_request(self, succeeded):
+        self.error_rate = self._moving_average(self.error_rate, 0.0 if succeeded else 1.0,
+                                               self.ERROR_ALPHA)
+
+    def record_throughput(self, size, seconds):
+        if size and seconds > 0:
+            self.bytes_per_sec = self._moving_average(self.bytes_per_sec, size / seconds,
+                                                      self.THROUGHPUT_ALPHA)
+
+    def score(self):
+        '''The expected cost of using the server; lower is better.  Unmeasured servers get a
+        neutral score so they are still tried.'''
+        rtt = self.UNKNOWN_RTT if self.avg_rtt is None else self.avg_rtt
+        return rtt * (1 + 10 * self.error_rate)
+
     def to_json(self):
         return {
+            'first_try': int(self.first_try),
             'last_try': int(self.last_try),
             'last_good': int(self.last_good),
             'last_blacklisted': int(self.last_blacklisted),
+            'last_info_fetch': int(self.last_info_fetch),
+            'banner': self.banner,
+            'donation_address': self.donation_address,
+            'avg_rtt': None if self.avg_rtt is None else round(self.avg_rtt, 4),
+            'error_rate': round(self.error_rate, 4),
+            'bytes_per_sec': None if self.bytes_per_sec is None else int(self.bytes_per_sec),
         }
 
     @classmethod
@@ -249,6 +349,8 @@ class SVServer:
         logger.info('connecting...')
 
         self.state.last_try = time.time()
+        if not self.state.first_try:
+            self.state.first_try = self.state.last_try
         session_factory = partial(SVSession, network, self, logger)
         async with self._connector(session_factory, proxy=network.proxy) as session:
             try:
@@ -256,6 +358,7 @@ class SVServer:
             except DisconnectSessionError as error:
                 await session.disconnect(str(error), blacklist=error.blacklist)
             except (RPCError, BatchError, TaskTimeout) as error:
+                self.state.record_request(False)
                 await session.disconnect(str(error))
         logger.info('disconnected')
 
@@ -439,7 +542,9 @@ class SVSession(RPCSession):
     async def _negotiate_protocol(self):
         '''Raises: RPCError, TaskTimeout'''
         args = (PACKAGE_VERSION, PROTOCOL_VERSION)
+        start = time.time()
         self.version = await self.send_request('server.version', args)
+        self.server.state.record_rtt(time.time() - start)
         self.logger.debug(f'negotiated protocol: {self.version}')
 
     async def _get_checkpoint_headers(self):
@@ -501,7 +606,9 @@ class SVSession(RPCSession):
             await sleep(self._secs_to_next_ping())
             if self._secs_to_next_ping() < 1:
                 self.logger.debug(f'sending {method}')
+                start = time.time()
                 await self.send_request(method)
+                self.server.state.record_rtt(time.time() - start)
 
     def _check_header_proof(self, hex_root, branch, raw_header, height):
         '''Raises: DisconnectSessionError'''
@@ -578,10 +685,17 @@ class SVSession(RPCSession):
         while height < tip.height:
             height = await self._request_chunk(height + 1, 2016)
 
-    async def _subscribe_to_script_hash(self, script_hash):
-        '''Raises: RPCError, TaskTimeout'''
-        status = await self.send_request(SCRIPTHASH_SUBSCRIBE, [script_hash])
-        await self._on_status_changed(script_hash, status)
+    async def _subscribe_to_script_hashes(self, script_hashes):
+        '''Subscribe to the script hashes in a single batch, then request the history of those
+        whose status differs from the wallet's.
+
+        Raises: RPCError, BatchError, TaskTimeout'''
+        async with self.send_batch(raise_errors=True) as batch:
+            for script_hash in script_hashes:
+                batch.add_request(SCRIPTHASH_SUBSCRIBE, [script_hash])
+        async with TaskGroup() as group:
+            for script_hash, status in zip(script_hashes, batch.results):
+                await group.spawn(self._on_status_changed(script_hash, status))
 
     async def _on_status_changed(self, script_hash, status):
         address = self._address_map.get(script_hash)
@@ -591,8 +705,7 @@ class SVSession(RPCSession):
 
         # Wallets needing a notification
         wallets = [wallet for wallet, subs in self._subs_by_wallet.items()
-                   if script_hash in subs and
-                   _history_status(wallet.get_address_history(address)) != status]
+                   if script_hash in subs and wallet.get_address_status(address) != status]
         if not wallets:
             return
 
@@ -610,7 +723,7 @@ class SVSession(RPCSession):
 
         # Check the status; it can change legitimately between initial notification and
         # history request
-        hstatus = _history_status(history)
+        hstatus = history_status(history)
         if hstatus != status:
             self.logger.warning(f'history status mismatch {hstatus} vs {status} for {address}')
 
@@ -619,16 +732,21 @@ class SVSession(RPCSession):
 
     async def _main_server_batch(self):
         '''Raises: DisconnectSessionError, BatchError, TaskTimeout'''
+        server = self.server
+        now = time.time()
+        if server.state.is_info_fresh(now):
+            self._network.trigger_callback('banner')
+            return
         async with timeout_after(10):
             async with self.send_batch(raise_errors=True) as batch:
                 batch.add_request('server.banner')
                 batch.add_request('server.donation_address')
                 batch.add_request('server.peers.subscribe')
-        server = self.server
         try:
             server.state.banner = _require_string(batch.results[0])
             server.state.donation_address = _require_string(batch.results[1])
             server.state.peers = self._parse_peers_subscribe(batch.results[2])
+            server.state.last_info_fetch = now
             self._network.trigger_callback('banner')
         except AssertionError as e:
             raise DisconnectSessionError(f'main server requests bad batch response: {e}')
@@ -782,40 +900,68 @@ class SVSession(RPCSession):
                 result[height] = header_at_height(self.chain, height)
         return result
 
+    async def _send_tracked_request(self, method, args):
+        '''Send a request, recording its success or failure in the server's error rate.
+
+        Raises: RPCError, TaskTimeout'''
+        try:
+            result = await self.send_request(method, args)
+        except (RPCError, TaskTimeout):
+            self.server.state.record_request(False)
+            raise
+        self.server.state.record_request(True)
+        return result
+
     async def request_tx(self, tx_hash):
         '''Raises: RPCError, TaskTimeout'''
-        return await self.send_request('blockchain.transaction.get', [tx_hash])
+        return await self._send_tracked_request('blockchain.transaction.get', [tx_hash])
 
     async def request_proof(self, *args):
         '''Raises: RPCError, TaskTimeout'''
-        return await self.send_request(REQUEST_MERKLE_PROOF, args)
+        return await self._send_tracked_request(REQUEST_MERKLE_PROOF, args)
 
     async def request_history(self, script_hash):
         '''Raises: RPCError, TaskTimeout'''
-        return await self.send_request(SCRIPTHASH_HISTORY, [script_hash])
+        return await self._send_tracked_request(SCRIPTHASH_HISTORY, [script_hash])
+
+    async def request_histories(self, script_hashes):
+        '''Request the histories of the script hashes in a single batch.
+
+        Raises: RPCError, BatchError, TaskTimeout'''
+        async with self.send_batch(raise_errors=True) as batch:
+            for script_hash in script_hashes:
+                batch.add_request(SCRIPTHASH_HISTORY, [script_hash])
+        return batch.results
 
     async def subscribe_to_pairs(self, wallet, pairs):
         '''pairs is an iterable of (address, script_hash) pairs.
 
-        Raises: RPCError, TaskTimeout'''
+        Raises: RPCError, BatchError, TaskTimeout'''
         # Set notification handler
         self._handlers[SCRIPTHASH_SUBSCRIBE] = self._on_status_changed
         if wallet not in self._subs_by_wallet:
             self._subs_by_wallet[wallet] = []
         # Take reference so wallet can be unsubscribed asynchronously without conflict
         subs = self._subs_by_wallet[wallet]
+        pairs = list(pairs)
         async with TaskGroup() as group:
             wallet.request_count += len(pairs)
             wallet.progress_event.set()
             for address, script_hash in pairs:
                 subs.append(script_hash)
-                # Send request even if already subscribed, as our user expects a response
-                # to trigger other actions and won't get one if we swallow it.
                 self._address_map[script_hash] = address
-                await group.spawn(self._subscribe_to_script_hash(script_hash))
-
-            while await group.next_done():
-                wallet.response_count += 1
+            # Send requests even if already subscribed, as our user expects a response
+            # to trigger other actions and won't get one if we swallow it.
+            batch_sizes = {}
+            for start in range(0, len(pairs), SUBSCRIBE_BATCH_SIZE):
+                script_hashes = [script_hash for _address, script_hash
+                                 in pairs[start: start + SUBSCRIBE_BATCH_SIZE]]
+                task = await group.spawn(self._subscribe_to_script_hashes(script_hashes))
+                batch_sizes[task] = len(script_hashes)
+
+            while batch_sizes:
+                task = await group.next_done()
+                wallet.response_count += batch_sizes.pop(task)
                 wallet.progress_event.set()
         # A wallet shouldn't be subscribing the same address twice
         assert len(set(subs)) == len(subs)
@@ -846,6 +992,8 @@ class Network:
 
         # Add a wallet, remove a wallet, or redo all wallet verifications
         self.wallet_jobs = app_state.async_.queue()
+        # Chains of transactions to broadcast
+        self.broadcast_jobs = app_state.async_.queue()
 
         # Callbacks and their lock
         self.callbacks = defaultdict(list)
@@ -866,6 +1014,7 @@ class Network:
                 await group.spawn(self._monitor_lagging_sessions)
                 await group.spawn(self._monitor_main_chain)
                 await group.spawn(self._monitor_wallets, group)
+                await group.spawn(self._process_broadcasts)
         finally:
             app_state.config.set_key('servers', list(SVServer.all_servers.values()), True)
 
@@ -927,7 +1076,7 @@ class Network:
             logger.warning(f'no good servers available')
         elif self.main_server not in good_servers:
             if self.auto_connect():
-                await self._set_main_server(random.choice(good_servers), reason)
+                await self._set_main_server(self._fastest_server(good_servers), reason)
             else:
                 logger.warning(f'main server {self.main_server} is not good, but '
                                f'retaining it because auto-connect is off')
@@ -995,6 +1144,7 @@ class Network:
     def _read_config(self):
         # Remove obsolete key
         app_state.config.set_key('server_blacklist', None)
+        self._forget_stale_servers(time.time())
         count = len(SVServer.all_servers)
         logger.info(f'read {count:,d} servers from config file')
         if count < 5:
@@ -1021,8 +1171,32 @@ class Network:
         logger.info(f'main server: {main_server}; proxy: {proxy}')
         return main_server, proxy
 
-    async def _request_transactions(self, wallet):
-        missing_hashes = wallet.missing_transactions()
+    def _forget_stale_servers(self, now):
+        '''Forget servers learnt from peers that have not been good for SERVER_TTL, so that
+        the cached server list stays one of known-good servers.'''
+        main_server = app_state.config.get('server', None)
+        if isinstance(main_server, str):
+            try:
+                main_server = SVServer.from_string(main_server)
+            except Exception:
+                pass
+        stale_keys = [key for key, server in SVServer.all_servers.items()
+                      if server.host not in Net.DEFAULT_SERVERS and server != main_server
+                      and server.state.is_stale(now)]
+        for key in stale_keys:
+            del SVServer.all_servers[key]
+        if stale_keys:
+            logger.info(f'forgot {len(stale_keys):,d} stale servers')
+
+    async def _request_transactions(self, wallet, full_scan):
+        '''Fetch the transactions queued by the wallet when it received new history.  If
+        full_scan is True all transactions the wallet lacks are fetched; this scans the whole
+        transaction cache so is only done on startup and after timeouts.
+
+        Returns True if a request timed out.'''
+        missing_hashes = wallet.pop_pending_transactions()
+        if full_scan:
+            missing_hashes.update(wallet.missing_transactions())
         if not missing_hashes:
             return False
         wallet.request_count += len(missing_hashes)
@@ -1030,6 +1204,9 @@ class Network:
         had_timeout = False
         session = await self._main_session()
         session.logger.debug(f'requesting {len(missing_hashes)} missing transactions')
+        start = time.time()
+        received_size = 0
+        failed_hashes = []
         async with TaskGroup() as group:
             tasks = {}
             for tx_hash in missing_hashes:
@@ -1041,28 +1218,55 @@ class Network:
                 wallet.progress_event.set()
                 tx_hash = tasks.pop(task)
                 try:
-                    tx = Transaction(task.result())
-                    # Check it can be deserialized
-                    tx.deserialize()
-                    session.logger.debug(f'received tx {tx_hash} bytes: {len(tx.raw)}')
+                    tx_bytes = bytes.fromhex(task.result())
+                    received_size += len(tx_bytes)
+                    # Checking the hash proves it is the transaction asked for, so there is no
+                    # need to parse it here; the wallet parses it once when adding it
+                    if hash_to_hex_str(double_sha256(tx_bytes)) != tx_hash:
+                        raise ValueError('server returned a transaction with the wrong hash')
+                    tx = Transaction(tx_bytes)
+                    session.logger.debug(f'received tx {tx_hash} bytes: {len(tx_bytes)}')
+                    # Parses the transaction, so a malformed one is requeued like a failed fetch
+                    wallet.add_transaction(tx_hash, tx)
                 except CancelledError:
                     had_timeout = True
                 except Exception as e:
                     logger.error(f'fetching transaction {tx_hash}: {e}')
+                    failed_hashes.append(tx_hash)
                 else:
-                    wallet.add_transaction(tx_hash, tx)
                     self.trigger_callback('new_transaction', tx, wallet)
+                    self._notify_payments(wallet, tx_hash)
+        wallet.requeue_transactions(failed_hashes)
+        session.server.state.record_throughput(received_size, time.time() - start)
         return had_timeout
 
+    def _notify_payments(self, wallet, tx_hash):
+        '''Trigger a 'payment_received' callback for each wallet address an unconfirmed
+        transaction pays.'''
+        height, _conf, _timestamp = wallet.get_tx_height(tx_hash)
+        if height > 0:
+            return
+        for address, amount in wallet.get_received_payments(tx_hash).items():
+            logger.info(f'payment of {amount:,d} sats to {address} in {tx_hash}')
+            self.trigger_callback('payment_received', wallet,
+                                  PaymentReceived(tx_hash, address, amount))
+
     def _available_servers(self, protocol):
         now = time.time()
         unchosen = set(SVServer.all_servers.values()).difference(self.chosen_servers)
         return [server for server in unchosen
                 if server.protocol == protocol and server.state.can_retry(now)]
 
+    def _fastest_server(self, servers):
+        return min(servers, key=lambda server: server.state.score())
+
     def _random_server_nowait(self, protocol):
+        '''A random available server, favouring those with low latency and error rates.'''
         servers = self._available_servers(protocol)
-        return random.choice(servers) if servers else None
+        if not servers:
+            return None
+        weights = [1 / max(server.state.score(), 0.001) for server in servers]
+        return random.choices(servers, weights)[0]
 
     async def _random_server(self, protocol):
         while True:
@@ -1112,14 +1316,16 @@ class Network:
 
     async def _monitor_txs(self, wallet):
         '''Raises: RPCError, BatchError, TaskTimeout, DisconnectSessionError'''
+        full_scan = True
         while True:
             async with TaskGroup() as group:
                 tasks = (
-                    await group.spawn(self._request_transactions(wallet)),
+                    await group.spawn(self._request_transactions(wallet, full_scan)),
                     await group.spawn(self._request_proofs(wallet)),
                 )
             # Try again if a request timed out
-            if any(task.result() for task in tasks):
+            full_scan = any(task.result() for task in tasks)
+            if full_scan:
                 continue
             await wallet.txs_changed_event.wait()
             wallet.txs_changed_event.clear()
@@ -1136,6 +1342,63 @@ class Network:
             await session.subscribe_to_pairs(wallet, pairs)
             addresses = await wallet.new_addresses()
 
+    async def _consolidate_coins(self, wallet):
+        '''Periodically look for small coins to merge, as set by the config's consolidation
+        mode.  A transaction is broadcast only if the wallet can sign it without a password,
+        either because it has none or it is unlocked; otherwise it is proposed with the
+        'consolidation_proposed' callback.  A failed pass is logged and does not stop later
+        passes.'''
+        config = app_state.config
+        while True:
+            await sleep(CONSOLIDATION_INTERVAL)
+            mode = config.get_consolidation_mode()
+            if not wallet.is_synchronized():
+                continue
+            try:
+                wallet.release_settled_coins()
+                if mode == 'off':
+                    continue
+                # Gathering input information and signing are slow for many coins
+                plan = await run_in_thread(self._make_consolidation, wallet, mode, config)
+                if plan is None:
+                    continue
+                tx, coins = plan
+                if tx.is_complete():
+                    logger.info(f'consolidating {len(coins):,d} coins of {wallet} in '
+                                f'{tx.txid()}')
+                    # Keep payments from spending the coins until the consolidation is
+                    # confirmed or dropped
+                    wallet.reserve_coins(tx.txid(), coins)
+
+                    def on_status(tx_id, status, reason, _error):
+                        if status == BroadcastStatus.failed:
+                            logger.error(f'consolidation {tx_id} failed: {reason}')
+                            wallet.release_coins(tx_id)
+
+                    self.broadcast_chain([tx], on_status)
+                else:
+                    self.trigger_callback('consolidation_proposed', wallet, tx)
+            except CancelledError:
+                raise
+            except Exception:
+                logger.exception(f'consolidating coins of {wallet} failed')
+
+    def _make_consolidation(self, wallet, mode, config):
+        '''Return the consolidation transaction and the coins it spends, signed if mode is
+        'auto' and the wallet can sign without a password, or None if there is nothing to
+        consolidate.  Blocks, so run it in a thread.'''
+        plan = wallet.make_consolidation_transaction(
+            wallet.get_spendable_coins(None, config), config)
+        if plan is not None and (mode == 'auto' and not wallet.is_watching_only()
+                                 and not wallet.is_hardware_wallet()
+                                 and (not wallet.has_password() or wallet.is_unlocked())):
+            try:
+                wallet.sign_transaction(plan[0], None)
+            except InvalidPassword:
+                # The wallet's signing session ended
+                pass
+        return plan
+
     async def _maintain_wallet(self, wallet):
         '''Put all tasks for a single wallet in a group so they can be cancelled together.'''
         logger.info(f'maintaining wallet {wallet}')
@@ -1146,6 +1409,7 @@ class Network:
                         await group.spawn(self._monitor_txs, wallet)
                         await group.spawn(self._monitor_addresses, wallet)
                         await group.spawn(wallet.synchronize_loop)
+                        await group.spawn(self._consolidate_coins, wallet)
                 except (RPCError, BatchError, DisconnectSessionError, TaskTimeout) as error:
                     blacklist = isinstance(error, DisconnectSessionError) and error.blacklist
                     session = self.main_session()
@@ -1155,6 +1419,79 @@ class Network:
             SVSession.unsubscribe_wallet(wallet)
             logger.info(f'stopped maintaining wallet {wallet}')
 
+    async def _process_broadcasts(self):
+        while True:
+            transactions, callback, future = await self.broadcast_jobs.get()
+            try:
+                future.set_result(await self._broadcast_chain(transactions, callback))
+            except CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+
+    async def _broadcast_chain(self, transactions, callback):
+        '''Broadcast transactions in order, a batch at a time, each batch being sent without
+        waiting for the server to accept each transaction before sending the next.  A server
+        may check a batch's transactions concurrently, so a child rejected for missing inputs
+        its parent was sent alongside is sent again with the next batch.
+        '''
+        tx_ids = [tx.txid() for tx in transactions]
+        positions = {tx_id: n for n, tx_id in enumerate(tx_ids)}
+        parents = [{positions[hash_to_hex_str(txin.prev_hash)] for txin in tx.inputs()
+                    if hash_to_hex_str(txin.prev_hash) in positions} for tx in transactions]
+        results = [[tx_id, BroadcastStatus.queued, None, None] for tx_id in tx_ids]
+        attempts = [0] * len(transactions)
+
+        def set_status(n, status, reason=None, error=None):
+            results[n][1:] = status, reason, error
+            if callback:
+                callback(tx_ids[n], status, reason, error)
+
+        pending = list(range(len(transactions)))
+        while pending:
+            batch_indices = []
+            for n in pending[:BROADCAST_BATCH_SIZE]:
+                if any(results[p][1] == BroadcastStatus.failed for p in parents[n]):
+                    set_status(n, BroadcastStatus.failed,
+                               _('it spends a transaction that was not sent'))
+                else:
+                    batch_indices.append(n)
+            pending = pending[BROADCAST_BATCH_SIZE:]
+            if not batch_indices:
+                continue
+
+            session = await self._main_session()
+            for n in batch_indices:
+                attempts[n] += 1
+                set_status(n, BroadcastStatus.sent)
+            try:
+                async with session.send_batch() as batch:
+                    for n in batch_indices:
+                        batch.add_request(TRANSACTION_BROADCAST, [str(transactions[n])])
+                outcomes = batch.results
+            except CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'error broadcasting {len(batch_indices):,d} transactions: {e}')
+                outcomes = [e] * len(batch_indices)
+
+            sent = set(batch_indices)
+            retries = []
+            for n, outcome in zip(batch_indices, outcomes):
+                if (not isinstance(outcome, Exception)
+                        or _broadcast_error_matches(outcome, BROADCAST_TX_KNOWN)):
+                    set_status(n, BroadcastStatus.accepted)
+                elif (attempts[n] < BROADCAST_ATTEMPTS and
+                      broadcast_failure_retryable(outcome, not parents[n].isdisjoint(sent))):
+                    retries.append(n)
+                else:
+                    logger.info(f'broadcast of {tx_ids[n]} failed: {outcome}')
+                    set_status(n, BroadcastStatus.failed, broadcast_failure_reason(outcome),
+                               outcome.message if isinstance(outcome, RPCError) else None)
+            pending = retries + pending
+        return [tuple(result) for result in results]
+
     async def _main_session(self):
         while True:
             session = self.main_session()
@@ -1305,8 +1642,43 @@ class Network:
     def get_utxos(self, script_hash):
         return self.request_and_wait('blockchain.scripthash.listunspent', [script_hash])
 
+    def get_histories(self, script_hashes, timeout=None):
+        '''Return the history of each script hash from the main server, requested in batches.
+        Blocks until all have arrived, or raises concurrent.futures.TimeoutError after timeout
+        seconds if given.'''
+        script_hashes = list(script_hashes)
+
+        async def request_histories():
+            session = await self._main_session()
+            histories = []
+            for n in range(0, len(script_hashes), HISTORY_BATCH_SIZE):
+                histories.extend(await session.request_histories(
+                    script_hashes[n: n + HISTORY_BATCH_SIZE]))
+            return histories
+
+        return app_state.async_.spawn_and_wait(request_histories, timeout=timeout)
+
     def broadcast_transaction_and_wait(self, transaction: Transaction) -> str:
-        return self.request_and_wait('blockchain.transaction.broadcast', [str(transaction)])
+        return self.request_and_wait(TRANSACTION_BROADCAST, [str(transaction)])
+
+    def broadcast_chain(self, transactions, callback=None):
+        '''Queue a list of transactions for broadcast.  Each can spend the outputs of those
+        before it, and chains are broadcast in the order they are queued.
+
+        If given, callback(tx_id, status, reason, error) is called on the network thread as
+        each transaction's BroadcastStatus changes.  For a failed transaction reason is from
+        broadcast_failure_reason() for display, and error is the server's untranslated error
+        message if the server rejected it; otherwise they are None.
+
+        Returns a concurrent.futures.Future whose result is a list of (tx_id, status, reason,
+        error) tuples, one for each transaction in order.
+        '''
+        future = concurrent.futures.Future()
+        app_state.async_.spawn(self.broadcast_jobs.put, (list(transactions), callback, future))
+        return future
+
+    def broadcast_chain_and_wait(self, transactions, callback=None):
+        return self.broadcast_chain(transactions, callback).result()
 
 
 JSON.register(SVServerState, SVServer, SVProxy)
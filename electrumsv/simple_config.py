@@ -223,6 +223,59 @@ class SimpleConfig:
     def get_session_timeout(self):
         return self.get('session_timeout', 300)
 
+    def set_signing_processes(self, count):
+        self.set_key('signing_processes', count)
+
+    def get_signing_processes(self):
+        '''The number of processes to sign large transactions across.  1, the default, signs
+        in-process; 0 means one per CPU.'''
+        count = self.get('signing_processes', 1)
+        if count == 0:
+            count = os.cpu_count() or 1
+        return max(count, 1)
+
+    def set_coin_chooser(self, name):
+        self.set_key('coin_chooser', name)
+
+    def get_coin_chooser(self):
+        '''The name of the coinchooser.COIN_CHOOSERS class selecting the coins of payments:
+        'privacy', the default, or 'branch_and_bound' for wallets with very many coins.'''
+        return self.get('coin_chooser', 'privacy')
+
+    def set_coin_chooser_penalty(self, name):
+        self.set_key('coin_chooser_penalty', name)
+
+    def get_coin_chooser_penalty(self):
+        '''The name of the coinchooser.PENALTIES function choosing between candidate coin
+        selections: 'privacy', the default, 'minimise_fee' or 'consolidate'.'''
+        return self.get('coin_chooser_penalty', 'privacy')
+
+    def set_consolidation_mode(self, mode):
+        self.set_key('consolidation_mode', mode)
+
+    def get_consolidation_mode(self):
+        '''What the network does with wallets holding many small coins: 'off', the default,
+        'propose' a consolidation transaction to the GUI, or 'auto' broadcast one where the
+        wallet can sign without a password.'''
+        return self.get('consolidation_mode', 'off')
+
+    def get_consolidation_min_coins(self):
+        '''Consolidate once a wallet holds at least this many small coins.'''
+        return self.get('consolidation_min_coins', 200)
+
+    def get_consolidation_max_value(self):
+        '''Coins of a value in satoshis below this are small.'''
+        return self.get('consolidation_max_value', 100_000)
+
+    def get_consolidation_max_inputs(self):
+        '''The most coins a consolidation transaction spends.'''
+        return self.get('consolidation_max_inputs', 500)
+
+    def get_consolidation_max_fee_per_kb(self):
+        '''Consolidate only while the fee rate is at most this.  The default is half the
+        default fee rate, so consolidation waits for the fee rate to be set lower.'''
+        return self.get('consolidation_max_fee_per_kb', 500)
+
     def open_last_wallet(self):
         if self.get('wallet_path') is None:
             last_wallet = self.get('gui_last_wallet')
@@ -0,0 +1,309 @@
+'''An in-process ElectrumX server serving a synthetic, deterministic dataset.
+
+It speaks enough of the ElectrumX protocol for SVSession to negotiate, connect headers,
+subscribe to script hashes, and fetch histories, transactions and merkle proofs, so that
+sync can be tested and benchmarked without live servers.
+
+The dataset is a chain of easy proof-of-work headers whose first header is its own
+checkpoint.  Each address is paid by `txs_per_address` transactions, and transactions are
+packed `txs_per_block` to a block.  Headers verify against `dataset.coin`, so before
+connecting sessions to the server select the dataset's network with `Net.set_to(dataset.net)`
+and install `Headers.from_file(dataset.coin, path, dataset.checkpoint)` as
+`app_state.headers`.
+'''
+
+from collections import defaultdict
+from functools import partial
+import struct
+
+from aiorpcx import RPCError, RPCSession, handler_invocation, serve_rs
+from bitcoinx import (
+    CheckPoint, Coin, Bitcoin, Tx, TxInput, TxOutput, Script, double_sha256,
+    hash_to_hex_str, sha256
+)
+
+from electrumsv.address import Address
+from electrumsv.bitcoin import history_status, push_script
+from electrumsv.crypto import hash_160
+from electrumsv.networks import SVMainnet
+
+
+EASY_BITS = 0x207fffff
+EASY_TARGET = 0x7fffff << 232
+struct_header = struct.Struct('<I32s32sIII')
+# A fixed, well-formed P2PKH unlocking script.  Nothing verifies the signature.
+DUMMY_SCRIPT_SIG = bytes.fromhex(
+    push_script('30440220' + '11' * 32 + '0220' + '22' * 32 + '41') +
+    push_script('02' + '79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798'))
+
+
+def _easy_required_bits(headers, chain, height, timestamp=None):
+    return EASY_BITS
+
+
+def _merkle_root_and_branches(tx_hashes):
+    '''Returns (root, branches) where branches[n] is the merkle branch of tx_hashes[n].'''
+    branches = [[] for _ in tx_hashes]
+    positions = list(range(len(tx_hashes)))
+    level = list(tx_hashes)
+    while len(level) > 1:
+        if len(level) & 1:
+            level.append(level[-1])
+        for n, pos in enumerate(positions):
+            branches[n].append(level[pos ^ 1])
+            positions[n] = pos >> 1
+        level = [double_sha256(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0], branches
+
+
+class SyntheticDataset:
+    '''A deterministic chain, address set and transaction set.'''
+
+    def __init__(self, address_count, *, txs_per_address=1, txs_per_block=500, seed=b'esv'):
+        self.addresses = [Address.from_P2PKH_hash(hash_160(seed + n.to_bytes(4, 'little')))
+                          for n in range(address_count)]
+        self.script_hashes = [address.to_scripthash_hex() for address in self.addresses]
+        # tx_hash hex -> raw tx bytes
+        self.txs = {}
+        # tx_hash hex -> (height, position in block)
+        self.tx_positions = {}
+        # script_hash hex -> list of (tx_hash hex, height) pairs
+        self.histories = defaultdict(list)
+        self.mempool = set()
+        self.raw_headers = []
+        self.branches = {}
+
+        block_txs = []
+        for n in range(address_count * txs_per_address):
+            address_index = n % address_count
+            tx = Tx(1, [TxInput(sha256(seed + b'prev' + n.to_bytes(4, 'little')), 0,
+                                Script(DUMMY_SCRIPT_SIG), 0xffffffff)],
+                    [TxOutput(10_000 + n, Script(self.addresses[address_index].to_script()))], 0)
+            block_txs.append((tx.to_bytes(), self.script_hashes[address_index]))
+        self._mine_block([])
+        for start in range(0, len(block_txs), txs_per_block):
+            self._mine_block(block_txs[start: start + txs_per_block])
+
+        self.coin = Coin('Synthetic', self.raw_headers[0].hex(), _easy_required_bits,
+                         Bitcoin.P2PKH_verbyte, Bitcoin.P2SH_verbyte, Bitcoin.WIF_byte,
+                         Bitcoin.xpub_verbytes, Bitcoin.xprv_verbytes, 'synthetic')
+        self.checkpoint = CheckPoint(self.raw_headers[0], 0, 0)
+        self.net = type('SVSynthetic', (SVMainnet, ), {
+            'NAME': 'synthetic',
+            'COIN': self.coin,
+            'CHECKPOINT': self.checkpoint,
+            'DEFAULT_SERVERS': {},
+            'VERIFICATION_BLOCK_MERKLE_ROOT': None,
+        })
+
+    def _mine_block(self, block_txs):
+        height = len(self.raw_headers)
+        prev_hash = double_sha256(self.raw_headers[-1]) if self.raw_headers else bytes(32)
+        # Every block has a dummy coinbase so that no block is empty
+        coinbase = Tx(1, [TxInput(bytes(32), 0xffffffff, Script(height.to_bytes(4, 'little')),
+                                  0xffffffff)], [TxOutput(0, Script(b''))], 0).to_bytes()
+        raws = [coinbase] + [raw for raw, _script_hash in block_txs]
+        tx_hashes = [double_sha256(raw) for raw in raws]
+        merkle_root, branches = _merkle_root_and_branches(tx_hashes)
+        for pos, (raw, tx_hash, branch) in enumerate(zip(raws, tx_hashes, branches)):
+            hex_hash = hash_to_hex_str(tx_hash)
+            self.txs[hex_hash] = raw
+            self.tx_positions[hex_hash] = (height, pos)
+            self.branches[hex_hash] = [hash_to_hex_str(elt) for elt in branch]
+        for raw, script_hash in block_txs:
+            self.histories[script_hash].append((hash_to_hex_str(double_sha256(raw)), height))
+
+        nonce = 0
+        while True:
+            raw_header = struct_header.pack(1, prev_hash, merkle_root,
+                                            1_500_000_000 + height * 600, EASY_BITS, nonce)
+            if int.from_bytes(double_sha256(raw_header), 'little') <= EASY_TARGET:
+                break
+            nonce += 1
+        self.raw_headers.append(raw_header)
+
+    @property
+    def height(self):
+        return len(self.raw_headers) - 1
+
+    def status(self, script_hash):
+        return history_status(self.histories.get(script_hash))
+
+    def add_mempool_tx(self, raw_tx):
+        '''Add a raw transaction to the mempool.  Returns (tx_hash, touched script hashes).'''
+        tx_hash = hash_to_hex_str(double_sha256(raw_tx))
+        script_hashes = set()
+        if tx_hash not in self.txs:
+            self.txs[tx_hash] = raw_tx
+            self.mempool.add(tx_hash)
+            for output in Tx.from_bytes(raw_tx).outputs:
+                script_hash = hash_to_hex_str(sha256(bytes(output.script_pubkey)))
+                self.histories[script_hash].append((tx_hash, 0))
+                script_hashes.add(script_hash)
+        return tx_hash, script_hashes
+
+
+class FakeElectrumXSession(RPCSession):
+
+    # Never throttle or disconnect benchmark clients for resource usage
+    cost_hard_limit = 0
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.server = server
+        self.dataset = server.dataset
+        self.subscribed = set()
+        server.sessions.add(self)
+        self.handlers = {
+            'server.version': self.server_version,
+            'server.ping': self.ping,
+            'server.banner': self.banner,
+            'server.donation_address': self.donation_address,
+            'server.peers.subscribe': self.peers_subscribe,
+            'blockchain.estimatefee': self.estimatefee,
+            'blockchain.relayfee': self.relayfee,
+            'blockchain.block.header': self.block_header,
+            'blockchain.block.headers': self.block_headers,
+            'blockchain.headers.subscribe': self.headers_subscribe,
+            'blockchain.scripthash.subscribe': self.scripthash_subscribe,
+            'blockchain.scripthash.get_history': self.scripthash_get_history,
+            'blockchain.transaction.get': self.transaction_get,
+            'blockchain.transaction.get_merkle': self.transaction_get_merkle,
+            'blockchain.transaction.broadcast': self.transaction_broadcast,
+        }
+
+    async def connection_lost(self):
+        await super().connection_lost()
+        self.server.sessions.discard(self)
+
+    async def handle_request(self, request):
+        self.server.request_counts[request.method] += 1
+        handler = self.handlers.get(request.method)
+        return await handler_invocation(handler, request)()
+
+    async def server_version(self, client_name='', protocol_version=None):
+        return ['FakeElectrumX 1.0', '1.4']
+
+    async def ping(self):
+        return None
+
+    async def banner(self):
+        return 'Welcome to FakeElectrumX'
+
+    async def donation_address(self):
+        return ''
+
+    async def peers_subscribe(self):
+        return []
+
+    async def estimatefee(self, number):
+        return 0.00001
+
+    async def relayfee(self):
+        return 0.00001
+
+    def _raw_header(self, height):
+        if not isinstance(height, int) or not 0 <= height <= self.dataset.height:
+            raise RPCError(1, f'height {height} out of range')
+        return self.dataset.raw_headers[height]
+
+    async def block_header(self, height, cp_height=0):
+        if cp_height:
+            raise RPCError(1, 'header proofs are not supported')
+        return self._raw_header(height).hex()
+
+    async def block_headers(self, start_height, count, cp_height=0):
+        if cp_height:
+            raise RPCError(1, 'header proofs are not supported')
+        self._raw_header(start_height)
+        raw_headers = self.dataset.raw_headers[start_height: start_height + min(count, 2016)]
+        return {'hex': b''.join(raw_headers).hex(), 'count': len(raw_headers), 'max': 2016}
+
+    async def headers_subscribe(self):
+        height = self.dataset.height
+        return {'hex': self._raw_header(height).hex(), 'height': height}
+
+    async def scripthash_subscribe(self, script_hash):
+        self.subscribed.add(script_hash)
+        return self.dataset.status(script_hash)
+
+    async def scripthash_get_history(self, script_hash):
+        result = []
+        for tx_hash, height in self.dataset.histories.get(script_hash, []):
+            item = {'tx_hash': tx_hash, 'height': height}
+            if height <= 0:
+                item['fee'] = 0
+            result.append(item)
+        return result
+
+    async def transaction_get(self, tx_hash, verbose=False):
+        raw_tx = self.dataset.txs.get(tx_hash)
+        if raw_tx is None:
+            raise RPCError(1, f'unknown transaction {tx_hash}')
+        self.server.bytes_served += len(raw_tx)
+        return raw_tx.hex()
+
+    async def transaction_get_merkle(self, tx_hash, height):
+        position = self.dataset.tx_positions.get(tx_hash)
+        if position is None or position[0] != height:
+            raise RPCError(1, f'tx {tx_hash} not in block at height {height}')
+        return {'block_height': height, 'merkle': self.dataset.branches[tx_hash],
+                'pos': position[1]}
+
+    async def transaction_broadcast(self, raw_tx):
+        try:
+            raw_tx = bytes.fromhex(raw_tx)
+            Tx.from_bytes(raw_tx)
+        except Exception as e:
+            raise RPCError(1, f'the transaction was rejected by network rules.\n\n{e}')
+        errors = self.server.broadcast_errors.get(hash_to_hex_str(double_sha256(raw_tx)))
+        if errors:
+            raise RPCError(1, f'the transaction was rejected by network rules.\n\n'
+                           f'{errors.pop(0)}')
+        tx_hash, script_hashes = self.dataset.add_mempool_tx(raw_tx)
+        await self.server.notify(script_hashes)
+        return tx_hash
+
+
+class FakeElectrumX:
+    '''Serves a SyntheticDataset over TCP.  Use as an async context manager, or call start()
+    and stop() on the event loop the clients will use.'''
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.sessions = set()
+        self.request_counts = defaultdict(int)
+        self.bytes_served = 0
+        # tx_hash hex -> list of error messages to reject its next broadcasts with
+        self.broadcast_errors = {}
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._server = await serve_rs(partial(FakeElectrumXSession, self), host, port)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        for session in list(self.sessions):
+            await session.close()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+
+    async def notify(self, script_hashes):
+        '''Send status notifications for the given script hashes to subscribed sessions.'''
+        for session in list(self.sessions):
+            for script_hash in script_hashes & session.subscribed:
+                await session.send_notification('blockchain.scripthash.subscribe',
+                                                (script_hash, self.dataset.status(script_hash)))
+
+    async def broadcast(self, raw_tx):
+        '''Add a transaction to the mempool as if another wallet broadcast it.'''
+        tx_hash, script_hashes = self.dataset.add_mempool_tx(raw_tx)
+        await self.notify(script_hashes)
+        return tx_hash
@@ -1,9 +1,15 @@
 import base64
+import pickle
+
 from bitcoinx import (
     PublicKey, Ops, PrivateKey, Bitcoin, BitcoinTestnet, base58_encode_check, is_minikey,
+    cashaddr
 )
 
-from electrumsv.address import Address
+from electrumsv.address import (
+    Address, AddressError, base58_decode_check_many, base58_encode_check_many,
+    cashaddr_decode_many, cashaddr_encode_many
+)
 from electrumsv.bitcoin import (
     is_new_seed, is_old_seed, var_int, op_push, seed_type,
     push_script, int_to_hex
@@ -12,6 +18,7 @@ from electrumsv.crypto import sha256d
 from electrumsv.keystore import is_xpub, is_xprv, is_private_key
 from electrumsv import crypto
 from electrumsv.exceptions import InvalidPassword
+from electrumsv.networks import Net, SVMainnet, SVTestnet
 from electrumsv.util import bfh, bh2u
 from electrumsv.storage import WalletStorage
 
@@ -224,6 +231,76 @@ class Test_bitcoin(SequentialTestCase):
         self.assertEqual(address_to_script('35ZqQJcBQMZ1rsv8aSuJ2wkC7ohUCQMJbT'), 'a9142a84cf00d47f699ee7bbc1dea5ec1bdecb4ac15487')
         self.assertEqual(address_to_script('3PyjzJ3im7f7bcV724GR57edKDqoZvH7Ji'), 'a914f47c8954e421031ad04ecd8e7752c9479206b9d387')
 
+    def test_address_interned(self):
+        string = '14gcRovpkCoGkCNBivQBvw7eso7eiNAbxG'
+        address = Address.from_string(string)
+        self.assertIs(Address.from_P2PKH_hash(address.hash160), address)
+        self.assertIs(Address.from_string(string), address)
+        self.assertEqual(address.to_string(), string)
+        self.assertIs(address.to_script(), address.to_script())
+        self.assertEqual(pickle.loads(pickle.dumps(address)), address)
+        self.assertNotEqual(address, Address.from_P2SH_hash(address.hash160))
+        # The string follows the network
+        Net.set_to(SVTestnet)
+        try:
+            self.assertEqual(address.to_string(),
+                             base58_encode_check(bytes([111]) + address.hash160))
+        finally:
+            Net.set_to(SVMainnet)
+        self.assertEqual(address.to_string(), string)
+
+    def test_address_from_strings(self):
+        strings = ['14gcRovpkCoGkCNBivQBvw7eso7eiNAbxG', '35ZqQJcBQMZ1rsv8aSuJ2wkC7ohUCQMJbT',
+                   'bitcoincash:qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a',
+                   '14gcRovpkCoGkCNBivQBvw7eso7eiNAbxG']
+        addresses = Address.from_strings(strings)
+        self.assertEqual(addresses, [Address.from_string(string) for string in strings])
+        self.assertIs(addresses[0], addresses[3])
+        self.assertEqual(Address.from_strings(['mutXcGt1CJdkRvXuN2xoz2quAAQYQ59bRX'],
+                                              net=SVTestnet),
+                         [Address.from_string('mutXcGt1CJdkRvXuN2xoz2quAAQYQ59bRX', SVTestnet)])
+        with self.assertRaises(AddressError):
+            Address.from_strings(['14gcRovpkCoGkCNBivQBvw7eso7eiNAbxH'])
+
+    def test_address_decode_strings(self):
+        strings = ['14gcRovpkCoGkCNBivQBvw7eso7eiNAbxH', '35ZqQJcBQMZ1rsv8aSuJ2wkC7ohUCQMJbT',
+                   'BITCOINCASH:QPM2QSZNHKS23Z7629MMS6S4CWEF74VCWVY22GDX6A',
+                   'qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a',
+                   'bitcoincash:Qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a',
+                   'bchtest:qpm2qsznhks23z7629mms6s4cwef74vcwvy22gdx6a', '', 'mutXcGt1CJdk']
+        addresses = Address.decode_strings(strings)
+        self.assertEqual(addresses, [None, Address.from_string(strings[1]),
+                                     Address.from_string(strings[3]),
+                                     Address.from_string(strings[3]), None, None, None, None])
+        self.assertEqual(Address.to_strings(addresses[1:3]),
+                         ['35ZqQJcBQMZ1rsv8aSuJ2wkC7ohUCQMJbT',
+                          '1BpEi6DfDAUFd7GtittLSdBeYJvcoaVggu'])
+
+    def test_base58_many(self):
+        payloads = [bytes(21), bytes([0, 0, 7]) + bytes(range(18)), bytes([5]) + bytes(20),
+                    bytes(range(40))]
+        strings = [base58_encode_check(payload) for payload in payloads]
+        self.assertEqual(base58_encode_check_many(payloads), strings)
+        self.assertEqual(base58_decode_check_many(strings), payloads)
+        bad_checksum = strings[1][:-1] + ('2' if strings[1][-1] != '2' else '3')
+        self.assertEqual(base58_decode_check_many([bad_checksum, '', '0OIl', 'Ä']),
+                         [None] * 4)
+
+    def test_cashaddr_many(self):
+        pairs = [(cashaddr.PUBKEY_TYPE, bytes(20)), (cashaddr.SCRIPT_TYPE, bytes(range(20))),
+                 (cashaddr.PUBKEY_TYPE, bytes([255]) * 20)]
+        strings = [cashaddr._encode_full('bitcoincash', kind, hash160)
+                   for kind, hash160 in pairs]
+        self.assertEqual(cashaddr_encode_many('bitcoincash', pairs), strings)
+        self.assertEqual(cashaddr_decode_many(strings, 'bitcoincash'), pairs)
+        self.assertEqual(cashaddr_decode_many([strings[1].upper(), strings[1][12:]],
+                                              'bitcoincash'), pairs[1:2] * 2)
+        bad_checksum = strings[0][:-1] + ('p' if strings[0][-1] != 'p' else 'q')
+        self.assertEqual(cashaddr_decode_many(strings, 'bchtest'), [None] * 3)
+        self.assertEqual(cashaddr_decode_many([bad_checksum, strings[0] + 'q',
+                                               strings[0][:-1] + 'b'], 'bitcoincash'),
+                         [None] * 3)
+
 
 class Test_bitcoin_testnet(TestCaseForTestnet):
 
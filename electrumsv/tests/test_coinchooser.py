@@ -0,0 +1,145 @@
+import random
+
+from bitcoinx import PrivateKey, sha256
+import pytest
+
+from electrumsv.address import Address
+from electrumsv.coinchooser import (
+    Bucket, CoinChooserBranchAndBound, CoinChooserPrivacy, CoinConsolidator, get_coin_chooser,
+    least_penalty, PENALTIES, PRNG
+)
+from electrumsv.exceptions import NotEnoughFunds
+from electrumsv.simple_config import SimpleConfig
+from electrumsv.transaction import XTxInput
+
+
+KEYS = [PrivateKey(sha256(n.to_bytes(4, 'little'))) for n in range(20)]
+ADDRESSES = [Address.from_string(key.public_key.to_address().to_string()) for key in KEYS]
+
+
+def _coin(n, value, key_index):
+    pubkey = KEYS[key_index].public_key.to_hex()
+    coin = XTxInput(sha256(n.to_bytes(4, 'little')), n % 3, value=value,
+                    address=ADDRESSES[key_index])
+    coin.type = 'p2pkh'
+    coin.x_pubkeys = [pubkey]
+    coin.pubkeys = [pubkey]
+    coin.num_sig = 1
+    coin.signatures = [None]
+    return coin
+
+
+def _coins(count, seed=1):
+    rnd = random.Random(seed)
+    return [_coin(n, rnd.randrange(10_000, 2_000_000), rnd.randrange(len(KEYS)))
+            for n in range(count)]
+
+
+def _fee_estimator(size):
+    return size
+
+
+def test_get_coin_chooser(tmpdir):
+    config = SimpleConfig(options={}, read_user_config_function=lambda _: {},
+                          read_user_dir_function=lambda : str(tmpdir))
+    chooser = get_coin_chooser(config)
+    assert type(chooser) is CoinChooserPrivacy and chooser.penalty == 'privacy'
+    config.set_coin_chooser('branch_and_bound')
+    config.set_coin_chooser_penalty('minimise_fee')
+    chooser = get_coin_chooser(config)
+    assert type(chooser) is CoinChooserBranchAndBound and chooser.penalty == 'minimise_fee'
+    config.set_coin_chooser('unknown')
+    assert type(get_coin_chooser(config)) is CoinChooserPrivacy
+
+
+@pytest.mark.parametrize("chooser_class", (CoinChooserPrivacy, CoinChooserBranchAndBound))
+@pytest.mark.parametrize("amount", (50_000, 1_500_000, 20_000_000))
+def test_make_tx(chooser_class, amount):
+    coins = _coins(200)
+    tx = chooser_class().make_tx(coins, [(ADDRESSES[0], amount)], [ADDRESSES[1]],
+                                 _fee_estimator, 546)
+    assert tx.output_value() >= amount
+    assert tx.get_fee() >= _fee_estimator(tx.estimated_size())
+    # Every coin of a spent address is spent
+    spent = {txin.address for txin in tx.inputs()}
+    assert len(tx.inputs()) == sum(coin.address in spent for coin in coins)
+
+
+def test_deterministic():
+    coins = _coins(500)
+    shuffled = list(coins)
+    random.Random(2).shuffle(shuffled)
+    outputs = [(ADDRESSES[0], 3_000_000)]
+    txs = [CoinChooserBranchAndBound().make_tx(c, outputs, [ADDRESSES[1]], _fee_estimator, 546)
+           for c in (coins, shuffled)]
+    assert ({txin.outpoint_bytes() for txin in txs[0].inputs()} ==
+            {txin.outpoint_bytes() for txin in txs[1].inputs()})
+
+
+def test_not_enough_funds():
+    coins = _coins(10)
+    total = sum(coin.value for coin in coins)
+    with pytest.raises(NotEnoughFunds):
+        CoinChooserBranchAndBound().make_tx(coins, [(ADDRESSES[0], total)], [ADDRESSES[1]],
+                                            _fee_estimator, 546)
+
+
+@pytest.mark.parametrize("chooser_class", (CoinChooserPrivacy, CoinChooserBranchAndBound))
+def test_penalties(chooser_class):
+    coins = _coins(100)
+    outputs = [(ADDRESSES[0], 20_000_000)]
+    txs = {penalty: chooser_class(penalty).make_tx(coins, list(outputs), [ADDRESSES[1]],
+                                                   _fee_estimator, 546)
+           for penalty in PENALTIES}
+    sizes = {penalty: tx.estimated_size() for penalty, tx in txs.items()}
+    assert sizes['minimise_fee'] <= sizes['privacy'] <= sizes['consolidate']
+    assert sizes['minimise_fee'] < sizes['consolidate']
+    assert chooser_class('no such penalty').penalty == 'privacy'
+
+
+def test_least_penalty():
+    buckets = [Bucket(n, size, 1000 * n, []) for n, size in enumerate((10, 50, 30, 30, 20))]
+    candidates = [(1, 4), (2, 3), (0, 1, 2, 3)]
+    assert least_penalty(buckets, candidates, lambda count, value, size: size) == (2, 3)
+    assert least_penalty(buckets, candidates, lambda count, value, size: -count) == (0, 1, 2, 3)
+    assert least_penalty(buckets, candidates,
+                         lambda count, value, size: abs(value - 6000)) == (0, 1, 2, 3)
+
+
+def test_search_candidate():
+    chooser = CoinChooserBranchAndBound()
+    values = [10, 20, 35, 70, 160, 400]
+    prefix_sums = [0, 10, 30, 65, 135, 295, 695]
+    # 70 + 20 + 10 meets 100 exactly; 160 is the smallest single bucket
+    assert sorted(chooser._search_candidate(values, prefix_sums, 100, 0)) == [0, 1, 3]
+    chooser.max_search_buckets = 1
+    assert chooser._search_candidate(values, prefix_sums, 100, 0) == (4, )
+
+
+@pytest.mark.parametrize("count,percent", ((10_000, 90), (40_000, 30)))
+def test_pay_most_of_many_buckets(count, percent):
+    # No single bucket or small set meets the amount, so only the draws and the largest
+    # buckets can
+    rnd = random.Random(3)
+    buckets = [Bucket(n, 148, rnd.randrange(10_000, 20_000), []) for n in range(count)]
+    amount = sum(bucket.value for bucket in buckets) * percent // 100
+    required_funds = lambda size: amount + size
+    sufficient_funds = lambda chosen: (sum(bucket.value for bucket in chosen) >=
+                                       required_funds(sum(bucket.size for bucket in chosen)))
+    chooser = CoinChooserBranchAndBound()
+    chooser.p = PRNG(b'seed')
+    chosen = chooser.choose_buckets(buckets, sufficient_funds,
+                                    lambda count, value, size: size, required_funds)
+    assert sufficient_funds(chosen)
+    assert len({bucket.desc for bucket in chosen}) == len(chosen)
+
+
+def test_consolidator():
+    # Address 0 has many small coins, address 1 one, and address 2 a large coin and one
+    # not worth spending
+    coins = ([_coin(n, 5_000, 0) for n in range(6)] + [_coin(6, 5_000, 1)] +
+             [_coin(7, 5_000_000, 2), _coin(8, 100, 2)] + [_coin(9, 100, 3)])
+    chosen = CoinConsolidator().choose_coins(coins, 10_000, 100, _fee_estimator)
+    assert chosen == coins[:7] + coins[7:9]
+    chosen = CoinConsolidator().choose_coins(coins, 10_000, 6, _fee_estimator)
+    assert chosen == coins[:6]
@@ -0,0 +1,282 @@
+from contextlib import asynccontextmanager
+from functools import partial
+import os
+
+from aiorpcx import timeout_after
+from bitcoinx import Headers, Script, Tx, TxInput, TxOutput, hex_str_to_hash
+import pytest
+
+from electrumsv.app_state import app_state, AppStateProxy
+from electrumsv.bitcoin import history_status
+from electrumsv.network import (
+    BroadcastStatus, Network, PaymentReceived, SVServer, SVSession, _root_from_proof
+)
+from electrumsv.networks import Net
+from electrumsv.simple_config import SimpleConfig
+from electrumsv.storage import WalletStorage
+from electrumsv.transaction import Transaction
+from electrumsv.wallet import ImportedAddressWallet
+
+from .fake_electrumx import FakeElectrumX, SyntheticDataset
+
+
+class _Wallet:
+
+    def __init__(self):
+        self.request_count = 0
+        self.response_count = 0
+        self.progress_event = app_state.async_.event()
+        self.histories = {}
+
+    def get_address_history(self, address):
+        return self.histories.get(address, [])
+
+    def get_address_status(self, address):
+        return history_status(self.get_address_history(address))
+
+    async def set_address_history(self, address, history, tx_fees):
+        self.histories[address] = history
+
+
+class _Network:
+
+    def __init__(self):
+        self.check_main_chain_event = app_state.async_.event()
+
+
+class _FetchingNetwork(Network):
+    '''A Network fetching wallet transactions over a single session.'''
+
+    def __init__(self, session):
+        self.session = session
+        self.callbacks = []
+
+    async def _main_session(self):
+        return self.session
+
+    def trigger_callback(self, event, *args):
+        self.callbacks.append((event, args))
+
+
+@pytest.fixture
+def dataset_env(tmpdir):
+    dataset = SyntheticDataset(25, txs_per_address=2, txs_per_block=4)
+    prior_net = Net._net
+    Net.set_to(dataset.net)
+    AppStateProxy(SimpleConfig({'electrum_sv_path': str(tmpdir)}), 'cmdline')
+    app_state.headers = Headers.from_file(dataset.coin, os.path.join(str(tmpdir), 'headers'),
+                                          dataset.checkpoint)
+    with app_state.async_:
+        yield dataset
+    Net.set_to(prior_net)
+
+
+@asynccontextmanager
+async def _fake_session(dataset):
+    '''Yields a fake server for dataset and a session with it that has negotiated the
+    protocol and subscribed to headers.'''
+    async with FakeElectrumX(dataset) as server:
+        sv_server = SVServer.unique(server.host, server.port, 't')
+        session_factory = partial(SVSession, _Network(), sv_server, sv_server._logger(0))
+        async with sv_server._connector(session_factory, proxy=None) as session:
+            await session._negotiate_protocol()
+            await session._subscribe_headers()
+            yield server, session
+
+
+async def _sync(dataset):
+    async with _fake_session(dataset) as (server, session):
+        assert session.tip.height == dataset.height
+
+        wallet = _Wallet()
+        pairs = list(zip(dataset.addresses, dataset.script_hashes))
+        await session.subscribe_to_pairs(wallet, pairs)
+        SVSession.unsubscribe_wallet(wallet)
+
+        results = []
+        for address, script_hash in pairs:
+            history = wallet.get_address_history(address)
+            assert history_status(history) == dataset.status(script_hash)
+            for tx_hash, height in history:
+                tx = Transaction(await session.request_tx(tx_hash))
+                tx.deserialize()
+                assert tx.txid() == tx_hash
+                proof = await session.request_proof(tx_hash, height)
+                branch = [hex_str_to_hash(item) for item in proof['merkle']]
+                root = _root_from_proof(hex_str_to_hash(tx_hash), branch, proof['pos'])
+                header = (await session.headers_at_heights([height]))[height]
+                results.append(root == header.merkle_root)
+        return results
+
+
+def test_session_syncs_from_fake_server(dataset_env):
+    results = app_state.async_.spawn_and_wait(_sync, dataset_env, timeout=60)
+    assert len(results) == 50
+    assert all(results)
+
+
+async def _resubscribe(dataset):
+    async with _fake_session(dataset) as (server, session):
+        wallet = _Wallet()
+        pairs = list(zip(dataset.addresses, dataset.script_hashes))
+        await session.subscribe_to_pairs(wallet, pairs)
+        first_count = server.request_counts['blockchain.scripthash.get_history']
+        SVSession.unsubscribe_wallet(wallet)
+
+        # A restarted session with an up-to-date wallet fetches no histories
+        await session.subscribe_to_pairs(wallet, pairs)
+        SVSession.unsubscribe_wallet(wallet)
+        second_count = server.request_counts['blockchain.scripthash.get_history']
+        return first_count, second_count - first_count, wallet.response_count
+
+
+def test_resubscribe_fetches_only_changed(dataset_env):
+    first, second, responses = app_state.async_.spawn_and_wait(_resubscribe, dataset_env,
+                                                               timeout=60)
+    assert first == 25
+    assert second == 0
+    assert responses == 50
+
+
+async def _payment(dataset, wallet_path):
+    async with _fake_session(dataset) as (server, session):
+        address = dataset.addresses[0]
+        wallet = ImportedAddressWallet.from_text(WalletStorage(wallet_path),
+                                                 address.to_string())
+        network = _FetchingNetwork(session)
+        await session.subscribe_to_pairs(wallet, [(address, dataset.script_hashes[0])])
+        await network._request_transactions(wallet, True)
+        # Confirmed history is not reported as new payments
+        assert not [event for event, args in network.callbacks
+                    if event == 'payment_received']
+
+        tx = Tx(1, [TxInput(bytes(32), 7, Script(b'\x51'), 0xffffffff)],
+                [TxOutput(123_456, Script(address.to_script()))], 0)
+        wallet.txs_changed_event.clear()
+        await server.broadcast(tx.to_bytes())
+        async with timeout_after(10):
+            await wallet.txs_changed_event.wait()
+        get_count = server.request_counts['blockchain.transaction.get']
+        await network._request_transactions(wallet, False)
+        get_count = server.request_counts['blockchain.transaction.get'] - get_count
+        SVSession.unsubscribe_wallet(wallet)
+
+        payments = [args for event, args in network.callbacks if event == 'payment_received']
+        return get_count, payments, wallet, PaymentReceived(tx.hex_hash(), address, 123_456)
+
+
+def test_mempool_payment_fast_path(dataset_env, tmpdir):
+    get_count, payments, wallet, expected = app_state.async_.spawn_and_wait(
+        _payment, dataset_env, os.path.join(str(tmpdir), 'wallet'), timeout=60)
+    # Only the new transaction was fetched
+    assert get_count == 1
+    assert payments == [(wallet, expected)]
+
+
+async def _wrong_transaction(dataset, wallet_path):
+    async with _fake_session(dataset) as (server, session):
+        address = dataset.addresses[0]
+        wallet = ImportedAddressWallet.from_text(WalletStorage(wallet_path),
+                                                 address.to_string())
+        network = _FetchingNetwork(session)
+        await session.subscribe_to_pairs(wallet, [(address, dataset.script_hashes[0])])
+        tx_hashes = [tx_hash for tx_hash, height in wallet.get_address_history(address)]
+        # The server answers with some other transaction
+        other_hash = next(tx_hash for tx_hash in dataset.txs if tx_hash not in tx_hashes)
+        dataset.txs[tx_hashes[0]] = dataset.txs[other_hash]
+        await network._request_transactions(wallet, True)
+        SVSession.unsubscribe_wallet(wallet)
+        return tx_hashes[0], wallet
+
+
+def test_wrong_transaction_rejected(dataset_env, tmpdir):
+    tx_hash, wallet = app_state.async_.spawn_and_wait(
+        _wrong_transaction, dataset_env, os.path.join(str(tmpdir), 'wallet'), timeout=60)
+    assert wallet.get_transaction(tx_hash) is None
+    # It is fetched again later
+    assert tx_hash in wallet.pop_pending_transactions()
+
+
+async def _unparseable_transaction(dataset, wallet_path):
+    async with _fake_session(dataset) as (server, session):
+        address = dataset.addresses[0]
+        wallet = ImportedAddressWallet.from_text(WalletStorage(wallet_path),
+                                                 address.to_string())
+        network = _FetchingNetwork(session)
+        await session.subscribe_to_pairs(wallet, [(address, dataset.script_hashes[0])])
+        tx_hashes = [tx_hash for tx_hash, height in wallet.get_address_history(address)]
+        add_transaction = wallet.add_transaction
+
+        def failing_add_transaction(tx_hash, tx):
+            if tx_hash == tx_hashes[0]:
+                raise ValueError('malformed transaction')
+            add_transaction(tx_hash, tx)
+
+        # A transaction the wallet cannot parse does not end the request
+        wallet.add_transaction = failing_add_transaction
+        await network._request_transactions(wallet, True)
+        SVSession.unsubscribe_wallet(wallet)
+        return tx_hashes, wallet
+
+
+def test_unparseable_transaction_requeued(dataset_env, tmpdir):
+    tx_hashes, wallet = app_state.async_.spawn_and_wait(
+        _unparseable_transaction, dataset_env, os.path.join(str(tmpdir), 'wallet'), timeout=60)
+    assert wallet.get_transaction(tx_hashes[0]) is None
+    assert all(wallet.get_transaction(tx_hash) for tx_hash in tx_hashes[1:])
+    assert wallet.pop_pending_transactions() == {tx_hashes[0]}
+
+
+def _chain(length):
+    txs = []
+    prev_hash = bytes(32)
+    for n in range(length):
+        tx = Tx(1, [TxInput(prev_hash, 0, Script(b'\x51'), 0xffffffff)],
+                [TxOutput(100_000 - n * 1000, Script(b'\x51'))], 0)
+        prev_hash = tx.hash()
+        txs.append(Transaction(tx.to_bytes()))
+    return txs
+
+
+async def _broadcast_chain(dataset, txs, broadcast_errors):
+    async with _fake_session(dataset) as (server, session):
+        server.broadcast_errors.update(broadcast_errors)
+        network = _FetchingNetwork(session)
+        statuses = []
+        results = await network._broadcast_chain(txs, lambda *args: statuses.append(args))
+        return results, statuses, server.request_counts['blockchain.transaction.broadcast']
+
+
+def test_broadcast_chain_retries_missing_inputs(dataset_env):
+    txs = _chain(5)
+    tx_ids = [tx.txid() for tx in txs]
+    # The server checked the second transaction before accepting the first
+    results, statuses, count = app_state.async_.spawn_and_wait(
+        _broadcast_chain, dataset_env, txs, {tx_ids[1]: ['Missing inputs']}, timeout=60)
+    assert results == [(tx_id, BroadcastStatus.accepted, None, None) for tx_id in tx_ids]
+    assert [status for tx_id, status, reason, error in statuses if tx_id == tx_ids[1]] == [
+        BroadcastStatus.sent, BroadcastStatus.sent, BroadcastStatus.accepted]
+    assert count == 6
+    assert all(tx_id in dataset_env.mempool for tx_id in tx_ids)
+
+
+def test_broadcast_chain_failure(dataset_env):
+    txs = _chain(5)
+    tx_ids = [tx.txid() for tx in txs]
+    results, statuses, count = app_state.async_.spawn_and_wait(
+        _broadcast_chain, dataset_env, txs, {
+            tx_ids[0]: ['txn-already-known'],
+            tx_ids[2]: ['bad-txns-inputs-spent'],
+            tx_ids[3]: ['Missing inputs'],
+            tx_ids[4]: ['Missing inputs'],
+        }, timeout=60)
+    assert [status for tx_id, status, reason, error in results] == [
+        BroadcastStatus.accepted, BroadcastStatus.accepted, BroadcastStatus.failed,
+        BroadcastStatus.failed, BroadcastStatus.failed]
+    assert 'already-spent' in results[2][2]
+    # The server's own error is passed alongside the reason shown to the user
+    assert results[2][3].endswith('bad-txns-inputs-spent')
+    assert results[3][2] == results[4][2] == 'it spends a transaction that was not sent'
+    assert results[3][3] is results[4][3] is None
+    # The failed transaction's children were sent in its batch but not again
+    assert count == 5
@@ -0,0 +1,109 @@
+import os
+import struct
+
+from bitcoinx import Coin, CheckPoint, Headers, double_sha256
+import pytest
+
+from electrumsv.headers_snapshot import (
+    export_headers_snapshot, import_headers_snapshot, HeadersSnapshotError
+)
+
+
+EASY_BITS = 0x207fffff
+CHECKPOINT_HEIGHT = 10
+TIP_HEIGHT = 25
+struct_header = struct.Struct('<I32s32sIII')
+
+
+def _mine_chain(count):
+    raw_headers = []
+    prev_hash = bytes(32)
+    for height in range(count):
+        nonce = 0
+        while True:
+            raw_header = struct_header.pack(1, prev_hash, bytes([height]) * 32,
+                                            1_500_000_000 + height, EASY_BITS, nonce)
+            if int.from_bytes(double_sha256(raw_header), 'little') <= (0x7fffff << 232):
+                break
+            nonce += 1
+        raw_headers.append(raw_header)
+        prev_hash = double_sha256(raw_header)
+    return raw_headers
+
+
+RAW_HEADERS = _mine_chain(TIP_HEIGHT + 1)
+TEST_COIN = Coin('snapshot test', RAW_HEADERS[0].hex(), lambda *args: EASY_BITS,
+                 0x6f, 0xc4, 0xef, bytes(4), bytes(4), 'test')
+CHECKPOINT = CheckPoint(RAW_HEADERS[CHECKPOINT_HEIGHT], CHECKPOINT_HEIGHT, 0)
+
+
+def _new_headers(tmpdir, name='headers'):
+    return Headers.from_file(TEST_COIN, os.path.join(tmpdir, name), CHECKPOINT)
+
+
+def _populated_headers(tmpdir):
+    headers = _new_headers(tmpdir, 'source_headers')
+    for height in range(2, CHECKPOINT_HEIGHT):
+        headers.set_one(height, RAW_HEADERS[height])
+    for raw_header in RAW_HEADERS[CHECKPOINT_HEIGHT + 1:]:
+        headers.connect(raw_header)
+    return headers
+
+
+def test_export_import_round_trip(tmpdir):
+    tmpdir = str(tmpdir)
+    snapshot_path = os.path.join(tmpdir, 'headers.snapshot')
+    start_height, count = export_headers_snapshot(_populated_headers(tmpdir), snapshot_path)
+    assert (start_height, count) == (2, TIP_HEIGHT - 1)
+
+    headers = _new_headers(tmpdir)
+    chain = import_headers_snapshot(headers, snapshot_path)
+    assert chain.height == TIP_HEIGHT
+    for height in range(2, TIP_HEIGHT + 1):
+        assert headers.raw_header_at_height(chain, height) == RAW_HEADERS[height]
+
+
+def test_import_rejects_corruption(tmpdir):
+    tmpdir = str(tmpdir)
+    snapshot_path = os.path.join(tmpdir, 'headers.snapshot')
+    export_headers_snapshot(_populated_headers(tmpdir), snapshot_path)
+    with open(snapshot_path, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 1]))
+
+    headers = _new_headers(tmpdir)
+    with pytest.raises(HeadersSnapshotError):
+        import_headers_snapshot(headers, snapshot_path)
+    assert headers.longest_chain().height == CHECKPOINT_HEIGHT
+
+
+def test_import_rejects_other_checkpoint(tmpdir):
+    tmpdir = str(tmpdir)
+    snapshot_path = os.path.join(tmpdir, 'headers.snapshot')
+    export_headers_snapshot(_populated_headers(tmpdir), snapshot_path)
+
+    other_checkpoint = CheckPoint(RAW_HEADERS[CHECKPOINT_HEIGHT + 1], CHECKPOINT_HEIGHT + 1, 0)
+    headers = Headers.from_file(TEST_COIN, os.path.join(tmpdir, 'headers'), other_checkpoint)
+    with pytest.raises(HeadersSnapshotError):
+        import_headers_snapshot(headers, snapshot_path)
+
+
+def test_import_rejects_bad_magic(tmpdir):
+    tmpdir = str(tmpdir)
+    snapshot_path = os.path.join(tmpdir, 'headers.snapshot')
+    with open(snapshot_path, 'wb') as f:
+        f.write(struct.pack('<8sHIII32s', b'NOTSNAPS', 1, 0, 0, 0, bytes(32)))
+    with pytest.raises(HeadersSnapshotError):
+        import_headers_snapshot(_new_headers(tmpdir), snapshot_path)
+
+
+@pytest.mark.parametrize("size", (0, 10))
+def test_import_rejects_truncated(tmpdir, size):
+    tmpdir = str(tmpdir)
+    snapshot_path = os.path.join(tmpdir, 'headers.snapshot')
+    with open(snapshot_path, 'wb') as f:
+        f.write(bytes(size))
+    with pytest.raises(HeadersSnapshotError):
+        import_headers_snapshot(_new_headers(tmpdir), snapshot_path)
@@ -1,3 +1,5 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import pytest
 
 from bitcoinx import PrivateKey, PublicKey
@@ -5,8 +7,8 @@ from bitcoinx import PrivateKey, PublicKey
 from electrumsv.address import Address
 from electrumsv.exceptions import InvalidPassword
 from electrumsv.keystore import (
-    Imported_KeyStore, Old_KeyStore, BIP32_KeyStore, from_bip39_seed,
-    from_master_key, from_seed, xpubkey_to_address
+    Imported_KeyStore, Old_KeyStore, BIP32_KeyStore, bip39_to_seed, derive_account_candidates,
+    from_bip39_seed, from_master_key, from_seed, xpubkey_to_address
 )
 from electrumsv.crypto import pw_encode
 from electrumsv.networks import Net, SVMainnet, SVTestnet
@@ -14,6 +16,12 @@ from electrumsv.networks import Net, SVMainnet, SVTestnet
 
 class TestOld_KeyStore:
 
+    def test_derive_public_key(self):
+        keystore = from_seed('acb740e454c3134901d7c8f16497cc1c', None, False)
+        public_key = keystore.derive_public_key(1, 4)
+        assert public_key.to_hex(compressed=False) == keystore.derive_pubkey(1, 4)
+        assert Address.from_pubkey(public_key) == Address.from_pubkey(keystore.derive_pubkey(1, 4))
+
     # Seed can be given in hex and as an old-style mnemonic
     @pytest.mark.parametrize("seed_text", (
         'powerful random nobody notice nothing important anyway look away hidden message over',
@@ -58,6 +66,16 @@ class TestOld_KeyStore:
         assert result == (bytes.fromhex(
             '81279e4fe405363eb56e686726d450fe4a76a1d83b64311d7618b845683aab4a'), False)
 
+    def test_get_private_keys(self):
+        keystore = Old_KeyStore.from_seed('ee6ea9eceaf649640051a4c305ac5c59')
+        derivations = {keystore.get_xpubkey(*sequence): sequence
+                       for sequence in ((False, 10), (True, 3))}
+        assert keystore.get_private_keys(derivations, None) == {
+            x_pubkey: keystore.get_private_key(sequence, None)
+            for x_pubkey, sequence in derivations.items()}
+        with pytest.raises(InvalidPassword):
+            keystore.get_private_keys(derivations, 'guess')
+
     def test_check_seed(self):
         seed = 'ee6ea9eceaf649640051a4c305ac5c59'
         keystore = Old_KeyStore.from_seed(seed)
@@ -153,6 +171,19 @@ class TestImported_KeyStore:
             'fc073bed1a151f0510e5558a22d23f16ed8032a1b74ffcac05227c053e1a1d8af5'
         )
 
+    def test_unlock(self):
+        password = 'password'
+        d = Imported_KeyStore({})
+        pubkey = d.import_privkey("5HueCGU8rMjxEXxiPuD5BDku4MkFqeZyd4dZ1jvhTVqvbTLvyTJ", password)
+        msg_sig = d.sign_message(pubkey, 'BitcoinSV', password)
+        d.unlock(password, 60)
+        assert d.sign_message(pubkey, 'BitcoinSV', None) == msg_sig
+        # Importing a key ends the session
+        d.import_privkey("KwdMAjGmerYanjeui5SHS7JkmpZvVipYvB2LJGU1ZxJwYvP98617", password)
+        assert not d.is_unlocked()
+        with pytest.raises(InvalidPassword):
+            d.sign_message(pubkey, 'BitcoinSV', None)
+
     def test_decrypt_message(self):
         password = 'password'
         enc_msg = ('QklFMQNkonLnVmRMF3dl+P0rHSbM4lvDPmnE2CFcD+98gGsOe6qtKtmVbCg4'
@@ -264,6 +295,52 @@ class TestBIP32_KeyStore:
                                          '9ec51ce4c3337a7de2a13'), True)
 
 
+    def test_get_private_keys(self):
+        xprv = ('xprv9s21ZrQH143K4XLpSd2berkCzJTXDv68rusDQFiQGSqa1ZmVXnYzYpTQ9'
+                'qYiSB7mHvg6kEsrd2ZtnHRJ61sZhSN4jZ2T8wxA4T75BE4QQZ1')
+        xpub = ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6e5KsF6cmt17Fv8w'
+                'GvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')
+        password = 'password'
+        keystore = BIP32_KeyStore({'xprv': pw_encode(xprv, password), 'xpub': xpub})
+        derivations = {'a': [0, 1], 'b': [0, 7], 'c': [1, 0], 'd': (1, 2, 3)}
+        assert keystore.get_private_keys(derivations, password) == {
+            x_pubkey: keystore.get_private_key(sequence, password)
+            for x_pubkey, sequence in derivations.items()}
+        with pytest.raises(InvalidPassword):
+            keystore.get_private_keys(derivations, 'guess')
+
+    def test_unlock(self):
+        xprv = ('xprv9s21ZrQH143K4XLpSd2berkCzJTXDv68rusDQFiQGSqa1ZmVXnYzYpTQ9'
+                'qYiSB7mHvg6kEsrd2ZtnHRJ61sZhSN4jZ2T8wxA4T75BE4QQZ1')
+        xpub = ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6e5KsF6cmt17Fv8w'
+                'GvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')
+        password = 'password'
+        keystore = BIP32_KeyStore({'xprv': pw_encode(xprv, password), 'xpub': xpub})
+        derivations = {'a': [0, 1], 'b': (1, 2, 3)}
+        keypairs = keystore.get_private_keys(derivations, password)
+
+        with pytest.raises(InvalidPassword):
+            keystore.unlock('guess', 60)
+        assert not keystore.is_unlocked()
+        keystore.unlock(password, 60)
+        assert keystore.is_unlocked()
+        assert keystore.get_private_keys(derivations, None) == keypairs
+        assert keystore.get_private_keys(derivations, password) == keypairs
+        with pytest.raises(InvalidPassword):
+            keystore.get_private_keys(derivations, 'guess')
+
+        secrets = keystore._session.secrets
+        secret = secrets['xprv']
+        keystore.lock()
+        assert not keystore.is_unlocked() and not secrets and not any(secret)
+        with pytest.raises(InvalidPassword):
+            keystore.get_private_keys(derivations, None)
+
+        keystore.unlock(password, 0)
+        assert not keystore.is_unlocked()
+        with pytest.raises(InvalidPassword):
+            keystore.get_private_keys(derivations, None)
+
     @pytest.mark.parametrize("password", ('Password', None))
     def test_check_password(self, password):
         xprv = ('xprv9s21ZrQH143K4XLpSd2berkCzJTXDv68rusDQFiQGSqa1ZmVXnYzYpTQ9'
@@ -293,6 +370,33 @@ class TestXPub:
         keystore = BIP32_KeyStore({'xpub': xpub})
         assert keystore.derive_pubkey(for_change, n) == pubkey
 
+    def test_derive_public_key(self):
+        xpub = ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6e5KsF6cmt17Fv8w'
+                'GvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')
+        keystore = BIP32_KeyStore({'xpub': xpub})
+        keystore.max_cached_pubkeys = 4
+        public_key = keystore.derive_public_key(True, 5)
+        assert public_key.to_hex() == (
+            '033177256871768b5ee8e031647f3727e63d1b62c8d776d9b422a367fd8e721bd3')
+        assert keystore.derive_public_key(True, 5) is public_key
+        for n in range(10):
+            assert keystore.derive_pubkey(False, n) == keystore.get_pubkey_from_xpub(xpub, (0, n))
+        assert len(keystore._child_keys[0]) == 4
+        # A changed xpub is noticed
+        keystore.xpub = from_bip39_seed('foo bar baz', '', "m/44'/0'/0'").xpub
+        assert keystore.derive_public_key(True, 5) != public_key
+
+    def test_public_key_from_xpubkey(self):
+        xpub = ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6e5KsF6cmt17Fv8w'
+                'GvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')
+        keystore = BIP32_KeyStore({'xpub': xpub})
+        for for_change, n in ((False, 3), (True, 5), (True, 6)):
+            x_pubkey = keystore.get_xpubkey(for_change, n)
+            public_key = BIP32_KeyStore.public_key_from_xpubkey(x_pubkey)
+            assert public_key == keystore.derive_public_key(for_change, n)
+            assert xpubkey_to_address(x_pubkey) == (public_key.to_hex(),
+                                                    Address.from_pubkey(public_key))
+
     def test_xpubkey(self):
         xpub = ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6e5KsF6cmt17Fv8w'
                 'GvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')
@@ -318,6 +422,14 @@ class TestXPub:
             '13d0025602e9aa22cc7106abab85e4c41f18f030c370213769c18d6754f3d0584e69a7fa1200001900'
         ) == (xpub, [0, 25])
 
+    def test_get_pubkey_derivation(self):
+        xpub = ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6e5KsF6cmt17Fv8w'
+                'GvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')
+        keystore = BIP32_KeyStore({'xpub': xpub})
+        assert keystore.get_pubkey_derivation(keystore.get_xpubkey(True, 10)) == [1, 10]
+        other = BIP32_KeyStore({'xpub': from_bip39_seed('foo bar baz', '', "m/44'/0'/0'").xpub})
+        assert keystore.get_pubkey_derivation(other.get_xpubkey(True, 10)) is None
+
 def test_from_bip39_seed():
     keystore = from_bip39_seed('foo bar baz', '', "m/44'/0'/0'")
     assert keystore.xprv == ('xprv9xpBW4EdWnv4PEASBsu3VuPNAcxRiSMXTjAfZ9dkP5FCrKWCacKZBhS3cJVGCe'
@@ -326,6 +438,24 @@ def test_from_bip39_seed():
                              'kXTZtbpEvAzxSKAxnnsVDuwSAAvvXHWVncpX46V3LGj5SaKHtNNnc')
 
 
+def test_derive_account_candidates():
+    bip32_seed = bip39_to_seed('foo bar baz', '')
+    derivations = ["m/44'/0'/0'", "m/44'/0'/1'", "m/44'/145'/0'", 'm']
+    candidates = derive_account_candidates(bip32_seed, derivations, 3)
+    assert [candidate.derivation for candidate in candidates] == derivations
+    assert candidates[0].xpub == ('xpub6BoXuZmXMAUMbiEuHuS3s3L6ienv7u5Npx6GMY3MwQnBj7qM89dojV'
+                                  'kXTZtbpEvAzxSKAxnnsVDuwSAAvvXHWVncpX46V3LGj5SaKHtNNnc')
+    for candidate in candidates:
+        keystore = from_bip39_seed('foo bar baz', '', candidate.derivation)
+        assert candidate.xpub == keystore.xpub
+        assert candidate.addresses == [Address.from_pubkey(keystore.derive_public_key(False, n))
+                                       for n in range(3)]
+    with ThreadPoolExecutor(2) as executor:
+        assert derive_account_candidates(bip32_seed, derivations, 3, executor) == candidates
+    with ProcessPoolExecutor(2) as executor:
+        assert derive_account_candidates(bip32_seed, derivations, 3, executor) == candidates
+
+
 def test_bip32_root():
     Net.set_to(SVMainnet)
     k = BIP32_KeyStore({})
@@ -0,0 +1,113 @@
+import json
+import time
+
+from electrumsv.app_state import AppStateProxy
+from electrumsv.network import Network, SVServer, SVServerState, SERVER_INFO_TTL, SERVER_TTL
+from electrumsv.simple_config import SimpleConfig
+from electrumsv.util import JSON
+
+
+class TestSVServerState:
+
+    def test_defaults(self):
+        state = SVServerState()
+        assert state.avg_rtt is None
+        assert state.bytes_per_sec is None
+        assert state.error_rate == 0
+        assert state.score() == SVServerState.UNKNOWN_RTT
+
+    def test_record_rtt(self):
+        state = SVServerState()
+        state.record_rtt(0.2)
+        assert state.avg_rtt == 0.2
+        state.record_rtt(1.2)
+        assert abs(state.avg_rtt - (0.2 + SVServerState.RTT_ALPHA)) < 1e-9
+
+    def test_error_rate_penalises_score(self):
+        good, bad = SVServerState(), SVServerState()
+        for state in (good, bad):
+            state.record_rtt(0.1)
+        for n in range(10):
+            good.record_request(True)
+            bad.record_request(n % 2 == 0)
+        assert good.error_rate == 0
+        assert 0 < bad.error_rate < 1
+        assert good.score() < bad.score()
+
+    def test_unmeasured_ranks_between(self):
+        fast, slow, unknown = SVServerState(), SVServerState(), SVServerState()
+        fast.record_rtt(0.05)
+        slow.record_rtt(5)
+        assert fast.score() < unknown.score() < slow.score()
+
+    def test_record_throughput(self):
+        state = SVServerState()
+        state.record_throughput(0, 1.0)
+        state.record_throughput(1000, 0)
+        assert state.bytes_per_sec is None
+        state.record_throughput(1000, 2.0)
+        assert state.bytes_per_sec == 500
+
+    def test_json_round_trip(self):
+        state = SVServerState()
+        state.record_rtt(0.25)
+        state.record_request(False)
+        state.record_throughput(4000, 2.0)
+        state2 = SVServerState.from_json(json.loads(json.dumps(state.to_json())))
+        assert state2.avg_rtt == 0.25
+        assert state2.error_rate == round(state.error_rate, 4)
+        assert state2.bytes_per_sec == 2000
+
+    def test_from_json_legacy(self):
+        state = SVServerState.from_json({'last_try': 1, 'last_good': 2, 'last_blacklisted': 0})
+        assert state.last_good == 2
+        assert state.avg_rtt is None
+        assert state.score() == SVServerState.UNKNOWN_RTT
+
+    def test_config_serialization(self):
+        state = SVServerState()
+        state.record_rtt(0.5)
+        state2 = JSON.loads(JSON.dumps(state))
+        assert isinstance(state2, SVServerState)
+        assert state2.avg_rtt == 0.5
+
+    def test_is_info_fresh(self):
+        state = SVServerState()
+        assert not state.is_info_fresh(time.time())
+        state.last_info_fetch = time.time() - 60
+        assert state.is_info_fresh(time.time())
+        state.last_info_fetch = time.time() - SERVER_INFO_TTL - 1
+        assert not state.is_info_fresh(time.time())
+
+    def test_is_stale(self):
+        now = time.time()
+        state = SVServerState()
+        # Never tried
+        assert not state.is_stale(now)
+        # Tried but never good, within and after SERVER_TTL of the first try
+        state.first_try = now - SERVER_TTL + 60
+        state.last_try = now - 10
+        assert not state.is_stale(now)
+        state.first_try = now - SERVER_TTL - 60
+        assert state.is_stale(now)
+        state.last_good = now - 20
+        assert not state.is_stale(now)
+        state.last_good = now - SERVER_TTL - 20
+        assert state.is_stale(now)
+
+
+def test_forget_stale_servers(tmpdir):
+    AppStateProxy(SimpleConfig({'electrum_sv_path': str(tmpdir),
+                                'server': 'main.stale.test:50002:s'}), 'cmdline')
+    now = time.time()
+    servers = [SVServer.unique(host, 50002, 's') for host in ('main.stale.test', 'peer.stale.test')]
+    try:
+        for server in servers:
+            server.state.first_try = server.state.last_try = now - SERVER_TTL - 60
+        Network.__new__(Network)._forget_stale_servers(now)
+        # The configured main server is kept
+        assert [server for server in servers if server in SVServer.all_servers.values()] == [
+            servers[0]]
+    finally:
+        for server in servers:
+            SVServer.all_servers.pop((server.host, server.port, server.protocol), None)
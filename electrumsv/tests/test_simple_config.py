@@ -91,6 +91,40 @@ class Test_SimpleConfig(unittest.TestCase):
         config.set_key("electrum_sv_path", another_path)
         self.assertEqual(another_path, config.get("electrum_sv_path"))
 
+    def test_signing_processes(self):
+        config = SimpleConfig(options={}, read_user_config_function=lambda _: {},
+                              read_user_dir_function=lambda : self.user_dir)
+        self.assertEqual(1, config.get_signing_processes())
+        config.set_signing_processes(4)
+        self.assertEqual(4, config.get_signing_processes())
+        config.set_signing_processes(0)
+        self.assertEqual(os.cpu_count() or 1, config.get_signing_processes())
+
+    def test_coin_chooser(self):
+        config = SimpleConfig(options={}, read_user_config_function=lambda _: {},
+                              read_user_dir_function=lambda : self.user_dir)
+        self.assertEqual('privacy', config.get_coin_chooser())
+        config.set_coin_chooser('branch_and_bound')
+        self.assertEqual('branch_and_bound', config.get_coin_chooser())
+
+    def test_coin_chooser_penalty(self):
+        config = SimpleConfig(options={}, read_user_config_function=lambda _: {},
+                              read_user_dir_function=lambda : self.user_dir)
+        self.assertEqual('privacy', config.get_coin_chooser_penalty())
+        config.set_coin_chooser_penalty('consolidate')
+        self.assertEqual('consolidate', config.get_coin_chooser_penalty())
+
+    def test_consolidation_settings(self):
+        config = SimpleConfig(options={}, read_user_config_function=lambda _: {},
+                              read_user_dir_function=lambda : self.user_dir)
+        self.assertEqual('off', config.get_consolidation_mode())
+        self.assertEqual(200, config.get_consolidation_min_coins())
+        self.assertEqual(100_000, config.get_consolidation_max_value())
+        self.assertEqual(500, config.get_consolidation_max_inputs())
+        self.assertEqual(500, config.get_consolidation_max_fee_per_kb())
+        config.set_consolidation_mode('auto')
+        self.assertEqual('auto', config.get_consolidation_mode())
+
     def test_user_config_is_not_written_with_read_only_config(self):
         """The user config does not contain command-line options when saved."""
         fake_read_user = lambda _: {"something": "a"}
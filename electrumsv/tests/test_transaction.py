@@ -1,13 +1,16 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import unittest
 import pytest
 
 from electrumsv import transaction
 from electrumsv.address import Address
 from electrumsv.keystore import xpubkey_to_address
+from electrumsv.networks import Net
 from electrumsv.transaction import get_address_from_output_script
 from electrumsv.util import bh2u
 
-from bitcoinx import PrivateKey, PublicKey, Tx, Script
+from bitcoinx import PrivateKey, PublicKey, Tx, TxInput, TxOutput, Script, Ops, push_item
 
 
 unsigned_blob = '010000000149f35e43fefd22d8bb9e4b3ff294c6286154c25712baf6ab77b646e5074d6aed010000005701ff4c53ff0488b21e0000000000000000004f130d773e678a58366711837ec2e33ea601858262f8eaef246a7ebd19909c9a03c3b30e38ca7d797fee1223df1c9827b2a9f3379768f520910260220e0560014600002300feffffffd8e43201000000000118e43201000000001976a914e158fb15c888037fdc40fb9133b4c1c3c688706488ac5fbd0700'
@@ -239,6 +242,184 @@ class TestTransaction2:
         assert tx.is_complete()
         assert tx.txid() == "b83acf939a92c420d0cb8d45d5d4dfad4e90369ebce0f49a45808dc1b41259b0"
 
+    def test_serialize_preimages(self):
+        tx = transaction.Transaction(unsigned_tx)
+        preimages = tx.serialize_preimages()
+        assert len(preimages) == 2
+        assert [preimage.hex() for preimage in preimages] == [
+            transaction.Transaction(unsigned_tx).serialize_preimage(i) for i in range(2)]
+
+    def test_sighash_context_invalidation(self):
+        tx = transaction.Transaction(unsigned_tx)
+        context = tx.sighash_context()
+        assert tx.sighash_context() is context
+        preimage = tx.serialize_preimage(0)
+        address = priv_keys[0].public_key.to_address(coin=Net.COIN)
+        tx.add_outputs([(Address.from_string(address.to_string()), 1000)])
+        assert tx.sighash_context()[:2] == context[:2]
+        assert tx.sighash_context()[2] != context[2]
+        assert tx.serialize_preimage(0) != preimage
+
+
+    def test_sign_parallel(self, monkeypatch):
+        monkeypatch.setattr(transaction, 'PARALLEL_SIGNING_MIN_INPUTS', 2)
+        keypairs = {priv_key.public_key.to_hex(): (priv_key.to_bytes(), priv_key.is_compressed())
+                    for priv_key in priv_keys}
+        tx = transaction.Transaction(unsigned_tx)
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(2, mp_context=context) as executor:
+            tx.sign(keypairs, executor)
+        assert tx.raw == signed_tx_3
+        assert tx.is_complete()
+
+    def test_raw_held_as_bytes(self):
+        tx = transaction.Transaction(bytes.fromhex(signed_tx_3))
+        assert tx.raw == signed_tx_3
+        assert tx.to_bytes() == bytes.fromhex(signed_tx_3)
+        assert str(tx) == signed_tx_3
+        assert tx.txid() == "b83acf939a92c420d0cb8d45d5d4dfad4e90369ebce0f49a45808dc1b41259b0"
+        assert tx.serialize_bytes() == tx.to_bytes()
+        assert tx.estimated_size() == len(signed_tx_3) // 2
+
+
+def _estimate_txins():
+    pubkeys = sorted(priv_key.public_key.to_hex() for priv_key in priv_keys)
+    common = {'prevout_hash': '11' * 32, 'prevout_n': 0, 'value': 10000, 'sequence': 0}
+    p2pkh = transaction.Transaction(unsigned_tx).inputs()[0]
+    p2pk = dict(common, type='p2pk', num_sig=1, signatures=[None],
+                pubkeys=[priv_keys[0].public_key.to_hex(compressed=False)],
+                x_pubkeys=[priv_keys[0].public_key.to_hex(compressed=False)])
+    p2sh = dict(common, type='p2sh', num_sig=2, signatures=[None] * 3,
+                pubkeys=pubkeys + ['02' + '33' * 32], x_pubkeys=pubkeys + ['02' + '33' * 32])
+    return [p2pkh, p2pk, p2sh]
+
+
+class TestEstimatedSize:
+
+    @pytest.mark.parametrize("txin", _estimate_txins())
+    def test_input_size_table(self, txin):
+        script = bytes.fromhex(transaction.Transaction.input_script(txin, True))
+        serialized = transaction.Transaction.serialize_input_bytes(txin, script, True)
+        assert transaction.Transaction.estimated_input_size(txin) == len(serialized)
+
+    def test_incremental(self):
+        address = Address.from_string('1MYXdf4moacvaEKZ57ozerpJ3t9xSeN6LK')
+        tx = transaction.Transaction.from_io([], [(address, 1000)])
+        assert tx.estimated_size() == len(tx.serialize_bytes(True))
+        for txin in _estimate_txins() * 100:
+            tx.add_inputs([txin])
+        tx.add_outputs([(address, 2000)] * 300)
+        assert tx.estimated_size() == len(tx.serialize_bytes(True))
+
+    def test_complete(self):
+        tx = transaction.Transaction(signed_tx_3)
+        assert tx.estimated_size() == len(signed_tx_3) // 2
+
+
+class TestParseTx:
+
+    def test_parse_signed(self):
+        parsed = transaction.parse_tx(bytes.fromhex(signed_blob))
+        assert (parsed.version, parsed.locktime) == (1, 507231)
+        txin, = parsed.inputs
+        assert txin.prev_idx == 1 and txin.value is None
+        output, = parsed.outputs
+        assert isinstance(output.script_pubkey, memoryview)
+        assert output.address == Address.from_string('1MYXdf4moacvaEKZ57ozerpJ3t9xSeN6LK')
+        assert transaction.deserialize(signed_blob) == \
+            transaction.deserialize(bytes.fromhex(signed_blob))
+
+    def test_parse_unsigned_reads_value(self):
+        parsed = transaction.parse_tx(unsigned_blob)
+        assert parsed.inputs[0].value == 20112600
+        assert parsed.inputs[0].to_dict()['value'] == 20112600
+
+    def test_slots(self):
+        parsed = transaction.parse_tx(signed_blob)
+        with pytest.raises(AttributeError):
+            parsed.inputs[0].extra = 1
+        with pytest.raises(AttributeError):
+            parsed.outputs[0].extra = 1
+
+    def test_large_op_return(self):
+        data = bytes(1_000_000)
+        script = bytes([Ops.OP_0, Ops.OP_RETURN]) + push_item(data)
+        tx = Tx(1, [TxInput(bytes(range(32)), 0, Script(bytes.fromhex('51')), 0xffffffff)],
+                [TxOutput(0, Script(script))], 0)
+        raw = tx.to_bytes()
+        parsed = transaction.parse_tx(raw)
+        # The script is a view of the raw transaction, not a copy
+        assert parsed.outputs[0].script_pubkey.obj is raw
+        assert parsed.outputs[0].address.script == script
+        assert transaction.Transaction(raw).txid() == tx.hex_hash()
+
+    def test_truncated(self):
+        with pytest.raises(transaction.SerializationError):
+            transaction.parse_tx(bytes.fromhex(signed_blob)[:-10])
+
+
+class TestXTxInput:
+
+    def test_mapping(self):
+        txin = transaction.XTxInput(bytes(range(32)), 3, value=1000)
+        assert txin['prevout_hash'] == bytes(range(32))[::-1].hex()
+        assert txin['prevout_n'] == 3
+        assert txin.get('sequence', 0) == 0xffffffff - 1
+        # Unset fields are absent, except address
+        assert 'scriptSig' not in txin
+        assert txin.get('num_sig', 1) == 1
+        with pytest.raises(KeyError):
+            txin['pubkeys']
+        assert txin['address'] is None
+        txin['scriptSig'] = '5151'
+        assert txin.script_sig == bytes([0x51, 0x51])
+        txin['scriptSig'] = None
+        assert 'scriptSig' not in txin
+        txin['prev_tx'] = 'tx'
+        assert txin['prev_tx'] == 'tx'
+        assert set(txin) == {'prevout_hash', 'prevout_n', 'sequence', 'value', 'address',
+                             'prev_tx'}
+        del txin['value']
+        assert txin.value is None and 'value' not in txin
+
+    def test_dict_round_trip(self):
+        tx = transaction.Transaction(unsigned_tx)
+        d = transaction.deserialize(unsigned_tx)['inputs'][0]
+        assert isinstance(d, dict)
+        txin = transaction.XTxInput.from_dict(d)
+        assert txin == d
+        assert txin.to_dict() == d
+        assert tx.inputs()[0] == txin
+        copy = txin.copy()
+        copy['value'] = 1
+        assert txin['value'] != 1
+
+    def test_from_io_converts(self):
+        parsed = transaction.Transaction(unsigned_tx)
+        inputs = [txin.to_dict() for txin in parsed.inputs()]
+        outputs = [tuple(output) for output in parsed.outputs()]
+        tx = transaction.Transaction.from_io(inputs, outputs, parsed.locktime)
+        assert all(isinstance(txin, transaction.XTxInput) for txin in tx.inputs())
+        assert all(isinstance(output, transaction.XTxOutput) for output in tx.outputs())
+        address, value = tx.outputs()[0]
+        assert tx.outputs()[0].script_bytes() == address.to_script()
+        assert tx.serialize() == unsigned_tx
+
+    def test_decoded_on_access(self):
+        tx = transaction.Transaction(signed_blob)
+        outputs = tx.outputs()
+        # Nothing is decoded until it is accessed
+        assert all(isinstance(item, transaction.ParsedTxOutput) for item in outputs._items)
+        assert all(isinstance(item, transaction.ParsedTxInput) for item in tx.inputs()._items)
+        output = outputs[0]
+        assert isinstance(output, transaction.XTxOutput)
+        assert outputs._items[0] is output and outputs[0] is output
+        assert isinstance(tx.inputs()._items[0], transaction.ParsedTxInput)
+        assert [tuple(output) for output in outputs] == [
+            (item['address'], item['value'])
+            for item in transaction.deserialize(signed_blob)['outputs']]
+        assert tx.serialize() == signed_blob
+
 
 @pytest.mark.parametrize("script,answer,compressed", (
     ('2102edf5d63693c081edcc571187f219bb303022d0e83ac12b9c1ee803e7a7402312ac',
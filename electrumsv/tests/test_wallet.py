@@ -5,14 +5,20 @@ import shutil
 import sys
 import tempfile
 import unittest
+from unittest import mock
 
 import pytest
-from bitcoinx import PrivateKey, PublicKey
+from bitcoinx import PrivateKey, PublicKey, Script, Tx, TxInput, TxOutput
 
-from electrumsv.address import Address
+from electrumsv.address import Address, ScriptOutput
+from electrumsv.app_state import app_state
 from electrumsv.networks import Net, SVMainnet, SVTestnet
+from electrumsv.simple_config import SimpleConfig
 from electrumsv.storage import WalletStorage, FINAL_SEED_VERSION
-from electrumsv.wallet import sweep_preparations, ImportedPrivkeyWallet
+from electrumsv.transaction import Transaction
+from electrumsv.wallet import (
+    sweep_preparations, ImportedAddressWallet, ImportedPrivkeyWallet, UTXO
+)
 
 from .util import setup_async, tear_down_async
 
@@ -114,6 +120,127 @@ class TestImportedPrivkeyWallet:
 
 
 
+class TestOpReturnChain:
+
+    def test_chain(self, tmp_storage):
+        privkey = PrivateKey.from_random()
+        wallet = ImportedPrivkeyWallet.from_text(tmp_storage, privkey.to_WIF(), None)
+        address = wallet.get_receiving_addresses()[0]
+        coins = [UTXO(value=1_000_000, script_pubkey=address.to_script(),
+                      tx_hash=bytes(range(32)).hex(), out_index=n, height=100,
+                      address=address, is_coinbase=False) for n in range(3)]
+        config = SimpleConfig({'electrum_sv_path': str(tmp_storage.path) + '_dir',
+                               'fee_per_kb': 1000})
+        push_groups = [[b'group', bytes([n]) * 1000] for n in range(5)]
+        txs = list(wallet.make_opreturn_chain(coins, push_groups, config, None))
+
+        assert len(txs) == 5
+        assert all(tx.is_complete() for tx in txs)
+        for n, tx in enumerate(txs):
+            scripts = [output.script_bytes() for output in tx.outputs()]
+            assert ScriptOutput.as_op_return(push_groups[n]).to_script() in scripts
+            assert tx.get_fee() >= config.estimate_fee(len(tx.to_bytes()))
+        for prev_tx, tx in zip(txs, txs[1:]):
+            txin, = tx.inputs()
+            assert txin['prevout_hash'] == prev_tx.txid()
+            assert prev_tx.outputs()[txin['prevout_n']] == (address, txin['value'])
+        # What is left of the chain output is returned
+        assert txs[-1].outputs()[-1] == (address, wallet.dust_threshold())
+
+
+class TestConsolidation:
+
+    def _coins(self, addresses, values):
+        return [UTXO(value=value, script_pubkey=addresses[n % len(addresses)].to_script(),
+                     tx_hash=bytes([n]).hex() * 32, out_index=0, height=100,
+                     address=addresses[n % len(addresses)], is_coinbase=False)
+                for n, value in enumerate(values)]
+
+    def test_consolidation(self, tmp_storage):
+        keys = [PrivateKey.from_random() for n in range(3)]
+        wallet = ImportedPrivkeyWallet.from_text(
+            tmp_storage, ' '.join(key.to_WIF() for key in keys), None)
+        addresses = wallet.get_receiving_addresses()
+        config = SimpleConfig({'electrum_sv_path': str(tmp_storage.path) + '_dir',
+                               'consolidation_min_coins': 6,
+                               'consolidation_max_value': 10_000})
+        coins = self._coins(addresses, [5_000_000] + [5_000] * 8)
+        # Not at the default fee rate
+        assert wallet.make_consolidation_transaction(coins, config) is None
+        config.set_key('fee_per_kb', 500)
+
+        # The large coin at the first address is spent with its small coins
+        tx, spent = wallet.make_consolidation_transaction(coins, config)
+        assert set(spent) == set(coins)
+        assert len(tx.outputs()) == 1
+        assert tx.output_value() == sum(coin.value for coin in coins) - tx.get_fee()
+        assert tx.get_fee() >= config.estimate_fee(tx.estimated_size())
+
+        # Too few small coins
+        assert wallet.make_consolidation_transaction(coins[:6], config) is None
+        # Fees too high
+        config.set_key('customfee', 2000)
+        assert wallet.make_consolidation_transaction(coins, config) is None
+        config.set_key('customfee', None)
+
+        # At most the maximum inputs are spent, whole addresses at a time
+        config.set_key('consolidation_max_inputs', 5)
+        with mock.patch.object(wallet, '_add_input_info',
+                               wraps=wallet._add_input_info) as add_input_info:
+            tx, spent = wallet.make_consolidation_transaction(coins, config)
+        # Once for each address to size the coins, then for each chosen coin
+        assert add_input_info.call_count == len(addresses) + len(spent)
+        assert len(spent) == 3
+        assert len({coin.address for coin in spent}) == 1
+        assert coins[0] not in spent
+
+    def test_reserve_coins(self, tmp_storage):
+        wallet = ImportedPrivkeyWallet.from_text(
+            tmp_storage, PrivateKey.from_random().to_WIF(), None)
+        address = wallet.get_receiving_addresses()[0]
+        coins = self._coins([address], [5_000] * 3)
+        tx_id = 'ab' * 32
+        wallet.reserve_coins(tx_id, coins[:2])
+        assert wallet._reserved_coins == {coin.key() for coin in coins[:2]}
+        # Kept while the consolidation is unconfirmed
+        wallet._history[address] = [(tx_id, 0)]
+        wallet.release_settled_coins()
+        assert wallet._reserved_coins == {coin.key() for coin in coins[:2]}
+        # Released once it is confirmed or gone
+        wallet._history[address] = [(tx_id, 100)]
+        wallet.release_settled_coins()
+        assert not wallet._reserved_coins
+        wallet.reserve_coins(tx_id, coins)
+        wallet._history[address] = []
+        wallet.release_settled_coins()
+        assert not wallet._reserved_coins and not wallet._reservations
+
+
+class TestPendingTransactions:
+
+    def _paying_tx(self, address, amount):
+        tx = Tx(1, [TxInput(bytes(range(32)), 0, Script(b'\x51'), 0xffffffff)],
+                [TxOutput(amount, Script(address.to_script()))], 0)
+        return Transaction(tx.to_hex())
+
+    def test_new_history_queues_missing_transactions(self, tmp_storage):
+        address = Address.from_string('1KXf5PUHNaV42jE9NbJFPKhGGN1fSSGJNK')
+        wallet = ImportedAddressWallet.from_text(tmp_storage, address.to_string())
+        tx = self._paying_tx(address, 25_000)
+        tx_hash = tx.txid()
+
+        app_state.async_.spawn_and_wait(wallet.set_address_history, address,
+                                        [(tx_hash, 0)], {tx_hash: 226})
+        assert wallet.pop_pending_transactions() == {tx_hash}
+        assert wallet.pop_pending_transactions() == set()
+
+        wallet.requeue_transactions([tx_hash])
+        wallet.add_transaction(tx_hash, tx)
+        # Added transactions are dropped from the queue
+        assert wallet.pop_pending_transactions() == set()
+        assert wallet.get_received_payments(tx_hash) == {address: 25_000}
+
+
 sweep_utxos = {
     # SZEfg4eYxCJoqzumUqP34g uncompressed, address 1KXf5PUHNaV42jE9NbJFPKhGGN1fSSGJNK
     "6dd52f21a1376a67370452d1edfc811bc9d3f344bc7d973616ee27cebfd1940b": [
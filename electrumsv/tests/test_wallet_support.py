@@ -1,6 +1,6 @@
 import unittest
 
-from electrumsv import wallet_support
+from electrumsv import keystore, wallet_support
 
 
 TI_MINIKEY = 'SzavMBLoXU6kDrqtUVmffv'
@@ -43,3 +43,28 @@ class Test_TextImportIdentification(unittest.TestCase):
         matches = wallet_support.find_matching_text_import_types(SW_NOTHING)
         self.assertEqual(matches, set([]))
 
+
+
+class Test_AccountDiscovery(unittest.TestCase):
+    def test_discover_accounts(self):
+        bip32_seed = keystore.bip39_to_seed(SW_BIP39, '')
+        used = {"m/44'/145'/0'": 4, "m/44'/145'/2'": 0, "m/44'/0'/5'": 0}
+        used_script_hashes = {
+            candidate.addresses[used[candidate.derivation]].to_scripthash_hex()
+            for candidate in keystore.derive_account_candidates(bip32_seed, list(used), 5)
+        }
+        requests = []
+
+        def get_histories(script_hashes):
+            requests.append(len(script_hashes))
+            return [[{'tx_hash': 'ab' * 32, 'height': 1}] if script_hash in used_script_hashes
+                    else [] for script_hash in script_hashes]
+
+        accounts = wallet_support.discover_accounts(bip32_seed, get_histories,
+                                                    coin_types=(0, 145))
+        self.assertEqual([account.derivation for account in accounts],
+                         ["m/44'/145'/0'", "m/44'/145'/2'"])
+        # Two accounts of each coin type, then the third, then the fourth and fifth
+        self.assertEqual(requests, [20, 5, 10])
+        self.assertEqual(accounts[0].xpub,
+                         keystore.from_bip39_seed(SW_BIP39, '', "m/44'/145'/0'").xpub)
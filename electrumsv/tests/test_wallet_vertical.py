@@ -1,3 +1,4 @@
+import copy
 import tempfile
 import unittest
 from unittest import mock
@@ -128,6 +129,58 @@ class TestWalletKeystoreAddressIntegrity(unittest.TestCase):
         self.assertEqual(w.get_receiving_addresses()[0], Address.from_string('32ji3QkAgXNz6oFoRfakyD3ys1XXiERQYN'))
         self.assertEqual(w.get_change_addresses()[0], Address.from_string('36XWwEHrrVCLnhjK5MrVVGmUHghr9oWTN1'))
 
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_multisig_records(self, mock_write):
+        ks1 = keystore.from_seed('blast uniform dragon fiscal ensure vast young utility '
+                                 'dinosaur abandon rookie sure', '', True)
+        ks2 = keystore.from_xpub('xpub661MyMwAqRbcGfCPEkkyo5WmcrhTq8mi3xuBS7VEZ3LYvsgY1cCFDben'
+                                 'T33bdD12axvrmXhuX3xkAbKci3yZY9ZEk8vhLic7KNhLjqdh5ec')
+        w = self._create_multisig_wallet(ks1, ks2)
+        address = w.get_change_addresses()[0]
+        pubkeys = w.derive_pubkeys(True, 0)
+        record = w.get_multisig_record(address)
+        self.assertEqual(list(record.pubkeys), sorted(pubkeys))
+        self.assertEqual(w.get_public_keys(address), pubkeys)
+        self.assertEqual(record.redeem_script, w.pubkeys_to_redeem_script(pubkeys))
+        self.assertEqual(Address.from_multisig_script(record.redeem_script), address)
+
+        txin = {'address': address}
+        w._add_input_sig_info(txin, address)
+        self.assertEqual(txin['pubkeys'], sorted(pubkeys))
+        self.assertEqual([keystore.xpubkey_to_pubkey(x) for x in txin['x_pubkeys']],
+                         txin['pubkeys'])
+
+        # Saved records are loaded deriving only a sample of the keys of each chain to check
+        # them
+        w.create_new_addresses(False, 20)
+        data = w.save_addresses()
+        checked = sum(min(len(addresses), w.multisig_records_checked)
+                      for addresses in (w.get_receiving_addresses(), w.get_change_addresses()))
+        with mock.patch.object(w, 'derive_pubkeys', wraps=w.derive_pubkeys) as derive_pubkeys:
+            w.load_addresses(data)
+            self.assertEqual(w.get_multisig_record(address), record)
+            self.assertEqual(derive_pubkeys.call_count, checked)
+        self.assertLess(checked, len(w.get_addresses()))
+        self.assertEqual(w.save_addresses(), data)
+        # Saved keys not matching the keystores are ignored
+        bad_data = copy.deepcopy(data)
+        bad_data['multisig']['receiving'][-1][1].reverse()
+        w.load_addresses(bad_data)
+        self.assertEqual(w.get_change_addresses()[0], address)
+        self.assertEqual(w.get_multisig_record(address), record)
+        # As are malformed keys, whether or not they are in the sample checked
+        for name, index in (('change', 0), ('receiving', 1)):
+            bad_data = copy.deepcopy(data)
+            bad_data['multisig'][name][index][0].reverse()
+            w.load_addresses(bad_data)
+            self.assertEqual(w.get_change_addresses()[0], address)
+            self.assertEqual(w.get_multisig_record(address), record)
+        # Data saved without records
+        del data['multisig']
+        w.load_addresses(data)
+        self.assertEqual(w.get_change_addresses()[0], address)
+        self.assertEqual(w.get_multisig_record(address), record)
+
     @mock.patch.object(storage.WalletStorage, '_write')
     def test_bip39_multisig_seed_bip45_standard(self, mock_write):
         seed_words = 'treat dwarf wealth gasp brass outside high rent blood crowd make initial'
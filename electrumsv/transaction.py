@@ -23,24 +23,38 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from collections import namedtuple
+from collections.abc import MutableMapping, MutableSequence
 import struct
 
 from bitcoinx import (
-    PublicKey, PrivateKey, Ops, hash_to_hex_str, der_signature_to_compact, InvalidSignatureError,
-    P2MultiSig_Output, push_int, push_item, pack_byte
+    PublicKey, PrivateKey, Ops, hash_to_hex_str, hex_str_to_hash, der_signature_to_compact,
+    InvalidSignatureError, P2MultiSig_Output, push_int, push_item, pack_byte, pack_le_int32,
+    pack_le_int64, pack_le_uint32, pack_varint, pack_varbytes
 )
 
 from .address import (
     Address, ScriptOutput, UnknownAddress
 )
-from .bitcoin import to_bytes, push_script, public_key_to_p2pk_script, int_to_hex, var_int
+from .bitcoin import to_bytes, push_script, public_key_to_p2pk_script, int_to_hex
 from .crypto import sha256d, hash_160
 from .keystore import xpubkey_to_address, xpubkey_to_pubkey
 from .logs import logs
-from .util import profiler, bfh, bh2u
+from .util import bfh, bh2u
 
 
 NO_SIGNATURE = 'ff'
+# Signatures are assumed to be this long when estimating sizes
+ESTIMATED_SIGNATURE_SIZE = 0x48
+# Serialized outpoint and sequence number
+_INPUT_FIXED_SIZE = 32 + 4 + 4
+# Serialized version and locktime
+_TX_FIXED_SIZE = 4 + 4
+# Fewer signatures than this are made in-process even if parallel signing is requested, as
+# starting worker processes would take longer
+PARALLEL_SIGNING_MIN_INPUTS = 64
+# Signatures made by each task given to a signing executor
+PARALLEL_SIGNING_CHUNK_SIZE = 32
 
 logger = logs.get_logger("transaction")
 
@@ -290,71 +304,412 @@ def get_address_from_output_script(_bytes):
     match = [ Ops.OP_DUP, Ops.OP_HASH160, Ops.OP_PUSHDATA4,
               Ops.OP_EQUALVERIFY, Ops.OP_CHECKSIG ]
     if _match_decoded(decoded, match):
-        return Address.from_P2PKH_hash(decoded[2][1])
+        return Address.from_P2PKH_hash(bytes(decoded[2][1]))
 
     # p2sh
     match = [ Ops.OP_HASH160, Ops.OP_PUSHDATA4, Ops.OP_EQUAL ]
     if _match_decoded(decoded, match):
-        return Address.from_P2SH_hash(decoded[1][1])
+        return Address.from_P2SH_hash(bytes(decoded[1][1]))
 
     return ScriptOutput(bytes(_bytes))
 
 
-def _parse_input(vds):
-    d = {}
-    prevout_hash = hash_to_hex_str(vds.read_bytes(32))
-    prevout_n = vds.read_uint32()
-    scriptSig = vds.read_bytes(vds.read_compact_size())
-    sequence = vds.read_uint32()
-    d['prevout_hash'] = prevout_hash
-    d['prevout_n'] = prevout_n
-    d['sequence'] = sequence
-    d['address'] = UnknownAddress()
-    if prevout_hash == '00'*32:
-        d['type'] = 'coinbase'
-        d['scriptSig'] = bh2u(scriptSig)
-    else:
-        d['x_pubkeys'] = []
-        d['pubkeys'] = []
-        d['signatures'] = {}
-        d['address'] = None
-        d['type'] = 'unknown'
-        d['num_sig'] = 0
-        d['scriptSig'] = bh2u(scriptSig)
-        _parse_scriptSig(d, scriptSig)
+class _TxReader:
+    '''Reads a serialized transaction through a memoryview.  Byte fields are returned as
+    memoryview slices of the underlying buffer so nothing is copied.'''
 
-        if not Transaction.is_txin_complete(d):
-            d['value'] = vds.read_uint64()
-    return d
+    __slots__ = ('view', 'cursor')
 
+    def __init__(self, raw):
+        self.view = memoryview(raw)
+        self.cursor = 0
 
-def parse_output(vds, i):
-    d = {}
-    d['value'] = vds.read_int64()
-    scriptPubKey = vds.read_bytes(vds.read_compact_size())
-    d['address'] = get_address_from_output_script(scriptPubKey)
-    d['scriptPubKey'] = bh2u(scriptPubKey)
-    d['prevout_n'] = i
-    return d
+    def read_bytes(self, length):
+        start = self.cursor
+        end = start + length
+        if end > len(self.view):
+            raise SerializationError('attempt to read past end of buffer')
+        self.cursor = end
+        return self.view[start: end]
+
+    def _read_num(self, struct_format):
+        try:
+            (result, ) = struct_format.unpack_from(self.view, self.cursor)
+        except struct.error as e:
+            raise SerializationError(e)
+        self.cursor += struct_format.size
+        return result
 
+    def read_int32(self):
+        return self._read_num(_struct_le_int32)
 
-def deserialize(raw):
-    vds = _BCDataStream()
-    vds.write(bfh(raw))
+    def read_uint32(self):
+        return self._read_num(_struct_le_uint32)
+
+    def read_int64(self):
+        return self._read_num(_struct_le_int64)
+
+    def read_uint64(self):
+        return self._read_num(_struct_le_uint64)
+
+    def read_compact_size(self):
+        size = self.read_bytes(1)[0]
+        if size == 253:
+            return self._read_num(_struct_le_uint16)
+        if size == 254:
+            return self.read_uint32()
+        if size == 255:
+            return self.read_uint64()
+        return size
+
+
+_struct_le_uint16 = struct.Struct('<H')
+_struct_le_int32 = struct.Struct('<i')
+_struct_le_uint32 = struct.Struct('<I')
+_struct_le_int64 = struct.Struct('<q')
+_struct_le_uint64 = struct.Struct('<Q')
+# A push of the byte 0xff, which stands in for a missing signature in unsigned transactions
+_NO_SIGNATURE_PUSH = bytes([1]) + bfh(NO_SIGNATURE)
+
+
+# Mapping key -> (XTxInput attribute, conversion on setting, conversion on getting)
+_TXIN_FIELDS = {
+    'prevout_hash': ('prev_hash', hex_str_to_hash, hash_to_hex_str),
+    'prevout_n': ('prev_idx', None, None),
+    'scriptSig': ('script_sig', bfh, bytes.hex),
+    'sequence': ('sequence', None, None),
+    'value': ('value', None, None),
+    'type': ('type', None, None),
+    'address': ('address', None, None),
+    'num_sig': ('num_sig', None, None),
+    'x_pubkeys': ('x_pubkeys', None, None),
+    'pubkeys': ('pubkeys', None, None),
+    'signatures': ('signatures', None, None),
+    'redeemScript': ('redeem_script', None, None),
+}
+
+
+class XTxInput(MutableMapping):
+    '''A transaction input.  The outpoint hash and scripts are held as bytes.
+
+    For code written against the dictionaries inputs used to be, it is also a mutable
+    mapping with their keys ('prevout_hash', 'scriptSig', 'x_pubkeys' and so on) and hex
+    values.  An attribute that is None is absent from the mapping, except for 'address'
+    which is always present.  Other keys, such as 'prev_tx', are kept in a dictionary.
+    '''
+
+    __slots__ = ('prev_hash', 'prev_idx', 'script_sig', 'sequence', 'value', 'type',
+                 'address', 'num_sig', 'x_pubkeys', 'pubkeys', 'signatures', 'redeem_script',
+                 '_extra')
+
+    def __init__(self, prev_hash, prev_idx, script_sig=None, sequence=0xffffffff - 1,
+                 value=None, type=None, address=None, num_sig=None, x_pubkeys=None,
+                 pubkeys=None, signatures=None, redeem_script=None):
+        self.prev_hash = prev_hash
+        self.prev_idx = prev_idx
+        self.script_sig = script_sig
+        self.sequence = sequence
+        self.value = value
+        self.type = type
+        self.address = address
+        self.num_sig = num_sig
+        self.x_pubkeys = x_pubkeys
+        self.pubkeys = pubkeys
+        self.signatures = signatures
+        self.redeem_script = redeem_script
+        self._extra = None
+
+    @classmethod
+    def from_dict(cls, d):
+        txin = cls(None, None)
+        txin.update(d)
+        return txin
+
+    def to_dict(self):
+        return {key: self[key] for key in self}
+
+    def copy(self):
+        '''A shallow copy, as for a dictionary.'''
+        result = XTxInput(self.prev_hash, self.prev_idx)
+        for name in self.__slots__:
+            setattr(result, name, getattr(self, name))
+        if self._extra is not None:
+            result._extra = self._extra.copy()
+        return result
+
+    def outpoint_bytes(self):
+        return self.prev_hash + pack_le_uint32(self.prev_idx)
+
+    def __getitem__(self, key):
+        field = _TXIN_FIELDS.get(key)
+        if field is None:
+            if self._extra is None:
+                raise KeyError(key)
+            return self._extra[key]
+        name, _to_field, from_field = field
+        value = getattr(self, name)
+        if value is None:
+            if key == 'address':
+                return None
+            raise KeyError(key)
+        return value if from_field is None else from_field(value)
+
+    def __setitem__(self, key, value):
+        field = _TXIN_FIELDS.get(key)
+        if field is None:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+        else:
+            name, to_field, _from_field = field
+            if value is not None and to_field is not None:
+                value = to_field(value)
+            setattr(self, name, value)
+
+    def __delitem__(self, key):
+        field = _TXIN_FIELDS.get(key)
+        if field is None:
+            if self._extra is None:
+                raise KeyError(key)
+            del self._extra[key]
+        else:
+            if getattr(self, field[0]) is None:
+                raise KeyError(key)
+            setattr(self, field[0], None)
+
+    def __iter__(self):
+        for key, (name, _to_field, _from_field) in _TXIN_FIELDS.items():
+            if key == 'address' or getattr(self, name) is not None:
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return f'XTxInput({self.to_dict()!r})'
+
+
+class XTxOutput(namedtuple('XTxOutput', 'address value')):
+    '''A transaction output.  It unpacks as the (address, value) pair outputs used to be.'''
+
+    __slots__ = ()
+
+    def script_bytes(self):
+        return Transaction.pay_script_bytes(self.address)
+
+
+def to_txin(txin):
+    return txin if isinstance(txin, XTxInput) else XTxInput.from_dict(txin)
+
+
+class ParsedTxInput:
+    '''An input of a parsed transaction.  The script is only decoded when to_txin() is
+    called.'''
+
+    __slots__ = ('prev_hash', 'prev_idx', 'script_sig', 'sequence', 'value')
+
+    def __init__(self, prev_hash, prev_idx, script_sig, sequence, value):
+        self.prev_hash = prev_hash
+        self.prev_idx = prev_idx
+        self.script_sig = script_sig
+        self.sequence = sequence
+        self.value = value
+
+    def is_coinbase(self):
+        return self.prev_hash == bytes(32)
+
+    def to_txin(self):
+        '''The input as an XTxInput, as used by Transaction.'''
+        script_sig = self.script_sig
+        if self.is_coinbase():
+            return XTxInput(self.prev_hash, self.prev_idx, script_sig, self.sequence,
+                            type='coinbase', address=UnknownAddress())
+        txin = XTxInput(self.prev_hash, self.prev_idx, script_sig, self.sequence, self.value,
+                        'unknown', None, 0, [], [], {})
+        _parse_scriptSig(txin, script_sig)
+        return txin
+
+    def to_dict(self):
+        '''The input as a dictionary.'''
+        return self.to_txin().to_dict()
+
+
+class ParsedTxOutput:
+    '''An output of a parsed transaction.  script_pubkey is a view of the raw transaction;
+    the address is decoded on first access.'''
+
+    __slots__ = ('value', 'script_pubkey', '_address')
+
+    def __init__(self, value, script_pubkey):
+        self.value = value
+        self.script_pubkey = script_pubkey
+        self._address = None
+
+    @property
+    def address(self):
+        if self._address is None:
+            self._address = get_address_from_output_script(self.script_pubkey)
+        return self._address
+
+    def to_dict(self, n):
+        '''The output as a dictionary in the form returned by deserialize().'''
+        return {
+            'value': self.value,
+            'address': self.address,
+            'scriptPubKey': self.script_pubkey.hex(),
+            'prevout_n': n,
+        }
+
+    def to_txout(self):
+        return XTxOutput(self.address, self.value)
+
+
+class ParsedTx:
+
+    __slots__ = ('version', 'inputs', 'outputs', 'locktime')
+
+    def __init__(self, version, inputs, outputs, locktime):
+        self.version = version
+        self.inputs = inputs
+        self.outputs = outputs
+        self.locktime = locktime
+
+
+class _DecodedOnAccess(MutableSequence):
+    '''The inputs or outputs of a parsed transaction as a list.  Each is held as its parsed
+    record and decoded with decode() when first accessed, so that transactions whose inputs
+    or outputs are mostly not looked at are not fully decoded.'''
+
+    __slots__ = ('_items', '_decode')
+
+    def __init__(self, records, decode):
+        self._items = list(records)
+        self._decode = decode
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[n] for n in range(*index.indices(len(self._items)))]
+        item = self._items[index]
+        if isinstance(item, (ParsedTxInput, ParsedTxOutput)):
+            item = self._items[index] = self._decode(item)
+        return item
+
+    def __setitem__(self, index, item):
+        self._items[index] = item
+
+    def __delitem__(self, index):
+        del self._items[index]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __eq__(self, other):
+        return isinstance(other, (list, _DecodedOnAccess)) and list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
 
-    d = {}
-    d['version'] = vds.read_int32()
-    n_vin = vds.read_compact_size()
+    def insert(self, index, item):
+        self._items.insert(index, item)
+
+    def sort(self, *, key=None, reverse=False):
+        self._items = sorted(self, key=key, reverse=reverse)
+
+
+def _read_input(reader):
+    prev_hash = bytes(reader.read_bytes(32))
+    prev_idx = reader.read_uint32()
+    # Input scripts are small so are copied; output scripts can be megabytes
+    script_sig = bytes(reader.read_bytes(reader.read_compact_size()))
+    sequence = reader.read_uint32()
+    value = None
+    # Unsigned transactions in our extended format follow each incomplete input with its
+    # value.  An input can only be incomplete if its script pushes a missing signature, so
+    # the full script decode is avoided for signed inputs.
+    if _NO_SIGNATURE_PUSH in script_sig and prev_hash != bytes(32):
+        d = {'signatures': {}, 'num_sig': 0}
+        _parse_scriptSig(d, script_sig)
+        if not Transaction.is_txin_complete(d):
+            value = reader.read_uint64()
+    return ParsedTxInput(prev_hash, prev_idx, script_sig, sequence, value)
+
+
+def _read_output(reader):
+    value = reader.read_int64()
+    return ParsedTxOutput(value, reader.read_bytes(reader.read_compact_size()))
+
+
+def parse_tx(raw):
+    '''Parse a serialized transaction, given as bytes or hex, into a ParsedTx without copying
+    its scripts or decoding them.'''
+    reader = _TxReader(raw if not isinstance(raw, str) else bfh(raw))
+    version = reader.read_int32()
+    n_vin = reader.read_compact_size()
     assert n_vin != 0
-    d['inputs'] = [_parse_input(vds) for i in range(n_vin)]
-    n_vout = vds.read_compact_size()
-    d['outputs'] = [parse_output(vds, i) for i in range(n_vout)]
-    d['lockTime'] = vds.read_uint32()
-    return d
+    inputs = [_read_input(reader) for i in range(n_vin)]
+    n_vout = reader.read_compact_size()
+    outputs = [_read_output(reader) for i in range(n_vout)]
+    locktime = reader.read_uint32()
+    return ParsedTx(version, inputs, outputs, locktime)
+
+
+def deserialize(raw):
+    '''raw is the serialized transaction as bytes or hex.'''
+    parsed = parse_tx(raw)
+    return {
+        'version': parsed.version,
+        'inputs': [txin.to_dict() for txin in parsed.inputs],
+        'outputs': [output.to_dict(n) for n, output in enumerate(parsed.outputs)],
+        'lockTime': parsed.locktime,
+    }
 
 
 # pay & redeem scripts
 
+def _sign_digests(items):
+    '''Returns DER signatures of a list of (private key bytes, digest) pairs.  This is the
+    work done by each process when signing in parallel.'''
+    return [PrivateKey(privkey_bytes).sign(digest, None) for privkey_bytes, digest in items]
+
+
+def _varint_size(n):
+    return 1 if n < 0xfd else 3 if n <= 0xffff else 5 if n <= 0xffffffff else 9
+
+
+def _push_size(n):
+    '''The size of a push of n bytes of data, other than 0 or 1 bytes.'''
+    return n + (1 if n < Ops.OP_PUSHDATA1 else 2 if n <= 0xff else 3 if n <= 0xffff else 5)
+
+
+def _p2pk_script_size(txin, pubkey_size):
+    return _push_size(ESTIMATED_SIGNATURE_SIZE)
+
+
+def _p2pkh_script_size(txin, pubkey_size):
+    return _push_size(ESTIMATED_SIGNATURE_SIZE) + _push_size(pubkey_size)
+
+
+def _p2sh_script_size(txin, pubkey_size):
+    threshold = txin['num_sig']
+    count = len(txin.get('x_pubkeys', [None]))
+    redeem_script_size = (len(push_int(threshold)) + count * _push_size(pubkey_size) +
+                          len(push_int(count)) + 1)
+    # OP_0, signatures, then the redeem script
+    return (1 + threshold * _push_size(ESTIMATED_SIGNATURE_SIZE) +
+            _push_size(redeem_script_size))
+
+
+# Input type -> function returning the estimated size of its input script, given the txin
+# and its pubkey size.  Other types are measured by serializing the input.
+_ESTIMATED_SCRIPT_SIZES = {
+    'p2pk': _p2pk_script_size,
+    'p2pkh': _p2pkh_script_size,
+    'p2sh': _p2sh_script_size,
+}
+
+
 def multisig_script(public_keys, threshold):
     '''public_keys should be sorted hex strings.  P2MultiSig_Ouput is not used as they may be
     derivation rules and not valid public keys.
@@ -394,37 +749,61 @@ class Transaction:
     FORKID = 0x000000
 
     def __str__(self):
-        if self.raw is None:
-            self.raw = self.serialize()
-        return self.raw
+        return self.to_bytes().hex()
 
     def __init__(self, raw):
+        '''raw is the serialized transaction as bytes or hex, a dict with the hex under the
+        'hex' key, or None.'''
         if raw is None:
             self.raw = None
         elif isinstance(raw, str):
             self.raw = raw.strip() if raw else None
         elif isinstance(raw, dict):
             self.raw = raw['hex']
+        elif isinstance(raw, (bytes, bytearray, memoryview)):
+            self._raw = bytes(raw)
         else:
             raise Exception("cannot initialize transaction", raw)
         self._inputs = None
         self._outputs = None
+        self._sighash_hashes = None
+        # Estimated serialized sizes of the inputs and of the outputs, maintained as they are
+        # added.  None when they need recalculating.
+        self._size_model = None
         self.locktime = 0
         self.version = 1
 
+    @property
+    def raw(self):
+        '''The serialized transaction as hex, or None if it needs reserializing.  It is held
+        as bytes; hex is only produced here.'''
+        return None if self._raw is None else self._raw.hex()
+
+    @raw.setter
+    def raw(self, raw):
+        self._raw = bytes.fromhex(raw) if isinstance(raw, str) else raw
+
+    def to_bytes(self):
+        '''The serialized transaction as bytes.'''
+        if self._raw is None:
+            self._raw = self.serialize_bytes()
+        return self._raw
+
     def update(self, raw):
         self.raw = raw
         self._inputs = None
+        self._sighash_hashes = None
+        self._size_model = None
         self.deserialize()
 
     def inputs(self):
         if self._inputs is None:
-            self.deserialize()
+            self._parse()
         return self._inputs
 
     def outputs(self):
         if self._outputs is None:
-            self.deserialize()
+            self._parse()
         return self._outputs
 
     @classmethod
@@ -457,7 +836,7 @@ class Transaction:
             logger.warning(f'Signature {i}: {sig}')
             if sig in txin.get('signatures'):
                 continue
-            pre_hash = sha256d(bfh(self.serialize_preimage(i)))
+            pre_hash = sha256d(self.serialize_preimage_bytes(i))
             rec_sig_base = der_signature_to_compact(signatures[i])
             for recid in range(4):
                 rec_sig = rec_sig_base + bytes([recid])
@@ -479,7 +858,7 @@ class Transaction:
                     self.add_signature_to_txin(i, j, sig)
                     break
         # redo raw
-        self.raw = self.serialize()
+        self._raw = self.serialize_bytes()
 
     def add_signature_to_txin(self, i, signingPos, sig):
         assert isinstance(sig, str)
@@ -488,35 +867,49 @@ class Transaction:
         txin['scriptSig'] = None  # force re-serialization
         self.raw = None
 
+    def _parse(self):
+        '''Parse the raw transaction if not already done.  Returns the ParsedTx or None.'''
+        if self._raw is None or self._inputs is not None:
+            return None
+        parsed = parse_tx(self._raw)
+        self._inputs = _DecodedOnAccess(parsed.inputs, ParsedTxInput.to_txin)
+        self._sighash_hashes = None
+        self._size_model = None
+        self._outputs = _DecodedOnAccess(parsed.outputs, ParsedTxOutput.to_txout)
+        self.locktime = parsed.locktime
+        self.version = parsed.version
+        return parsed
+
     def deserialize(self) -> dict:
-        if self.raw is None:
-            return
-        if self._inputs is not None:
-            return
-        d = deserialize(self.raw)
-        self._inputs = d['inputs']
-        self._outputs = [(x['address'], x['value']) for x in d['outputs']]
-        assert all(isinstance(addr, (PublicKey, Address, ScriptOutput))
-                   for addr, value in self._outputs)
-        self.locktime = d['lockTime']
-        self.version = d['version']
-        return d
+        parsed = self._parse()
+        if parsed is None:
+            return None
+        return {
+            'version': parsed.version,
+            'inputs': [txin.to_dict() for txin in self._inputs],
+            'outputs': [output.to_dict(n) for n, output in enumerate(parsed.outputs)],
+            'lockTime': parsed.locktime,
+        }
 
     @classmethod
     def from_io(klass, inputs, outputs, locktime=0):
         assert all(isinstance(addr, (PublicKey, Address, ScriptOutput))
                    for addr, value in outputs)
         self = klass(None)
-        self._inputs = inputs
-        self._outputs = outputs.copy()
+        self._inputs = [to_txin(txin) for txin in inputs]
+        self._outputs = [XTxOutput(*output) for output in outputs]
         self.locktime = locktime
         return self
 
     @classmethod
     def pay_script(self, output):
+        return self.pay_script_bytes(output).hex()
+
+    @classmethod
+    def pay_script_bytes(self, output):
         if isinstance(output, PublicKey):
-            return output.P2PK_script().to_hex()
-        return output.to_script().hex()
+            return bytes(output.P2PK_script())
+        return output.to_script()
 
     @classmethod
     def estimate_pubkey_size_from_x_pubkey(cls, x_pubkey):
@@ -614,75 +1007,115 @@ class Transaction:
 
     @classmethod
     def serialize_outpoint(self, txin):
-        return bh2u(bfh(txin['prevout_hash'])[::-1]) + int_to_hex(txin['prevout_n'], 4)
+        return self.serialize_outpoint_bytes(txin).hex()
+
+    @classmethod
+    def serialize_outpoint_bytes(self, txin):
+        return hex_str_to_hash(txin['prevout_hash']) + pack_le_uint32(txin['prevout_n'])
 
     @classmethod
     def serialize_input(self, txin, script, estimate_size=False):
-        # Prev hash and index
-        s = self.serialize_outpoint(txin)
-        # Script length, script, sequence
-        s += var_int(len(script)//2)
-        s += script
-        s += int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
+        return self.serialize_input_bytes(txin, bfh(script), estimate_size).hex()
+
+    @classmethod
+    def serialize_input_bytes(self, txin, script, estimate_size=False):
+        '''script is the input script as bytes.'''
+        parts = [
+            # Prev hash and index
+            self.serialize_outpoint_bytes(txin),
+            # Script length, script, sequence
+            pack_varbytes(script),
+            pack_le_uint32(txin.get('sequence', 0xffffffff - 1)),
+        ]
         # offline signing needs to know the input value
         if ('value' in txin   # Legacy txs
             and not (estimate_size or self.is_txin_complete(txin))):
-            s += int_to_hex(txin['value'], 8)
-        return s
+            parts.append(pack_le_int64(txin['value']))
+        return b''.join(parts)
 
     def BIP_LI01_sort(self):
         # See https://github.com/kristovatlas/rfc/blob/master/bips/bip-li01.mediawiki
-        self._inputs.sort(key = lambda i: (i['prevout_hash'], i['prevout_n']))
+        # Byte-reversed hashes sort as their hex does
+        self._inputs.sort(key = lambda txin: (txin.prev_hash[::-1], txin.prev_idx))
         self._outputs.sort(key = lambda output: (output[1], self.pay_script(output[0])))
+        self._sighash_hashes = None
 
     def serialize_output(self, output):
+        return self.serialize_output_bytes(output).hex()
+
+    def serialize_output_bytes(self, output):
         addr, amount = output
-        s = int_to_hex(amount, 8)
-        script = self.pay_script(addr)
-        s += var_int(len(script)//2)
-        s += script
-        return s
+        return pack_le_int64(amount) + pack_varbytes(self.pay_script_bytes(addr))
 
     @classmethod
     def nHashType(cls):
         '''Hash type in hex.'''
         return 0x01 | (cls.SIGHASH_FORKID + (cls.FORKID << 8))
 
+    def invalidate_sighash_context(self):
+        '''Call after changing the outpoints or sequence numbers of inputs, or outputs, in
+        place.  Adding inputs or outputs through this class does so automatically.'''
+        self._sighash_hashes = None
+
+    def sighash_context(self):
+        '''Returns (hashPrevouts, hashSequence, hashOutputs) as bytes.  These are common to
+        the preimages of every input, so are computed once and cached until inputs or outputs
+        change.'''
+        if self._sighash_hashes is None:
+            inputs = self.inputs()
+            prevouts = bytearray()
+            sequences = bytearray()
+            for txin in inputs:
+                prevouts += txin.outpoint_bytes()
+                sequences += pack_le_uint32(txin.sequence)
+            outputs = bytearray()
+            for output in self.outputs():
+                outputs += self.serialize_output_bytes(output)
+            self._sighash_hashes = (sha256d(prevouts), sha256d(sequences), sha256d(outputs))
+        return self._sighash_hashes
+
+    def serialize_preimages(self):
+        '''Returns the preimages of all inputs, as bytes, in one pass.'''
+        return [self.serialize_preimage_bytes(i) for i in range(len(self.inputs()))]
+
     def serialize_preimage(self, i):
-        nVersion = int_to_hex(self.version, 4)
-        nHashType = int_to_hex(self.nHashType(), 4)
-        nLocktime = int_to_hex(self.locktime, 4)
-        inputs = self.inputs()
-        outputs = self.outputs()
-        txin = inputs[i]
-
-        hashPrevouts = bh2u(sha256d(bfh(''.join(self.serialize_outpoint(txin) for txin in inputs))))
-        hashSequence = bh2u(sha256d(bfh(''.join(int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
-                                             for txin in inputs))))
-        hashOutputs = bh2u(sha256d(bfh(''.join(self.serialize_output(o) for o in outputs))))
-        outpoint = self.serialize_outpoint(txin)
-        preimage_script = self.get_preimage_script(txin)
-        scriptCode = var_int(len(preimage_script) // 2) + preimage_script
-        try:
-            amount = int_to_hex(txin['value'], 8)
-        except KeyError:
+        return self.serialize_preimage_bytes(i).hex()
+
+    def serialize_preimage_bytes(self, i):
+        # Deserialize first so version and locktime are correct
+        txin = self.inputs()[i]
+        hashPrevouts, hashSequence, hashOutputs = self.sighash_context()
+        if txin.value is None:
             raise InputValueMissing
-        nSequence = int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
-        preimage = (nVersion + hashPrevouts + hashSequence + outpoint +
-                    scriptCode + amount + nSequence + hashOutputs + nLocktime + nHashType)
-        return preimage
+        return b''.join((
+            pack_le_int32(self.version),
+            hashPrevouts,
+            hashSequence,
+            txin.outpoint_bytes(),
+            pack_varbytes(bfh(self.get_preimage_script(txin))),
+            pack_le_int64(txin.value),
+            pack_le_uint32(txin.sequence),
+            hashOutputs,
+            pack_le_uint32(self.locktime),
+            pack_le_uint32(self.nHashType()),
+        ))
 
     def serialize(self, estimate_size=False):
-        nVersion = int_to_hex(self.version, 4)
-        nLocktime = int_to_hex(self.locktime, 4)
+        return self.serialize_bytes(estimate_size).hex()
+
+    def serialize_bytes(self, estimate_size=False):
         inputs = self.inputs()
         outputs = self.outputs()
-        txins = var_int(len(inputs)) + ''.join(
-            self.serialize_input(txin, self.input_script(txin, estimate_size), estimate_size)
-            for txin in inputs
-        )
-        txouts = var_int(len(outputs)) + ''.join(self.serialize_output(o) for o in outputs)
-        return nVersion + txins + txouts + nLocktime
+        out = bytearray(pack_le_int32(self.version))
+        out += pack_varint(len(inputs))
+        for txin in inputs:
+            script = bfh(self.input_script(txin, estimate_size))
+            out += self.serialize_input_bytes(txin, script, estimate_size)
+        out += pack_varint(len(outputs))
+        for output in outputs:
+            out += self.serialize_output_bytes(output)
+        out += pack_le_uint32(self.locktime)
+        return bytes(out)
 
     def hash(self):
         logger.warning("deprecated tx.hash()")
@@ -691,17 +1124,24 @@ class Transaction:
     def txid(self):
         if not self.is_complete():
             return None
-        ser = self.serialize()
-        return bh2u(sha256d(bfh(ser))[::-1])
+        return hash_to_hex_str(sha256d(self.to_bytes()))
 
     def add_inputs(self, inputs):
+        inputs = [to_txin(txin) for txin in inputs]
         self._inputs.extend(inputs)
+        self._sighash_hashes = None
+        if self._size_model is not None:
+            self._size_model[0] += sum(self.estimated_input_size(txin) for txin in inputs)
         self.raw = None
 
     def add_outputs(self, outputs):
         assert all(isinstance(addr, (PublicKey, Address, ScriptOutput))
                    for addr, value in outputs)
+        outputs = [XTxOutput(*output) for output in outputs]
         self._outputs.extend(outputs)
+        self._sighash_hashes = None
+        if self._size_model is not None:
+            self._size_model[1] += sum(self.estimated_output_size(output) for output in outputs)
         self.raw = None
 
     def input_value(self):
@@ -713,17 +1153,42 @@ class Transaction:
     def get_fee(self):
         return self.input_value() - self.output_value()
 
-    @profiler
     def estimated_size(self):
-        '''Return an estimated tx size in bytes.'''
-        return (len(self.serialize(True)) // 2 if not self.is_complete() or self.raw is None
-                else len(self.raw) // 2)  # ASCII hex string
+        '''Return an estimated tx size in bytes.  Unless the transaction is complete this
+        does not serialize it; input and output sizes are tracked as they are added.'''
+        if self._raw is not None and self.is_complete():
+            return len(self._raw)
+        inputs = self.inputs()
+        outputs = self.outputs()
+        if self._size_model is None:
+            self._size_model = [
+                sum(self.estimated_input_size(txin) for txin in inputs),
+                sum(self.estimated_output_size(output) for output in outputs),
+            ]
+        inputs_size, outputs_size = self._size_model
+        return (_TX_FIXED_SIZE + _varint_size(len(inputs)) + inputs_size +
+                _varint_size(len(outputs)) + outputs_size)
+
+    def invalidate_size_model(self):
+        '''Call after changing the type, public keys or signature requirements of an input
+        in place.'''
+        self._size_model = None
 
     @classmethod
     def estimated_input_size(self, txin):
         '''Return an estimated of serialized input size in bytes.'''
-        script = self.input_script(txin, True)
-        return len(self.serialize_input(txin, script, True)) // 2  # ASCII hex string
+        script_size_func = _ESTIMATED_SCRIPT_SIZES.get(txin['type'])
+        if script_size_func is None:
+            script = bfh(self.input_script(txin, True))
+            return len(self.serialize_input_bytes(txin, script, True))
+        script_size = script_size_func(txin, self.estimate_pubkey_size_for_txin(txin))
+        return _INPUT_FIXED_SIZE + _varint_size(script_size) + script_size
+
+    @classmethod
+    def estimated_output_size(self, output):
+        '''Return the serialized size of an (address, amount) output in bytes.'''
+        script_size = len(self.pay_script_bytes(output[0]))
+        return 8 + _varint_size(script_size) + script_size
 
     def signature_count(self):
         r = 0
@@ -740,28 +1205,62 @@ class Transaction:
         s, r = self.signature_count()
         return r == s
 
-    def sign(self, keypairs):
+    def sign(self, keypairs, executor=None):
+        '''Sign the inputs that keypairs, a map of x_pubkey to (private key bytes, compressed)
+        pairs, has keys for.
+
+        If an executor, such as app_state.signing_executor(), is given and there are at least
+        PARALLEL_SIGNING_MIN_INPUTS signatures to make, the signatures are made in its worker
+        processes.  The sighash digests are computed here first so workers only do the ECDSA.
+        '''
+        # (input index, signature index, private key bytes, compressed) in input order
+        jobs = []
         for i, txin in enumerate(self.inputs()):
             num = txin['num_sig']
             pubkeys, x_pubkeys = self.get_sorted_pubkeys(txin)
+            signed_count = len([sig for sig in txin['signatures'] if sig])
             for j, x_pubkey in enumerate(x_pubkeys):
-                signatures = [sig for sig in txin['signatures'] if sig]
-                if len(signatures) == num:
+                if signed_count == num:
                     # txin is complete
                     break
-                if x_pubkey in keypairs.keys():
-                    logger.debug("adding signature for %s", x_pubkey)
-                    sec, compressed = keypairs.get(x_pubkey)
-                    sig = self.sign_txin(i, sec)
-                    txin['signatures'][j] = sig
-                    pubkey = PrivateKey(sec).public_key.to_hex(compressed=compressed)
-                    txin['pubkeys'][j] = pubkey # needed for fd keys
-                    self._inputs[i] = txin
+                if x_pubkey in keypairs:
+                    sec, compressed = keypairs[x_pubkey]
+                    jobs.append((i, j, sec, compressed))
+                    if not txin['signatures'][j]:
+                        signed_count += 1
+
+        # A multisig input signed with several keys has one digest
+        digests = {}
+        for i, _j, _sec, _c in jobs:
+            if i not in digests:
+                digests[i] = sha256d(self.serialize_preimage_bytes(i))
+        items = [(sec, digests[i]) for i, _j, sec, _c in jobs]
+        if executor is not None and len(items) >= PARALLEL_SIGNING_MIN_INPUTS:
+            logger.debug("making %d signatures in worker processes", len(items))
+            chunk_size = PARALLEL_SIGNING_CHUNK_SIZE
+            chunks = [items[n: n + chunk_size] for n in range(0, len(items), chunk_size)]
+            signatures = [sig for sigs in executor.map(_sign_digests, chunks) for sig in sigs]
+        else:
+            logger.debug("making %d signatures", len(items))
+            signatures = _sign_digests(items)
+
+        sighash_hex = int_to_hex(self.nHashType() & 255, 1)
+        # Inputs for the same address share a key; compute each public key once
+        pubkeys = {}
+        for (i, j, sec, compressed), sig in zip(jobs, signatures):
+            txin = self._inputs[i]
+            txin['signatures'][j] = sig.hex() + sighash_hex
+            # needed for fd keys
+            pubkey = pubkeys.get((sec, compressed))
+            if pubkey is None:
+                pubkey = PrivateKey(sec).public_key.to_hex(compressed=compressed)
+                pubkeys[(sec, compressed)] = pubkey
+            txin['pubkeys'][j] = pubkey
         logger.debug("is_complete %s", self.is_complete())
-        self.raw = self.serialize()
+        self._raw = self.serialize_bytes()
 
     def sign_txin(self, txin_index, privkey_bytes):
-        pre_hash = sha256d(bfh(self.serialize_preimage(txin_index)))
+        pre_hash = sha256d(self.serialize_preimage_bytes(txin_index))
         privkey = PrivateKey(privkey_bytes)
         sig = privkey.sign(pre_hash, None)
         sig = bh2u(sig) + int_to_hex(self.nHashType() & 255, 1)
@@ -788,11 +1287,9 @@ class Transaction:
 
 
     def as_dict(self):
-        if self.raw is None:
-            self.raw = self.serialize()
         self.deserialize()
         out = {
-            'hex': self.raw,
+            'hex': str(self),
             'complete': self.is_complete(),
             'final': self.is_final(),
         }
@@ -37,29 +37,32 @@ import os
 import random
 import threading
 import time
-from typing import Optional, Union, Tuple, List, Any
+from typing import Optional, Union, Tuple, List, Any, Dict
 
 from aiorpcx import run_in_thread
-from bitcoinx import PrivateKey, PublicKey, is_minikey, P2MultiSig_Output
+from bitcoinx import (
+    PrivateKey, PublicKey, is_minikey, P2MultiSig_Output, hash_to_hex_str, hex_str_to_hash
+)
 
 from . import coinchooser
 from . import paymentrequest
-from .address import Address
+from .address import Address, ScriptOutput
 from .app_state import app_state
-from .bitcoin import COINBASE_MATURITY, scripthash_hex
+from .bitcoin import COINBASE_MATURITY, history_status, scripthash_hex
 from .contacts import Contacts
-from .crypto import sha256d
+from .crypto import hash_160, sha256d
 from .exceptions import NotEnoughFunds, ExcessiveFee, UserCancelled, InvalidPassword
 from .i18n import _
 from .keystore import (
-    load_keystore, Hardware_KeyStore, Imported_KeyStore, BIP32_KeyStore, xpubkey_to_address
+    load_keystore, Hardware_KeyStore, Imported_KeyStore, BIP32_KeyStore, Software_KeyStore,
+    xpubkey_to_address
 )
 from .logs import logs
 from .networks import Net
 from .paymentrequest import InvoiceStore
 from .paymentrequest import PR_PAID, PR_UNPAID, PR_UNKNOWN, PR_EXPIRED
 from .storage import multisig_type
-from .transaction import Transaction
+from .transaction import Transaction, XTxInput
 from .wallet_database import WalletData, DBTxInput, DBTxOutput, TxFlags, TxData, TxProof
 from .util import profiler, format_satoshis, bh2u, format_time, timestamp_to_datetime
 from .version import PACKAGE_VERSION
@@ -70,6 +73,10 @@ logger = logs.get_logger("wallet")
 
 TxInfo = namedtuple('TxInfo', 'hash status label can_broadcast amount '
                     'fee height conf timestamp')
+# The public keys of a multisig address sorted as in its redeem script, the index of the
+# keystore of each, the redeem script, and its hash160 (the P2SH script hash)
+MultisigRecord = namedtuple('MultisigRecord', 'pubkeys keystore_order redeem_script '
+                            'script_hash')
 
 
 @attr.s(slots=True, cmp=False, hash=False)
@@ -97,12 +104,8 @@ class UTXO:
         return ':'.join((self.tx_hash, str(self.out_index)))
 
     def to_tx_input(self):
-        return {
-            'address': self.address,
-            'value': self.value,
-            'prevout_n': self.out_index,
-            'prevout_hash': self.tx_hash,
-        }
+        return XTxInput(hex_str_to_hash(self.tx_hash), self.out_index, value=self.value,
+                        address=self.address)
 
 
 def dust_threshold(network):
@@ -201,6 +204,8 @@ class Abstract_Wallet:
         self._synchronize_event = app_state.async_.event()
         self._synchronized_event = app_state.async_.event()
         self.txs_changed_event = app_state.async_.event()
+        # tx_hashes seen in new history that the network should fetch without a full scan
+        self._pending_tx_ids = set()
         self.request_count = 0
         self.response_count = 0
         self.progress_event = app_state.async_.event()
@@ -242,6 +247,18 @@ class Abstract_Wallet:
         '''Returns a set of tx_hashes.'''
         return self.db.tx.get_unsynced_ids()
 
+    def pop_pending_transactions(self):
+        '''Returns the set of tx_hashes queued by set_address_history() that have not since
+        been added, and clears the queue.'''
+        with self.lock:
+            tx_ids, self._pending_tx_ids = self._pending_tx_ids, set()
+        return set(tx_id for tx_id in tx_ids if self.get_transaction(tx_id) is None)
+
+    def requeue_transactions(self, tx_ids):
+        '''Queue tx_hashes whose fetch failed so they are retried on the next change.'''
+        with self.lock:
+            self._pending_tx_ids.update(tx_ids)
+
     def unverified_transactions(self):
         '''Returns a map of tx_hash to tx_height.'''
         results = self.db.tx.get_unverified_entries(self.get_local_height())
@@ -311,6 +328,8 @@ class Abstract_Wallet:
         # address -> list(txid, height)
         addr_history = self.db.misc.get_value('addr_history')
         self._history = self.to_Address_dict(addr_history) if addr_history is not None else {}
+        # address -> status hash of its history; computed on demand from self._history
+        self._address_statuses = {}
 
         pruned_txo = self.db.misc.get_value('pruned_txo')
         if pruned_txo is None:
@@ -333,6 +352,9 @@ class Abstract_Wallet:
         self.logger.debug("frozen_coins %r", frozen_coins)
         self._frozen_coins = (set(tuple(v) for v in frozen_coins)
             if frozen_coins is not None else set([]))
+        # Coins spent by consolidations this session, kept from payments but not persisted
+        self._reserved_coins = set()
+        self._reservations = {}
 
         # What is persisted here differs depending on the wallet type.
         self.load_addresses(self.db.misc.get_value('addresses'))
@@ -387,8 +409,8 @@ class Abstract_Wallet:
 
     def save_addresses(self) -> dict:
         return {
-            'receiving': [addr.to_string() for addr in self.receiving_addresses],
-            'change': [addr.to_string() for addr in self.change_addresses],
+            'receiving': Address.to_strings(self.receiving_addresses),
+            'change': Address.to_strings(self.change_addresses),
         }
 
     def load_addresses(self, data: dict) -> None:
@@ -648,6 +670,7 @@ class Abstract_Wallet:
             # cleanup/detect if the 'frozen coin' was spent and
             # remove it from the frozen coin set
             self._frozen_coins.discard(input_key)
+            self._reserved_coins.discard(input_key)
 
         address_script = address.to_script()
         return [UTXO(value=value,
@@ -706,7 +729,8 @@ class Abstract_Wallet:
 
         mempool_height = self.get_local_height() + 1
         def is_spendable_utxo(utxo):
-            if exclude_frozen and self.is_frozen_utxo(utxo):
+            if exclude_frozen and (self.is_frozen_utxo(utxo)
+                                   or utxo.key() in self._reserved_coins):
                 return False
             if confirmed_only and utxo.height <= 0:
                 return False
@@ -754,6 +778,16 @@ class Abstract_Wallet:
         assert isinstance(address, Address)
         return self._history.get(address, [])
 
+    def get_address_status(self, address: Address) -> Optional[str]:
+        '''The server status hash of the address's history, or None if it has no history.  This
+        is what the network compares subscription results against, so it is cached.'''
+        try:
+            return self._address_statuses[address]
+        except KeyError:
+            status = history_status(self.get_address_history(address))
+            self._address_statuses[address] = status
+            return status
+
     def add_pending_transaction(self, tx_hash: str, tx: Transaction) -> None:
         with self.transaction_lock:
             # freeze the inputs.
@@ -763,25 +797,25 @@ class Abstract_Wallet:
         with self.transaction_lock:
             self._update_transaction_xputs(tx_hash, tx)
             self.logger.debug("adding tx data %s", tx_hash)
-            self.db.tx.add_transaction(tx, TxFlags.StateSettled)
+            self.db.tx.add_transaction(tx, TxFlags.StateSettled, tx_hash)
 
     def apply_transactions_xputs(self, tx_hash: str, tx: Transaction) -> None:
         with self.transaction_lock:
             self._update_transaction_xputs(tx_hash, tx)
 
     def _update_transaction_xputs(self, tx_hash: str, tx: Transaction) -> None:
-        is_coinbase = tx.inputs()[0]['type'] == 'coinbase'
+        inputs = tx.inputs()
+        is_coinbase = inputs[0].type == 'coinbase'
         # We batch the adding of inputs and outputs as it is a thousand times faster.
         txins = []
         txouts = []
 
         # add inputs
-        for tx_input in tx.inputs():
-            address = tx_input.get('address')
-            if tx_input['type'] != 'coinbase':
-                prevout_hash = tx_input['prevout_hash']
-                prevout_n = tx_input['prevout_n']
-            if self.is_mine(address):
+        for tx_input in inputs:
+            address = tx_input.address
+            if tx_input.type != 'coinbase' and self.is_mine(address):
+                prevout_hash = hash_to_hex_str(tx_input.prev_hash)
+                prevout_n = tx_input.prev_idx
                 # find value from prev output
                 match = next((row for row in self.get_txouts(prevout_hash, address)
                     if row.out_tx_n == prevout_n), None)
@@ -838,6 +872,7 @@ class Abstract_Wallet:
     async def set_address_history(self, addr, hist, tx_fees):
         with self.lock:
             self._history[addr] = hist # { address: (tx_hash, tx_height) }
+            self._address_statuses.pop(addr, None)
 
             tx_ids = set(t[0] for t in hist)
             updates = []
@@ -853,13 +888,25 @@ class Abstract_Wallet:
             for tx_id in tx_ids:
                 # if addr is new, we have to recompute txi and txo
                 tx = self.get_transaction(tx_id)
-                if (tx is not None and not len(self.get_txins(tx_id, addr)) and
+                if tx is None:
+                    self._pending_tx_ids.add(tx_id)
+                elif (not len(self.get_txins(tx_id, addr)) and
                         not len(self.get_txouts(tx_id, addr))):
                     self.apply_transactions_xputs(tx_id, tx)
 
         self.txs_changed_event.set()
         await self._trigger_synchronization()
 
+    def get_received_payments(self, tx_hash: str) -> Dict[Address, int]:
+        '''Returns a map of wallet address to the amount the transaction pays it.  Empty for
+        transactions spending the wallet's own coins, as their outputs to it are change.'''
+        if len(self.get_txins(tx_hash)):
+            return {}
+        payments = defaultdict(int)
+        for txout in self.get_txouts(tx_hash):
+            payments[Address.from_string(txout.address_string)] += txout.amount
+        return dict(payments)
+
     # Called by wallet.py:export_history()
     # Called by history_list.py:on_update()
     def get_history(self, domain=None):
@@ -1016,7 +1063,7 @@ class Abstract_Wallet:
         if i_max is None:
             # Let the coin chooser select the coins to spend
             max_change = self.max_change_outputs if self.multiple_change else 1
-            coin_chooser = coinchooser.CoinChooserPrivacy()
+            coin_chooser = coinchooser.get_coin_chooser(config)
             tx = coin_chooser.make_tx(inputs, outputs, change_addrs[:max_change],
                                       fee_estimator, self.dust_threshold())
         else:
@@ -1052,6 +1099,116 @@ class Abstract_Wallet:
         self.sign_transaction(tx, password)
         return tx
 
+    def make_opreturn_chain(self, coins, push_groups: List[List[bytes]], config,
+                            password: Optional[str], change_addr: Optional[Address]=None):
+        '''Yields signed transactions, one for each group of data pushes, paying an OP_RETURN
+        output of that group.  Each spends an output of the one before so they must be
+        broadcast in order.
+
+        The first transaction spends coins chosen from `coins` and funds a chain output to
+        `change_addr` (by default the first change address) with the fees of the rest.  Every
+        later transaction has the one input of the same type from that address, so their sizes
+        and fees are known up front, and the signing keys are derived only once.  The last
+        transaction returns a dust-threshold output to the address.
+        '''
+        if not push_groups:
+            return
+        if change_addr is None:
+            change_addr = (self.get_change_addresses() or self.get_receiving_addresses())[0]
+        data_outputs = [ScriptOutput.as_op_return(pushdatas) for pushdatas in push_groups]
+        locktime = max(self.get_local_height(), 0)
+
+        # A template of the input of every chained transaction
+        template = XTxInput(bytes(32), 0, value=0, address=change_addr)
+        self._add_input_info(template)
+        fees = [config.estimate_fee(Transaction.from_io(
+                    [template], [(data_output, 0), (change_addr, 0)]).estimated_size())
+                for data_output in data_outputs[1:]]
+        chain_value = sum(fees) + self.dust_threshold()
+
+        outputs = [(data_outputs[0], 0)]
+        if fees:
+            outputs.append((change_addr, chain_value))
+        tx = self.make_unsigned_transaction(coins, outputs, config, change_addr=change_addr)
+        self.sign_transaction(tx, password)
+        yield tx
+        if not fees:
+            return
+
+        keypairs = {}
+        if not any(isinstance(k, Hardware_KeyStore) for k in self.get_keystores()):
+            for k in self.get_keystores():
+                if not k.is_watching_only():
+                    keypairs.update(k.get_private_keys(k.get_tx_derivations(
+                        Transaction.from_io([template], [])), password))
+        try:
+            for data_output, fee in zip(data_outputs[1:], fees):
+                prev_idx = tx.outputs().index((change_addr, chain_value))
+                txin = template.copy()
+                txin.prev_hash = sha256d(tx.to_bytes())
+                txin.prev_idx = prev_idx
+                txin.value = chain_value
+                # Signing fills these in place
+                txin.signatures = list(template.signatures)
+                if template.pubkeys is not None:
+                    txin.pubkeys = list(template.pubkeys)
+                chain_value -= fee
+                tx = Transaction.from_io([txin], [(data_output, 0), (change_addr, chain_value)],
+                                         locktime)
+                if keypairs:
+                    tx.sign(keypairs)
+                else:
+                    self.sign_transaction(tx, password)
+                yield tx
+        finally:
+            keypairs.clear()
+
+    def make_consolidation_transaction(self, coins, config) -> Optional[Tuple[Transaction,
+                                                                              List[UTXO]]]:
+        '''Returns an unsigned transaction merging small coins from `coins` into one output,
+        and the UTXOs it spends, or None if there are too few small coins or the fee rate is
+        above the consolidation maximum.  The thresholds are the consolidation settings of
+        config.
+
+        Callers broadcasting the transaction should reserve its UTXOs with reserve_coins()
+        so that payments do not spend them in the meantime.
+        '''
+        if config.fee_per_kb() > config.get_consolidation_max_fee_per_kb():
+            return None
+        max_value = config.get_consolidation_max_value()
+        coins = [coin for coin in coins if coin.height > 0]
+        if sum(coin.value < max_value for coin in coins) < config.get_consolidation_min_coins():
+            return None
+
+        # The coins are sized for choosing from the input information of one coin of each
+        # address, as the inputs of an address are the same size.  Only the chosen coins are
+        # given their own, by make_unsigned_transaction()
+        inputs = [coin.to_tx_input() for coin in coins]
+        templates = {}
+        for txin in inputs:
+            template = templates.get(txin.address)
+            if template is None:
+                self._add_input_info(txin)
+                templates[txin.address] = txin
+            else:
+                for attr in ('type', 'num_sig', 'x_pubkeys', 'pubkeys', 'signatures',
+                             'redeem_script'):
+                    setattr(txin, attr, getattr(template, attr))
+        coins_by_outpoint = {txin.outpoint_bytes(): coin for txin, coin in zip(inputs, coins)}
+        inputs = coinchooser.CoinConsolidator().choose_coins(
+            inputs, max_value, config.get_consolidation_max_inputs(), config.estimate_fee)
+        if len(inputs) < 2:
+            return None
+        coins = [coins_by_outpoint[txin.outpoint_bytes()] for txin in inputs]
+
+        addrs = [addr for addr in self.get_change_addresses()[-self.gap_limit_for_change:]
+                 if self.get_num_tx(addr) == 0]
+        address = addrs[0] if addrs else coins[0].address
+        tx = self.make_unsigned_transaction(coins, [(address, '!')], config)
+        if tx.output_value() < self.dust_threshold():
+            return None
+        return tx, coins
+
     def is_frozen_address(self, addr):
         '''Address-level frozen query. Note: this is set/unset independent of
         'coin' level freezing.'''
@@ -1081,10 +1238,36 @@ class Abstract_Wallet:
         else:
             self._frozen_coins.difference_update(utxo.key() for utxo in utxos)
 
+    def reserve_coins(self, tx_id, utxos) -> None:
+        '''Keep the UTXOs spent by the broadcast transaction tx_id out of the spendable coins
+        until release_coins() is called for it.  Unlike frozen coins, reservations are not
+        shown to the user or saved.
+        '''
+        self._reservations[tx_id] = list(utxos)
+        self._reserved_coins.update(utxo.key() for utxo in utxos)
+
+    def release_coins(self, tx_id) -> None:
+        self._reserved_coins.difference_update(
+            utxo.key() for utxo in self._reservations.pop(tx_id, ()))
+
+    def release_settled_coins(self) -> None:
+        '''Release the coins reserved for transactions that are now confirmed, or that are not
+        in the wallet's history, having been dropped or never accepted.  Call this some time
+        after broadcasting so that the wallet has had a chance to see the transaction.
+        '''
+        for tx_id, utxos in list(self._reservations.items()):
+            # The transaction is in the history of the addresses whose coins it spends
+            heights = {tx_hash: height for tx_hash, height
+                       in self.get_address_history(utxos[0].address)}
+            height = heights.get(tx_id)
+            if height is None or height > 0:
+                self.release_coins(tx_id)
+
     def _analyze_history(self):
         bad_addrs = [addr for addr in self._history if not self.is_mine(addr)]
         for addr in bad_addrs:
             self._history.pop(addr)
+            self._address_statuses.pop(addr, None)
 
         for hist in self._history.values():
             for tx_hash, tx_height in hist:
@@ -1203,17 +1386,44 @@ class Abstract_Wallet:
         for addr, amount in tx.outputs():
             if self.is_mine(addr):
                 index = self.get_address_index(addr)
-                pubkeys = self.get_public_keys(addr)
-                # sort xpubs using the order of pubkeys
-                sorted_pubkeys, sorted_xpubs = zip(*sorted(zip(pubkeys, xpubs)))
-                info[addr] = (index, sorted_xpubs, self.m if isinstance(self, Multisig_Wallet)
-                              else None)
+                if isinstance(self, Multisig_Wallet):
+                    record = self.get_multisig_record(addr)
+                    sorted_xpubs = tuple(xpubs[k] for k in record.keystore_order)
+                    info[addr] = (index, sorted_xpubs, self.m)
+                else:
+                    pubkeys = self.get_public_keys(addr)
+                    # sort xpubs using the order of pubkeys
+                    sorted_pubkeys, sorted_xpubs = zip(*sorted(zip(pubkeys, xpubs)))
+                    info[addr] = (index, sorted_xpubs, None)
         logger.debug(f'add_hw_info: {info}')
         tx.output_info = info
 
+    def unlock(self, password: Optional[str], timeout: Optional[int]=None) -> None:
+        '''Start a signing session of `timeout` seconds, by default the configured session
+        timeout, with each software keystore.  Until it ends, transactions and messages are
+        signed without a password.  Raises InvalidPassword.'''
+        for keystore in self._signing_keystores():
+            keystore.unlock(password, timeout)
+
+    def lock(self) -> None:
+        '''End any signing session.'''
+        for keystore in self._signing_keystores():
+            keystore.lock()
+
+    def is_unlocked(self) -> bool:
+        keystores = self._signing_keystores()
+        return bool(keystores) and all(keystore.is_unlocked() for keystore in keystores)
+
+    def _signing_keystores(self):
+        return [keystore for keystore in self.get_keystores()
+                if isinstance(keystore, Software_KeyStore) and not keystore.is_watching_only()]
+
     def sign_transaction(self, tx: Transaction, password: str) -> None:
+        '''Sign with every keystore that can.  Software keystores sign large transactions in
+        the worker processes of the shared signing executor, if the config asks for them.'''
         if self.is_watching_only():
             return
+        executor = app_state.signing_executor()
         # add input values for signing
         self.add_input_values_to_tx(tx)
         # hardware wallets require extra info
@@ -1223,7 +1433,11 @@ class Abstract_Wallet:
         # sign
         for k in self.get_keystores():
             try:
-                if k.can_sign(tx):
+                if not k.can_sign(tx):
+                    continue
+                if isinstance(k, Software_KeyStore):
+                    k.sign_transaction(tx, password, executor)
+                else:
                     k.sign_transaction(tx, password)
             except UserCancelled:
                 continue
@@ -1540,6 +1754,7 @@ class ImportedWalletBase(Simple_Wallet):
                         transactions_new.add(tx_hash)
             transactions_to_remove -= transactions_new
             self._history.pop(address, None)
+            self._address_statuses.pop(address, None)
 
             for tx_hash in transactions_to_remove:
                 self._remove_transaction(tx_hash)
@@ -1566,8 +1781,7 @@ class ImportedAddressWallet(ImportedWalletBase):
     @classmethod
     def from_text(cls, storage, text):
         wallet = cls(storage)
-        for address in text.split():
-            wallet.import_address(Address.from_string(address))
+        wallet.import_addresses(Address.from_strings(text.split()))
         # Avoid adding addresses twice in network.py
         wallet._new_addresses.clear()
         return wallet
@@ -1591,10 +1805,10 @@ class ImportedAddressWallet(ImportedWalletBase):
         assert type(data) is list or data is None, str(data)
         if data is None:
             data = []
-        self.addresses = [Address.from_string(addr) for addr in data]
+        self.addresses = Address.from_strings(data)
 
     def save_addresses(self) -> list:
-        return [addr.to_string() for addr in self.addresses]
+        return Address.to_strings(self.addresses)
 
     def can_change_password(self):
         return False
@@ -1608,13 +1822,22 @@ class ImportedAddressWallet(ImportedWalletBase):
         return self._sorted
 
     def import_address(self, address):
-        assert isinstance(address, Address)
-        if address in self.addresses:
-            return False
-        self.addresses.append(address)
-        self._add_new_addresses([address])
-        self._sorted = None
-        return True
+        return bool(self.import_addresses([address]))
+
+    def import_addresses(self, addresses):
+        '''Import addresses not already in the wallet.  Returns those imported.'''
+        assert all(isinstance(address, Address) for address in addresses)
+        existing = set(self.addresses)
+        added = []
+        for address in addresses:
+            if address not in existing:
+                existing.add(address)
+                added.append(address)
+        if added:
+            self.addresses.extend(added)
+            self._add_new_addresses(added)
+            self._sorted = None
+        return added
 
     def delete_address_derived(self, address):
         self.addresses.remove(address)
@@ -1784,8 +2007,7 @@ class Deterministic_Wallet(Abstract_Wallet):
         self.logger.info(f'creating {count} new addresses')
 
         def derive_addresses(index_range):
-            return [self.pubkeys_to_address(self.derive_pubkeys(for_change, index))
-                    for index in index_range]
+            return [self.derive_address(for_change, index) for index in index_range]
         with self.lock:
             chain = self.change_addresses if for_change else self.receiving_addresses
             first = len(chain)
@@ -1794,6 +2016,9 @@ class Deterministic_Wallet(Abstract_Wallet):
         self._add_new_addresses(addresses)
         return addresses
 
+    def derive_address(self, for_change, n):
+        return self.pubkeys_to_address(self.derive_pubkeys(for_change, n))
+
     def _is_fresh_address(self, address):
         heights = [height for _, height in self.get_address_history(address) if height > 0]
         conf_count = self.get_local_height() - max(heights) + 1 if heights else 0
@@ -1883,10 +2108,17 @@ class Standard_Wallet(Simple_Deterministic_Wallet):
     def pubkeys_to_address(self, pubkey):
         return Address.from_pubkey(pubkey)
 
+    def derive_address(self, for_change, n):
+        # Skip serializing the public key to hex and parsing it again
+        return Address.from_pubkey(self.keystore.derive_public_key(for_change, n))
+
 
 class Multisig_Wallet(Deterministic_Wallet):
     # generic m of n
     gap_limit = 20
+    # Saved multisig records of each address chain checked against keys derived from the
+    # keystores when loading, spread along the chain from the first to the last
+    multisig_records_checked = 8
 
     def __init__(self, storage):
         self.wallet_type = storage.get('wallet_type')
@@ -1896,6 +2128,14 @@ class Multisig_Wallet(Deterministic_Wallet):
     def get_pubkeys(self, c, i):
         return self.derive_pubkeys(c, i)
 
+    def get_public_keys(self, address):
+        # In keystore order
+        record = self.get_multisig_record(address)
+        pubkeys = [None] * len(record.pubkeys)
+        for pubkey, k in zip(record.pubkeys, record.keystore_order):
+            pubkeys[k] = pubkey
+        return pubkeys
+
     def pubkeys_to_address(self, pubkeys):
         redeem_script = self.pubkeys_to_redeem_script(pubkeys)
         return Address.from_multisig_script(redeem_script)
@@ -1907,6 +2147,77 @@ class Multisig_Wallet(Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return [k.derive_pubkey(c, i) for k in self.get_keystores()]
 
+    def _make_multisig_record(self, pubkeys):
+        keystore_order = sorted(range(len(pubkeys)), key=pubkeys.__getitem__)
+        return self._sorted_multisig_record([pubkeys[k] for k in keystore_order],
+                                            keystore_order)
+
+    def _sorted_multisig_record(self, sorted_pubkeys, keystore_order):
+        redeem_script = P2MultiSig_Output(list(sorted_pubkeys), self.m).to_script_bytes()
+        return MultisigRecord(tuple(sorted_pubkeys), tuple(keystore_order), redeem_script,
+                              hash_160(redeem_script))
+
+    def derive_address(self, for_change, n):
+        record = self._make_multisig_record(self.derive_pubkeys(for_change, n))
+        address = Address.from_P2SH_hash(record.script_hash)
+        self._multisig_records[address] = record
+        return address
+
+    def get_multisig_record(self, address):
+        '''Returns the MultisigRecord of one of the wallet's addresses.  Records are made as
+        addresses are created and saved with them, so the keys are derived only once.'''
+        record = self._multisig_records.get(address)
+        if record is None:
+            record = self._make_multisig_record(self.get_pubkeys(*self.get_address_index(address)))
+            self._multisig_records[address] = record
+        return record
+
+    def save_addresses(self) -> dict:
+        data = super().save_addresses()
+        data['multisig'] = {
+            name: [(list(record.pubkeys), list(record.keystore_order))
+                   for record in map(self.get_multisig_record, addresses)]
+            for name, addresses in (('receiving', self.receiving_addresses),
+                                    ('change', self.change_addresses))
+        }
+        return data
+
+    def load_addresses(self, data: dict) -> None:
+        self._multisig_records = {}
+        multisig = (data or {}).get('multisig')
+        if multisig is None:
+            super().load_addresses(data)
+            return
+        # Build the addresses from redeem scripts made from the saved keys, which is quicker
+        # than deriving the keys or decoding the address strings
+        chains = []
+        for name, for_change in (('receiving', False), ('change', True)):
+            entries = multisig[name]
+            if not all(self._is_multisig_entry(*entry) for entry in entries):
+                self.logger.warning(f'saved {name} multisig keys are malformed')
+                super().load_addresses(data)
+                return
+            records = [self._sorted_multisig_record(pubkeys, keystore_order)
+                       for pubkeys, keystore_order in entries]
+            # Check a sample of the saved keys are those of the keystores
+            last = len(records) - 1
+            count = min(len(records), self.multisig_records_checked)
+            indexes = sorted({last * k // max(count - 1, 1) for k in range(count)})
+            if any(records[i] != self._make_multisig_record(self.derive_pubkeys(for_change, i))
+                   for i in indexes):
+                self.logger.warning(f'saved {name} multisig keys do not match the keystores')
+                super().load_addresses(data)
+                return
+            chains.append((name, records))
+        for name, records in chains:
+            addresses = [Address.from_P2SH_hash(record.script_hash) for record in records]
+            self._multisig_records.update(zip(addresses, records))
+            setattr(self, f'{name}_addresses', addresses)
+
+    def _is_multisig_entry(self, pubkeys, keystore_order):
+        return (len(pubkeys) == self.n and list(pubkeys) == sorted(pubkeys)
+                and sorted(keystore_order) == list(range(self.n)))
+
     def load_keystore(self):
         self.keystores = {}
         for i in range(self.n):
@@ -1954,11 +2265,13 @@ class Multisig_Wallet(Deterministic_Wallet):
         return ''.join(sorted(self.get_master_public_keys()))
 
     def _add_input_sig_info(self, txin, address):
-        # x_pubkeys are not sorted here because it would be too slow
-        # they are sorted in transaction.get_sorted_pubkeys
+        # Sorted as transaction.get_sorted_pubkeys() would, using the address's record
         derivation = self.get_address_index(address)
-        txin['x_pubkeys'] = [k.get_xpubkey(*derivation) for k in self.get_keystores()]
-        txin['pubkeys'] = None
+        record = self.get_multisig_record(address)
+        keystores = self.get_keystores()
+        txin['x_pubkeys'] = [keystores[k].get_xpubkey(*derivation)
+                             for k in record.keystore_order]
+        txin['pubkeys'] = list(record.pubkeys)
         # we need n place holders
         txin['signatures'] = [None] * self.n
         txin['num_sig'] = self.m
@@ -1046,7 +1046,7 @@ class TxCacheEntry:
         if self._transaction is None:
             if self.bytedata is None:
                 return None
-            self._transaction = Transaction(self.bytedata.hex())
+            self._transaction = Transaction(self.bytedata)
         return self._transaction
 
     def __repr__(self):
@@ -1100,10 +1100,12 @@ class TxCache:
         # TODO: Consider setting state based on height.
         self.add([ (tx_id, TxData(height=height, fee=fee), None, TxFlags.Unset) ])
 
-    def add_transaction(self, tx: Transaction, flags: Optional[int]=TxFlags.Unset) -> None:
-        tx_id = tx.txid()
-        tx_hex = str(tx)
-        bytedata = bytes.fromhex(tx_hex)
+    def add_transaction(self, tx: Transaction, flags: Optional[int]=TxFlags.Unset,
+            tx_id: Optional[str]=None) -> None:
+        # Callers that have already checked the hash pass it to avoid rehashing the tx.
+        if tx_id is None:
+            tx_id = tx.txid()
+        bytedata = tx.to_bytes()
         self.update_or_add([ (tx_id, TxData(), bytedata, flags | TxFlags.HasByteData) ])
 
     def add(self, inserts: List[Tuple[str, TxData, Optional[bytes], int]]) -> None:
@@ -4,6 +4,12 @@ from bitcoinx import is_minikey
 
 from . import bitcoin
 from . import keystore
+from .networks import Net
+
+
+# BIP44 coin types seeds restored into ElectrumSV are commonly used with: BTC, whose
+# derivations BSV wallets mostly share, BCH and BSV
+DISCOVERY_COIN_TYPES = (0, 145, 236)
 
 
 class SeedWordTypes(enum.IntEnum):
@@ -40,3 +46,39 @@ def find_matching_text_import_types(text):
     if is_minikey(text):
         matches.add(TextImportTypes.PRIVATE_KEY_MINIKEY)
     return matches
+
+
+def discover_accounts(bip32_seed, get_histories, coin_types=None, account_gap=2,
+                      address_count=5, executor=None):
+    '''Find the BIP44 accounts of a seed that have been used.  For each coin type, account
+    indexes are scanned until `account_gap` consecutive accounts are unused.  An account is
+    used if any of the first `address_count` addresses of its receiving chain has history.
+
+    get_histories takes a list of script hashes and returns their histories, as
+    Network.get_histories() does.  Each round of the scan derives all its accounts in one
+    call, fanned out over the executor if one is given, and requests the histories of all
+    their addresses in one call.
+
+    Returns the AccountCandidate of each used account.
+    '''
+    if coin_types is None:
+        coin_types = tuple(dict.fromkeys((Net.BIP44_COIN_TYPE, ) + DISCOVERY_COIN_TYPES))
+    scanned_to = {coin_type: 0 for coin_type in coin_types}
+    scan_to = {coin_type: account_gap for coin_type in coin_types}
+    used = []
+    while True:
+        accounts = [(coin_type, account) for coin_type in coin_types
+                    for account in range(scanned_to[coin_type], scan_to[coin_type])]
+        if not accounts:
+            break
+        scanned_to.update(scan_to)
+        candidates = keystore.derive_account_candidates(
+            bip32_seed, [keystore.bip44_derivation_cointype(coin_type, account)
+                         for coin_type, account in accounts], address_count, executor)
+        histories = get_histories([address.to_scripthash_hex() for candidate in candidates
+                                   for address in candidate.addresses])
+        for n, ((coin_type, account), candidate) in enumerate(zip(accounts, candidates)):
+            if any(histories[n * address_count: (n + 1) * address_count]):
+                used.append((coin_types.index(coin_type), account, candidate))
+                scan_to[coin_type] = max(scan_to[coin_type], account + 1 + account_gap)
+    return [candidate for _index, _account, candidate in sorted(used)]
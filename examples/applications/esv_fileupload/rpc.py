@@ -122,6 +122,32 @@ class LocalRPCFunctions:
             "fee": tx.get_fee(),
         }
 
+    def make_signed_opreturn_transactions(self, wallet_name: Optional[str]=None,
+            password: Optional[str]=None,
+            push_groups_b64: Optional[List[List[str]]]=None) -> List[dict]:
+        """
+        Sign a chain of OP_RETURN transactions, one for each group of pushdatas, in one call.
+        Each transaction spends an output of the one before, so they must be broadcast in the
+        order given.
+        """
+        wallet = self._get_wallet(wallet_name)
+
+        push_groups = []
+        for pushdatas_b64 in push_groups_b64:
+            push_groups.append([ base64.b64decode(pushdata_b64)
+                for pushdata_b64 in pushdatas_b64 ])
+
+        confirmed_coins = wallet.get_spendable_coins(None, {'confirmed_only': True})
+        results = []
+        for tx in wallet.make_opreturn_chain(confirmed_coins, push_groups, app_state.config,
+                password):
+            results.append({
+                "tx_id": tx.txid(),
+                "tx_hex": str(tx),
+                "fee": tx.get_fee(),
+            })
+        return results
+
     def broadcast_transaction(self, tx_hex: Optional[str]=None, wallet_name: Optional[str]=None,
                               wallet_memo: Optional[str]=None) -> str:
         wallet = None
@@ -140,6 +166,24 @@ class LocalRPCFunctions:
             wallet.set_label(tx_id, wallet_memo)
         return tx_id
 
+    def broadcast_transactions(self, tx_hexes: Optional[List[str]]=None) -> List[dict]:
+        """
+        Broadcast a chain of transactions, each of which may spend outputs of those before it.
+        The results are in the same order, and a transaction is failed if one it spends fails.
+        """
+        transactions = [ Transaction(tx_hex) for tx_hex in tx_hexes ]
+        results = []
+        for tx_id, status, reason, error in app_state.daemon.network.broadcast_chain_and_wait(
+                transactions):
+            if error is not None and error.find("too-long-mempool-chain") != -1:
+                reason = "too-long-mempool-chain"
+            results.append({
+                "tx_id": tx_id,
+                "status": status.name,
+                "reason": reason,
+            })
+        return results
+
     def get_transaction_state(self, tx_id: Optional[str]=None,
             wallet_name: Optional[str]=None) -> bool:
         wallet = self._get_wallet(wallet_name)
@@ -92,6 +92,18 @@ class WalletClient:
             return result['error']
         return result
 
+    def make_signed_opreturn_transactions(self, push_groups: List[List[bytes]]) -> List[dict]:
+        push_groups_b64 = []
+        for pushdatas in push_groups:
+            push_groups_b64.append([ base64.b64encode(pushdata).decode('utf-8')
+                for pushdata in pushdatas ])
+        params = {
+            'push_groups_b64': push_groups_b64,
+            'wallet_name': self._wallet_name,
+            'password': self._wallet_password,
+        }
+        return self._send_request('make_signed_opreturn_transactions', **params)
+
     def broadcast_transaction(self, tx_hex: str) -> str:
         params = {
             'tx_hex': tx_hex,
@@ -101,6 +113,12 @@ class WalletClient:
             return result['error']
         return result
 
+    def broadcast_transactions(self, tx_hexes: List[str]) -> List[dict]:
+        params = {
+            'tx_hexes': tx_hexes,
+        }
+        return self._send_request('broadcast_transactions', **params)
+
     def get_transaction_state(self, tx_id: str) -> bool:
         params = {
             'tx_id': tx_id,
@@ -222,33 +240,62 @@ class BroadcastSession:
             result['final_tx_ids'] = list(v['tx_id'] for v in final_push_groups)
         return result
 
-    def _process_push_groups(self, push_groups, push_groups_state):
-        for i, push_group in enumerate(push_groups):
+    def _sign_push_groups(self, push_groups, push_groups_state):
+        # Sign all the groups not yet broadcast as one chain of transactions in one request.
+        indexes = [ i for i, state in enumerate(push_groups_state)
+            if 'when_broadcast' not in state ]
+        if not indexes:
+            return
+        self._logger.debug(f"Signing {len(indexes)} transactions")
+        sign_results = self._wallet.make_signed_opreturn_transactions(
+            [ push_groups[i] for i in indexes ])
+        when_signed = datetime.datetime.now().astimezone().isoformat()
+        for i, sign_result in zip(indexes, sign_results):
+            # Record metadata that we created a signed transaction for this group.
             state = push_groups_state[i]
-            if 'tx_id' not in state:
-                self._logger.debug(f"Signing tx {i}")
-                sign_result = self._wallet.make_signed_opreturn_transaction(push_group)
-
-                # Record metadata that we created a signed transaction for this group.
-                state['when_signed'] = datetime.datetime.now().astimezone().isoformat()
-                state['tx_id'] = sign_result['tx_id']
-                state['tx_fee'] = sign_result['fee']
-                state['tx_size'] = len(sign_result['tx_hex']) // 2
-
-                print(f"Broadcasting transaction {i+1}/{len(push_groups)}")
-                try:
-                    tx_id = self._wallet.broadcast_transaction(sign_result['tx_hex'])
-                except BitcoinNoValidUTXOsError:
-                    # Ensure the next attempt will rebuild and rebroadcast the transaction.
-                    del state['tx_id']
-                    # Block until we are ready for that.
-                    self._wait_for_utxo_split()
-                    continue
-                if tx_id != state['tx_id']:
-                    raise SessionError(
-                        f"Inconsistent tx_id, got '{tx_id}' expected '{state['tx_id']}'")
-                state['when_broadcast'] = datetime.datetime.now().astimezone().isoformat()
+            state.clear()
+            state['when_signed'] = when_signed
+            state['tx_id'] = sign_result['tx_id']
+            state['tx_fee'] = sign_result['fee']
+            state['tx_size'] = len(sign_result['tx_hex']) // 2
+            state['tx_hex'] = sign_result['tx_hex']
+
+    def _broadcast_push_groups(self, push_groups, push_groups_state):
+        # Broadcast all the signed transactions in one request, in the order they were signed.
+        while True:
+            indexes = [ i for i, state in enumerate(push_groups_state)
+                if 'when_broadcast' not in state ]
+            if not indexes:
+                return
+            print(f"Broadcasting {len(indexes)}/{len(push_groups)} transactions")
+            results = self._wallet.broadcast_transactions(
+                [ push_groups_state[i]['tx_hex'] for i in indexes ])
+            when_broadcast = datetime.datetime.now().astimezone().isoformat()
+            failed_result = None
+            for i, result in zip(indexes, results):
+                state = push_groups_state[i]
+                if result['status'] == 'accepted':
+                    if result['tx_id'] != state['tx_id']:
+                        raise SessionError(f"Inconsistent tx_id, got '{result['tx_id']}' "
+                            f"expected '{state['tx_id']}'")
+                    state['when_broadcast'] = when_broadcast
+                    del state['tx_hex']
+                elif failed_result is None:
+                    failed_result = result
+            if failed_result is None:
+                return
+            if failed_result['reason'] != "too-long-mempool-chain":
+                raise SessionError(f"Failed to broadcast transaction "
+                    f"'{failed_result['tx_id']}': {failed_result['reason']}")
+            # The rest of the chain cannot be broadcast.  Block until new coins are ready,
+            # then sign it again.
+            self._wait_for_utxo_split()
+            self._sign_push_groups(push_groups, push_groups_state)
 
+    def _process_push_groups(self, push_groups, push_groups_state):
+        self._sign_push_groups(push_groups, push_groups_state)
+        self._broadcast_push_groups(push_groups, push_groups_state)
+        for i, state in enumerate(push_groups_state):
             if 'in_mempool' not in state:
                 print(f"Looking for transaction {i+1}/{len(push_groups)} in mempool")
                 attempts = 0
@@ -260,7 +307,8 @@ class BroadcastSession:
                     attempts += 1
                 if attempts == 10:
                     print("Cleared broadcast state for transaction {i+1}/{len(push_groups)}")
-                    del state['tx_id']
+                    # The next attempt signs this and the transactions after it again.
+                    state.clear()
                     raise SessionError(f"Failed to find transaction in mempool '{tx_id}'")
 
                 state['in_mempool'] = True